@@ -0,0 +1,253 @@
+# === Almacén compartido de tablas en memoria (appretail) ===
+# Con @st.cache_data cada sesión recibía su propia copia (pickle) de las tablas y la caché
+# no se renovaba nunca. El almacén las carga una vez por proceso, todas las sesiones leen
+# el mismo DataFrame (no se modifica en su lugar: cada refresco publica uno nuevo) y se
+# mantienen al día de forma incremental:
+#
+# - Sello de information_schema.TABLES (como cache_resultados): si no cambió, no se consulta.
+# - Filas nuevas: clave primaria mayor que la última vista (empleado_id > ...).
+# - Filas modificadas: si la tabla tiene una columna de marca de tiempo (actualizado_en,
+#   updated_at...), las que cambiaron desde la última marca; se reemplazan por clave.
+# - Borrados: se comparan COUNT(*) y SUM(clave) de MySQL con los del DataFrame (un alta más
+#   un borrado dejan igual el conteo, no la suma). Si no cuadran, si el sello cambió sin
+#   traer filas (borrado o cambio que la consulta no ve) o si pasó RECARGA_COMPLETA, se
+#   recarga entera.
+#
+# Cada cambio de una tabla le da una versión nueva; `cambios_desde` entrega las filas
+# quitadas/agregadas desde una versión para mantener agregados derivados sin recalcularlos.
+#
+# Las columnas se compactan: texto repetitivo como category y números reducidos.
+
+import re
+import threading
+import time
+from collections import deque
+
+import pandas as pd
+from sqlalchemy import text
+
+from cache_resultados import sellos_version
+from prompt_esquema import leer_esquema
+
+INTERVALO_REFRESCO = 60  # Segundos entre comprobaciones de cambios
+RECARGA_COMPLETA = 6 * 3600  # Sin columna de marca las modificaciones solo se ven al recargar
+CATEGORICAS = ("provincia", "cargo", "estado_civil", "nivel_socioeconomico")
+MAX_CAMBIOS = 32  # Refrescos incrementales que se recuerdan por tabla (ver cambios_desde)
+MAX_PROPORCION_CATEGORIA = 0.5  # Otras columnas de texto: category si repiten valores
+_PATRON_MARCA = re.compile(r"actualiz|modific|updated|modified|changed|ultima_", re.IGNORECASE)
+_TIPOS_MARCA = {"timestamp", "datetime"}
+
+
+def convertir_objetos(df):
+    """Columnas object de Decimal o date (como las entrega pd.read_sql) a float64/datetime."""
+    for i in range(df.shape[1]):
+        serie = df.iloc[:, i]
+        if pd.api.types.is_object_dtype(serie.dtype):
+            tipo = pd.api.types.infer_dtype(serie, skipna=True)
+            if tipo == "decimal":  # DECIMAL de MySQL llega como objetos Decimal
+                df.isetitem(i, serie.astype("float64"))
+            elif tipo == "date":
+                df.isetitem(i, pd.to_datetime(serie, errors="coerce"))
+    return df
+
+
+def compactar(df):
+    """Texto repetitivo como category, Decimal/date como float/datetime y números con el dtype
+    más pequeño que los representa sin pérdida."""
+    convertir_objetos(df)
+    for i, columna in enumerate(df.columns):
+        serie = df.iloc[:, i]
+        if pd.api.types.is_integer_dtype(serie.dtype):
+            df.isetitem(i, pd.to_numeric(serie, downcast="integer"))
+        elif pd.api.types.is_float_dtype(serie.dtype):
+            reducida = serie.astype("float32")
+            if reducida.astype("float64").equals(serie):  # Solo si no cambia ningún valor
+                df.isetitem(i, reducida)
+        elif pd.api.types.is_object_dtype(serie.dtype) or pd.api.types.is_string_dtype(serie.dtype):
+            if isinstance(serie.dtype, pd.CategoricalDtype):
+                continue
+            if columna in CATEGORICAS or (len(serie) and serie.nunique() <= MAX_PROPORCION_CATEGORIA * len(serie)):
+                df.isetitem(i, serie.astype("category"))
+    return df
+
+
+def _clave_y_marca(columnas_esquema):
+    """Clave primaria (si es de una sola columna) y columna de marca de modificación, o None."""
+    primarias = [c["nombre"] for c in columnas_esquema if c["clave"] == "PRI"]
+    marcas = [c["nombre"] for c in columnas_esquema if c["tipo"] in _TIPOS_MARCA and _PATRON_MARCA.search(c["nombre"])]
+    return (primarias[0] if len(primarias) == 1 else None), (marcas[0] if marcas else None)
+
+
+def _maximo(df, columna):
+    """Máximo de la columna como valor de Python (parámetro SQL), o None."""
+    if columna is None or df.empty:
+        return None
+    valor = df[columna].max()
+    if pd.isna(valor):
+        return None
+    if hasattr(valor, "to_pydatetime"):
+        return valor.to_pydatetime()
+    return valor.item() if hasattr(valor, "item") else valor
+
+
+class AlmacenTablas:
+    """Tablas completas compartidas por el proceso, con refresco incremental en segundo plano."""
+
+    def __init__(self, engine, tablas, intervalo=INTERVALO_REFRESCO):
+        self.engine = engine
+        self.nombres = list(tablas)
+        self.intervalo = intervalo
+        self._lock = threading.Lock()
+        self._lock_refresco = threading.Lock()  # Un solo refresco (o carga inicial) a la vez
+        self._tablas = {}  # nombre -> estado (df, clave, marca, sello, versión...)
+        self._cambios = {}  # nombre -> deque de (versión anterior, versión nueva, quitadas, agregadas)
+        self._version = 0
+        self._refrescando = False
+        self._ultima_comprobacion = 0.0
+        self._estadisticas = {"cargas_completas": 0, "refrescos_incrementales": 0,
+                              "filas_incrementales": 0, "errores": 0, "ultimo_error": None}
+
+    # --- Lectura ---
+    def tablas(self):
+        """DataFrames actuales en el orden pedido. La primera vez carga (bloqueando); después,
+        si venció el intervalo, lanza el refresco en segundo plano y devuelve lo que hay."""
+        with self._lock:
+            cargadas = len(self._tablas) == len(self.nombres)
+        if not cargadas:
+            self.refrescar()  # Errores de la primera carga se propagan a quien llama
+        elif time.time() - self._ultima_comprobacion >= self.intervalo:
+            with self._lock:
+                lanzar = not self._refrescando
+                self._refrescando = True
+            if lanzar:
+                threading.Thread(target=self._refrescar_en_fondo, daemon=True, name="almacen-refresco").start()
+        with self._lock:
+            return tuple(self._tablas[n]["df"] for n in self.nombres)
+
+    def _refrescar_en_fondo(self):
+        try:
+            self.refrescar()
+        except Exception as e:  # Se sigue sirviendo la versión anterior
+            self._estadisticas["errores"] += 1
+            self._estadisticas["ultimo_error"] = str(e)
+        finally:
+            with self._lock:
+                self._refrescando = False
+
+    # --- Refresco ---
+    def refrescar(self):
+        """Comprueba cada tabla y aplica los cambios (incrementales o recarga completa)."""
+        with self._lock_refresco:
+            esquema = leer_esquema(self.engine)["tablas"]
+            for nombre in self.nombres:
+                with self._lock:
+                    estado = self._tablas.get(nombre)
+                with self.engine.connect() as conexion:
+                    sello = sellos_version(conexion, f"SELECT * FROM {nombre}")
+                    if estado is None or time.time() - estado["cargada"] >= RECARGA_COMPLETA:
+                        clave, marca = _clave_y_marca(esquema.get(nombre, []))
+                        nuevo = self._cargar(conexion, nombre, clave, marca, sello)
+                    elif sello is not None and sello == estado["sello"]:
+                        continue
+                    else:
+                        nuevo = self._incremental(conexion, estado, sello)
+                delta = nuevo.pop("delta", None)
+                with self._lock:
+                    self._version += 1
+                    nuevo["version"] = self._version
+                    if delta is None:  # Recarga completa: quien derive datos debe reconstruirlos
+                        self._cambios.pop(nombre, None)
+                    else:
+                        self._cambios.setdefault(nombre, deque(maxlen=MAX_CAMBIOS)).append(
+                            (estado["version"], nuevo["version"]) + delta)
+                    self._tablas[nombre] = nuevo
+            self._ultima_comprobacion = time.time()
+
+    def _cargar(self, conexion, nombre, clave, marca, sello):
+        df = compactar(pd.read_sql(text(f"SELECT * FROM `{nombre}`"), conexion))
+        self._estadisticas["cargas_completas"] += 1
+        return {"nombre": nombre, "df": df, "clave": clave, "marca": marca, "sello": sello,
+                "cargada": time.time(), "ultima_clave": _maximo(df, clave), "ultima_marca": _maximo(df, marca)}
+
+    def _incremental(self, conexion, estado, sello):
+        nombre, clave, marca = estado["nombre"], estado["clave"], estado["marca"]
+        if clave is None:
+            return self._cargar(conexion, nombre, clave, marca, sello)
+        condiciones, parametros = [], {}
+        if estado["ultima_clave"] is not None:
+            condiciones.append(f"`{clave}` > :ultima_clave")
+            parametros["ultima_clave"] = estado["ultima_clave"]
+        if estado["ultima_marca"] is not None:
+            # '>=' porque varias filas pueden compartir la última marca vista
+            condiciones.append(f"`{marca}` >= :ultima_marca")
+            parametros["ultima_marca"] = estado["ultima_marca"]
+        sql = f"SELECT * FROM `{nombre}`" + (" WHERE " + " OR ".join(condiciones) if condiciones else "")
+        # Con los mismos tipos que el DataFrame: si no, al unirlos quedaría object con float y Decimal
+        cambios = convertir_objetos(pd.read_sql(text(sql), conexion, params=parametros))
+        if cambios.empty and sello is not None:  # El sello cambió sin filas nuevas ni marcadas: borrados u otros
+            return self._cargar(conexion, nombre, clave, marca, sello)
+        df = estado["df"]
+        numerica = pd.api.types.is_numeric_dtype(df[clave].dtype)
+        suma = f"SUM(`{clave}`)" if numerica else "NULL"
+        total, suma_clave = conexion.execute(text(f"SELECT COUNT(*), {suma} FROM `{nombre}`")).one()
+
+        reemplazadas = df[df[clave].isin(cambios[clave])]
+        if not cambios.empty:
+            # Las category de cada parte tienen categorías distintas: se unen como texto y se recompacta
+            df = df[~df[clave].isin(cambios[clave])]
+            df = df.astype({c: "object" for c in df.select_dtypes("category").columns})
+            df = compactar(pd.concat([df, cambios], ignore_index=True).sort_values(clave, ignore_index=True))
+        if len(df) != total or (numerica and int(suma_clave or 0) != int(df[clave].sum())):
+            return self._cargar(conexion, nombre, clave, marca, sello)  # Hubo borrados: no se ven de forma incremental
+        self._estadisticas["refrescos_incrementales"] += 1
+        self._estadisticas["filas_incrementales"] += len(cambios)
+        return dict(estado, df=df, sello=sello, ultima_clave=_maximo(df, clave), ultima_marca=_maximo(df, marca),
+                    delta=(reemplazadas, cambios))
+
+    def cambios_desde(self, nombre, version):
+        """(versión actual, DataFrame actual, [(quitadas, agregadas), ...]) de la tabla.
+
+        La lista trae los cambios aplicados desde `version`, en orden; es None si no se pueden
+        reconstruir (primera vez, recarga completa o demasiados refrescos atrás) y hay que
+        recalcular desde el DataFrame completo.
+        """
+        with self._lock:
+            estado = self._tablas[nombre]
+            deltas, actual = [], version
+            for anterior, nueva, quitadas, agregadas in self._cambios.get(nombre, ()):
+                if anterior == actual:
+                    deltas.append((quitadas, agregadas))
+                    actual = nueva
+            return estado["version"], estado["df"], deltas if actual == estado["version"] else None
+
+    def clave(self, nombre):
+        """Columna de clave primaria con la que se identifican las filas de `cambios_desde`."""
+        with self._lock:
+            return self._tablas[nombre]["clave"]
+
+    # --- Métricas ---
+    def memoria(self):
+        """Bytes que ocupa cada tabla en memoria (incluido el texto de las columnas object)."""
+        with self._lock:
+            return {n: int(e["df"].memory_usage(index=True, deep=True).sum()) for n, e in self._tablas.items()}
+
+    def estadisticas(self):
+        """Filas y memoria por tabla, y contadores de cargas y refrescos."""
+        memoria = self.memoria()
+        with self._lock:
+            filas = {n: len(e["df"]) for n, e in self._tablas.items()}
+        return dict(self._estadisticas, filas=filas, memoria=memoria, bytes_total=sum(memoria.values()),
+                    ultima_comprobacion=self._ultima_comprobacion)
+
+
+_almacenes = {}
+_lock = threading.Lock()
+
+
+def obtener_almacen(engine, tablas):
+    """Almacén compartido para la base de datos del engine (uno por URL y lista de tablas)."""
+    clave = (str(engine.url), tuple(tablas))
+    with _lock:
+        if clave not in _almacenes:
+            _almacenes[clave] = AlmacenTablas(engine, tablas)
+        return _almacenes[clave]
@@ -6,9 +6,17 @@ st.set_page_config(page_title="Demo Aseguradora Inteligente con LLM", layout="wi
 import pandas as pd
 import requests
 import pymysql
-from sqlalchemy import create_engine
-import matplotlib.pyplot as plt
+from conexion_db import obtener_engine
+from cliente_llm import cliente_global as cliente_llm
+from planificador_llm import planificador_global as planificador_llm, establecer_sesion # Cola compartida de llamadas al LLM
+from graficos import servicio_graficos # Gráficos sin pyplot, cacheados como PNG
+import trazas # Tiempos por etapa: log JSONL, métricas Prometheus y panel de diagnóstico
+import paginacion # Visor paginado por clave (las páginas se piden a MySQL)
+import almacen_datos # Tablas compartidas por todas las sesiones, con refresco incremental
+import resumen_empleados # Resumen de empleados con agregados incrementales
+import indice_hechos # Hechos por empresa, producto y recomendación, recuperados por pregunta (BM25)
 import re # For regular expressions
+import uuid
 
 # ----------------------------------------
 # 1. CONFIGURACION DE CONEXION A LA BASE DE DATOS
@@ -19,17 +27,23 @@ DB_HOST = 'localhost'
 DB_PORT = '3306'
 DB_NAME = 'demo_aseguradora'
 
-engine = create_engine(f'mysql+pymysql://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}')
+# Engine con pool compartido por todas las sesiones del proceso (no se recrea en cada rerun)
+engine = obtener_engine(f'mysql+pymysql://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}')
 
 # ----------------------------------------
 # 2. CARGAR LAS TRES TABLAS
 # ----------------------------------------
-@st.cache_data
+# Process-wide store: loaded once, shared by every session and refreshed incrementally
+almacen = almacen_datos.obtener_almacen(engine, ["empresas_empleados", "productos_ofrecibles", "recomendaciones_empresa_producto"])
+
 def cargar_datos():
+    # Solo la primera carga del proceso consulta la BD; después es el refresco en segundo plano
     try:
-        df_empleados = pd.read_sql("SELECT * FROM empresas_empleados", con=engine)
-        df_productos = pd.read_sql("SELECT * FROM productos_ofrecibles", con=engine)
-        df_recomendaciones = pd.read_sql("SELECT * FROM recomendaciones_empresa_producto", con=engine)
+        with trazas.tramo("cargar_datos") as tramo:
+            df_empleados, df_productos, df_recomendaciones = almacen.tablas()
+            tablas = (df_empleados, df_productos, df_recomendaciones)
+            tramo["filas"] = sum(len(df) for df in tablas)
+            tramo["bytes"] = almacen.estadisticas()["bytes_total"]
         return df_empleados, df_productos, df_recomendaciones
     except Exception as e:
         st.error(f"Error al cargar datos desde la base de datos: {e}")
@@ -41,80 +55,20 @@ df_empleados, df_productos, df_recomendaciones = cargar_datos()
 # ----------------------------------------
 # 3. FUNCION DE RESUMENES ESPECIFICOS (Your existing function)
 # ----------------------------------------
+MAX_EMPRESAS_RESUMEN = 50 # With more companies, per-company lines come from the fact index instead
+TOP_K_HECHOS = 20 # Facts retrieved per question
+PRESUPUESTO_TOKENS_HECHOS = 1200 # Token budget for the retrieved facts
+
 def construir_resumen_dinamico():
-    resumen = []
     if df_empleados.empty:
         return "No hay datos de empleados para generar resúmenes."
+    # Aggregates are updated with only the new/changed rows; the text is cached per table version
+    return resumen_empleados.obtener_resumen(almacen).texto(max_empresas=MAX_EMPRESAS_RESUMEN)
 
-    # 1. Salario y edad promedio por empresa
-    resumen_empresas = (
-        df_empleados.groupby("nombre_empresa")
-        .agg(salario_promedio=('salario_estimado', 'mean'), edad_promedio=('edad', 'mean'))
-        .round(0)
-        .reset_index()
-    )
-    resumen.append("\nSalario y edad promedio por empresa:")
-    for _, row in resumen_empresas.iterrows():
-        resumen.append(f"- {row.nombre_empresa}: salario promedio ${row.salario_promedio:,.0f}, edad promedio {row.edad_promedio:.0f} años") # Formatted numbers
-
-    # 2. Empresas con empleados casados y mayores de 40
-    if not df_empleados.empty:
-        filtro_casados = df_empleados[(df_empleados.estado_civil == 'casado') & (df_empleados.edad > 40)]
-        if not filtro_casados.empty:
-            empresas_casados_40 = filtro_casados['nombre_empresa'].value_counts().index.tolist()
-            resumen.append("\nEmpresas con empleados casados y mayores de 40 años (ejemplos):")
-            resumen.extend([f"- {e}" for e in empresas_casados_40[:5]]) # Limit for brevity
-        else:
-            resumen.append("\nNo se encontraron empresas con un número significativo de empleados casados y mayores de 40 años.")
-    else:
-        resumen.append("\nNo hay datos de empleados para analizar estado civil y edad por empresa.")
-
-
-    # 3. Cargos más comunes entre nivel medio-alto
-    if not df_empleados.empty:
-        empleados_medio_alto = df_empleados[df_empleados.nivel_socioeconomico == 'medio-alto']
-        if not empleados_medio_alto.empty:
-            cargos_comunes = (
-                empleados_medio_alto['cargo']
-                .value_counts()
-                .head(5)
-                .to_dict()
-            )
-            resumen.append("\nCargos más comunes entre empleados de nivel socioeconómico medio-alto:")
-            for cargo, count in cargos_comunes.items():
-                resumen.append(f"- {cargo}: {count} empleados")
-        else:
-            resumen.append("\nNo se encontraron empleados de nivel socioeconómico medio-alto.")
-    else:
-        resumen.append("\nNo hay datos de empleados para analizar cargos comunes por nivel socioeconómico.")
-
-
-    # 4. Provincias con salario promedio > $2500
-    if not df_empleados.empty:
-        salario_provincia = (
-            df_empleados.groupby("provincia")['salario_estimado'].mean().reset_index()
-        )
-        provincias_altos = salario_provincia[salario_provincia.salario_estimado > 2500]['provincia'].tolist()
-        if provincias_altos:
-            resumen.append("\nProvincias con salario promedio mayor a $2500:")
-            resumen.extend([f"- {p}" for p in provincias_altos])
-        else:
-            resumen.append("\nNinguna provincia tiene un salario promedio mayor a $2500 según los datos.")
-    else:
-        resumen.append("\nNo hay datos de empleados para analizar salarios por provincia.")
-
-    # 5. Empresa con mayor diversidad de cargos
-    if not df_empleados.empty and 'nombre_empresa' in df_empleados.columns and 'cargo' in df_empleados.columns:
-        diversidad = df_empleados.groupby("nombre_empresa")['cargo'].nunique().sort_values(ascending=False)
-        if not diversidad.empty:
-            top_empresa = diversidad.idxmax()
-            resumen.append(f"\nEmpresa con mayor diversidad de cargos: {top_empresa} ({diversidad.max()} cargos únicos)")
-        else:
-            resumen.append("\nNo se pudo determinar la empresa con mayor diversidad de cargos.")
-    else:
-        resumen.append("\nDatos insuficientes o faltan columnas para determinar diversidad de cargos.")
-
-    return "\n".join(resumen)
+def seleccionar_hechos(pregunta):
+    # Company, product and recommendation facts most relevant to the question, within the token budget
+    indice = indice_hechos.obtener_indice(almacen, resumen_empleados.obtener_resumen(almacen))
+    return indice.seleccionar(pregunta, k=TOP_K_HECHOS, presupuesto_tokens=PRESUPUESTO_TOKENS_HECHOS)
 
 # ----------------------------------------
 # 4. FUNCION PARA GENERAR CONTEXTO CON DATOS REALES
@@ -148,48 +102,56 @@ A continuación, se incluye un resumen real basado en los datos actuales:
 # ----------------------------------------
 # 5. FUNCION PARA CONSULTAR A OLLAMA
 # ----------------------------------------
-def consultar_ollama(pregunta, modelo="llama3"):
-    contexto_completo = generar_contexto()
-    prompt = f"{contexto_completo}\n\nPREGUNTA DEL USUARIO: {pregunta}\n\nRESPUESTA:".strip()
-    payload = {
-        "model": modelo,
-        "messages": [
-            {"role": "user", "content": prompt}
-        ],
-        "stream": False
-    }
+MODELO_ASISTENTE = "llama3"
+cliente_llm.calentar_en_segundo_plano(MODELO_ASISTENTE) # Precargar el modelo una vez por proceso
+trazas.iniciar_servidor_metricas() # Solo si PUERTO_METRICAS está definido
+
+def consultar_ollama(pregunta, modelo=MODELO_ASISTENTE):
+    # El contexto (instrucciones + resumen de datos) no cambia entre preguntas: va como mensaje
+    # de sistema idéntico para que Ollama reutilice su caché KV y solo evalúe la pregunta.
+    # Los hechos recuperados para esta pregunta van con ella, en el mensaje del usuario.
+    with trazas.tramo("contexto") as tramo:
+        contexto_completo = generar_contexto().strip()
+        tramo["caracteres"] = len(contexto_completo)
+    with trazas.tramo("hechos") as tramo:
+        try:
+            hechos = seleccionar_hechos(pregunta) if not df_empleados.empty else []
+        except Exception:
+            hechos = [] # Sin índice se responde solo con el resumen
+        tramo["hechos"] = len(hechos)
+    datos_pregunta = ""
+    if hechos:
+        datos_pregunta = "DATOS RELEVANTES PARA LA PREGUNTA:\n" + "\n".join(f"- {h}" for h in hechos) + "\n\n"
+    mensajes = [
+        {"role": "system", "content": contexto_completo},
+        {"role": "user", "content": f"{datos_pregunta}PREGUNTA DEL USUARIO: {pregunta}\n\nRESPUESTA:"}
+    ]
+    aviso_cola = st.empty()
     try:
-        # Increased timeout as LLM generation can be slow
-        response = requests.post("http://localhost:11434/api/chat", json=payload, timeout=120)
-        response.raise_for_status() # Raise an exception for HTTP errors (4xx or 5xx)
-        data = response.json()
-        return data.get("message", {}).get("content", "⚠️ No se encontró contenido en la respuesta.")
+        # Cola compartida del proceso: turnos por sesión, peticiones idénticas servidas una vez y timeout según lo medido
+        contenido = planificador_llm.chat(mensajes, modelo=modelo, al_esperar=lambda posicion, eta: aviso_cola.info(
+            f"⏳ En cola para el modelo: posición {posicion}, empieza en ~{eta:.0f} s"))
+        return contenido or "⚠️ No se encontró contenido en la respuesta."
     except requests.exceptions.Timeout:
         return "❌ Error: La solicitud a Ollama tardó demasiado tiempo en responder (timeout)."
     except requests.exceptions.RequestException as e:
         return f"❌ Error al conectar con Ollama o en la solicitud: {str(e)}"
     except Exception as e: # Catch any other unexpected errors
         return f"❌ Error inesperado al procesar la respuesta de Ollama: {str(e)}"
+    finally:
+        aviso_cola.empty()
 
 # ----------------------------------------
 # 6. FUNCION PARA CREAR GRAFICOS (MATPLOTLIB) - User Provided
 # ----------------------------------------
 def crear_grafico_matplotlib(categorias, valores, etiqueta_categoria, etiqueta_valor, titulo_grafico="Gráfico de Barras"):
+    # Devuelve el PNG del gráfico de barras (cacheado por el servicio compartido) o None
     if not categorias or not valores:
         return None
     if len(categorias) != len(valores):
         return None
 
     try:
-        MAX_CAT_LABEL_LENGTH = 18
-        categorias_display = []
-        for cat in categorias:
-            cat_str = str(cat)
-            if len(cat_str) > MAX_CAT_LABEL_LENGTH:
-                categorias_display.append(cat_str[:MAX_CAT_LABEL_LENGTH-3] + "...")
-            else:
-                categorias_display.append(cat_str)
-        
         valores_numeric = []
         for v in valores:
             try:
@@ -201,7 +163,7 @@ def crear_grafico_matplotlib(categorias, valores, etiqueta_categoria, etiqueta_v
         if not valores_numeric:
             return None
 
-        num_categorias = len(categorias_display)
+        num_categorias = len(categorias)
         
         # --- AJUSTE DE TAMAÑO DEL GRÁFICO Y DPI ---
         # El ancho en pulgadas puede variar un poco con el número de categorías
@@ -214,42 +176,15 @@ def crear_grafico_matplotlib(categorias, valores, etiqueta_categoria, etiqueta_v
         DPI_GRAFICO = 75  # DPI más bajo para una imagen más pequeña en píxeles
         # --- FIN AJUSTE DE TAMAÑO Y DPI ---
         
-        # Aplicar figsize y dpi al crear la figura
-        fig, ax = plt.subplots(figsize=(ancho_pulgadas, alto_pulgadas), dpi=DPI_GRAFICO)
-        
-        bars = ax.bar(categorias_display, valores_numeric, color='mediumseagreen')
-
-        ax.set_title(titulo_grafico, fontsize=8, pad=8) 
-        ax.set_xlabel(etiqueta_categoria, fontsize=7) 
-        ax.set_ylabel(etiqueta_valor, fontsize=7)   
-        
-        rotation_angle = 0
-        horizontal_alignment = 'center'
-        if num_categorias > 3 and ancho_pulgadas < num_categorias * 0.9:
-            rotation_angle = 30
-            horizontal_alignment = 'right'
-        if num_categorias > 5 and ancho_pulgadas < num_categorias * 0.7:
-            rotation_angle = 45
-        if num_categorias > 8 and ancho_pulgadas < num_categorias * 0.5: # Si está muy apretado
-            rotation_angle = 60
-        
-        plt.xticks(rotation=rotation_angle, ha=horizontal_alignment, fontsize=6) 
-        plt.yticks(fontsize=6) 
-
-        if valores_numeric:
-            max_val = max(valores_numeric) if valores_numeric else 0
-            ax.set_ylim(0, (max_val * 1.25) if max_val > 0 else 1) 
-
-            for bar_item in bars:
-                yval = bar_item.get_height()
-                label_text = f'{yval:,.2f}' if isinstance(yval, float) and not yval.is_integer() else f'{yval:,.0f}'
-                ax.text(bar_item.get_x() + bar_item.get_width()/2.0, 
-                        yval + (max_val * 0.02 if max_val > 0 else 0.02), 
-                        label_text, 
-                        ha='center', va='bottom', fontsize=5) 
-        
-        plt.tight_layout(pad=0.4) # Padding ajustado
-        return fig
+        with trazas.tramo("grafico", categorias=num_categorias) as tramo:
+            png = servicio_graficos.renderizar(
+                "barras", categorias, valores_numeric, etiqueta_categoria, etiqueta_valor,
+                tamano=(ancho_pulgadas, alto_pulgadas), dpi=DPI_GRAFICO,
+                color='mediumseagreen', titulo=titulo_grafico, fuente_ejes=7, fuente_ticks=6, fuente_valores=5,
+                rotacion="auto", max_largo_etiqueta=18, pad=0.4,
+            )
+            tramo["bytes"] = len(png)
+            return png
     except Exception as e:
         st.error(f"Error interno al crear gráfico Matplotlib: {e}")
         return None
@@ -349,10 +284,22 @@ if 'respuesta_ollama' not in st.session_state:
     st.session_state.respuesta_ollama = ""
 if 'pregunta_actual' not in st.session_state:
     st.session_state.pregunta_actual = ""
-if 'chart_fig' not in st.session_state: # To store the generated figure object
-    st.session_state.chart_fig = None
+if 'chart_png' not in st.session_state: # PNG bytes of the generated chart (not a live Figure)
+    st.session_state.chart_png = None
 if 'chart_attempted' not in st.session_state: # To know if we tried to make a chart
     st.session_state.chart_attempted = False
+if 'traza' not in st.session_state: # Tiempos por etapa de la última pregunta (panel de diagnóstico)
+    st.session_state.traza = None
+trazas.establecer(st.session_state.traza)
+if 'vista_empleados' not in st.session_state: # Paginated server-side viewer of empresas_empleados
+    st.session_state.vista_empleados = None
+if 'vista_productos' not in st.session_state: # Same for productos_ofrecibles
+    st.session_state.vista_productos = None
+if 'vista_recomendaciones' not in st.session_state: # Same for recomendaciones_empresa_producto
+    st.session_state.vista_recomendaciones = None
+if 'id_sesion' not in st.session_state: # Turno propio en la cola del LLM
+    st.session_state.id_sesion = uuid.uuid4().hex
+establecer_sesion(st.session_state.id_sesion)
 
 
 pregunta_usuario = st.text_area("Escribe tu pregunta:", value=st.session_state.pregunta_actual, height=100, key="pregunta_usuario_ta")
@@ -362,13 +309,14 @@ if st.button("💬 Consultar al Asistente", key="consultar_btn"):
         st.warning("Por favor, escribe una pregunta antes de consultar.")
         st.session_state.respuesta_ollama = ""
         st.session_state.pregunta_actual = ""
-        st.session_state.chart_fig = None
+        st.session_state.chart_png = None
         st.session_state.chart_attempted = False
     else:
         st.session_state.pregunta_actual = pregunta_usuario
         st.session_state.respuesta_ollama = "" # Clear previous
-        st.session_state.chart_fig = None      # Clear previous
+        st.session_state.chart_png = None      # Clear previous
         st.session_state.chart_attempted = True # Mark that we will attempt
+        st.session_state.traza = trazas.iniciar_traza("respuesta", pregunta=pregunta_usuario)
 
         with st.spinner("Consultando a Ollama y procesando respuesta..."):
             respuesta_texto = consultar_ollama(pregunta_usuario)
@@ -376,15 +324,16 @@ if st.button("💬 Consultar al Asistente", key="consultar_btn"):
 
             if "❌ Error" not in respuesta_texto:
                 # Intentar extraer datos y generar el gráfico
-                cats, vals, et_cat, et_val = intentar_extraer_datos_graficables(respuesta_texto)
+                with trazas.tramo("extraer_datos") as tramo:
+                    cats, vals, et_cat, et_val = intentar_extraer_datos_graficables(respuesta_texto)
+                    tramo["categorias"] = len(cats) if cats else 0
                 if cats and vals:
                     # Generar un título para el gráfico basado en la pregunta
                     titulo_grafico = f"Gráfico"
                     # titulo_grafico = f"Visualización para: '{pregunta_usuario[:60]}...'" if pregunta_usuario else "Gráfico de Barras"
-                    fig = crear_grafico_matplotlib(cats, vals, et_cat, et_val, titulo_grafico=titulo_grafico)
-                    st.session_state.chart_fig = fig
+                    st.session_state.chart_png = crear_grafico_matplotlib(cats, vals, et_cat, et_val, titulo_grafico=titulo_grafico)
                 # else:
-                    # st.session_state.chart_fig = None # Already done above
+                    # st.session_state.chart_png = None # Already done above
             # else: Error message will be shown in the response tab
 
 # --- Tabs for Response and Chart ---
@@ -414,10 +363,10 @@ with tab_visualizacion:
     col_izq_espacio, col_grafico, col_der_espacio = st.columns([0.15, 0.7, 0.15]) # 70% del ancho para el gráfico, centrado
 
     with col_grafico: # El gráfico se dibujará en esta columna central
-        if st.session_state.chart_fig:
+        if st.session_state.chart_png:
             # IMPORTANTE: use_container_width=False para que el tamaño del gráfico
             # sea determinado por figsize y dpi de Matplotlib, no por el ancho de la columna.
-            st.pyplot(st.session_state.chart_fig, use_container_width=False)
+            st.image(st.session_state.chart_png, use_container_width=False)
             st.caption("Gráfico generado automáticamente a partir de los datos detectados en la respuesta del asistente.")
         elif st.session_state.chart_attempted and "❌ Error" not in st.session_state.respuesta_ollama:
             st.info("No se pudieron extraer datos adecuados de la respuesta del asistente para generar un gráfico, o la respuesta no contenía un formato de lista graficable.")
@@ -430,23 +379,48 @@ with tab_visualizacion:
 # 9. Visualizar tablas de respaldo (Your existing section)
 # ----------------------------------------
 if not all(df.empty for df in [df_empleados, df_productos, df_recomendaciones]):
-    with st.expander("💾 Ver datos tabulares de respaldo (empleados: primeras 300 filas)"):
-        if not df_empleados.empty:
-            st.subheader("👥 Empleados por Empresa")
-            st.dataframe(df_empleados.head(300), use_container_width=True, height=300)
-        else:
-            st.caption("No hay datos de empleados para mostrar.")
-
-        if not df_productos.empty:
-            st.subheader("📦 Productos Ofrecibles")
-            st.dataframe(df_productos, use_container_width=True, height=300)
-        else:
-            st.caption("No hay datos de productos para mostrar.")
-
-        if not df_recomendaciones.empty:
-            st.subheader("✅ Recomendaciones por Empresa")
-            st.dataframe(df_recomendaciones, use_container_width=True, height=300)
-        else:
-            st.caption("No hay datos de recomendaciones para mostrar.")
+    with st.expander("💾 Ver datos tabulares de respaldo (paginados)"):
+        estado_almacen = almacen.estadisticas()
+        st.caption(f"Almacén compartido: {sum(estado_almacen['filas'].values()):,} filas en "
+                   f"{estado_almacen['bytes_total'] / 1024**2:.1f} MB · {estado_almacen['refrescos_incrementales']} refrescos "
+                   f"incrementales ({estado_almacen['filas_incrementales']:,} filas), "
+                   f"{estado_almacen['cargas_completas']} cargas completas")
+        # Page through each table in MySQL instead of sending it whole to the browser on each rerun
+        for df_tabla, tabla, clave_vista, titulo, vacio in [
+            (df_empleados, "empresas_empleados", "vista_empleados", "👥 Empleados por Empresa", "empleados"),
+            (df_productos, "productos_ofrecibles", "vista_productos", "📦 Productos Ofrecibles", "productos"),
+            (df_recomendaciones, "recomendaciones_empresa_producto", "vista_recomendaciones",
+             "✅ Recomendaciones por Empresa", "recomendaciones"),
+        ]:
+            if df_tabla.empty:
+                st.caption(f"No hay datos de {vacio} para mostrar.")
+                continue
+            st.subheader(titulo)
+            try:
+                vista = st.session_state[clave_vista]
+                if vista is None or (isinstance(vista, paginacion.VistaMemoria) and vista.df is not df_tabla):
+                    vista = paginacion.VistaPaginada(
+                        engine, f"SELECT * FROM {tabla}", df_tabla.columns,
+                        numericas=[c for c, t in df_tabla.dtypes.items() if pd.api.types.is_numeric_dtype(t)],
+                        filas_exactas=len(df_tabla))
+                    if not vista.paginable:
+                        # No primary key to page by: page the store's copy instead (rebuilt when it refreshes)
+                        vista = paginacion.VistaMemoria(df_tabla)
+                    st.session_state[clave_vista] = vista
+                # The store publishes a new DataFrame on each refresh: keep the total in step with it
+                st.session_state[clave_vista].filas_exactas = len(df_tabla)
+                paginacion.mostrar(st.session_state[clave_vista], clave_vista.replace("vista_", ""), altura=300)
+            except Exception as e:
+                st.caption(f"Visor paginado no disponible ({e}); se muestran las primeras 300 filas.")
+                st.dataframe(df_tabla.head(300), use_container_width=True, height=300)
 else:
-    st.warning("Advertencia: No se pudieron cargar los datos de las tablas. El asistente y los resúmenes podrían no funcionar como se espera.")
\ No newline at end of file
+    st.warning("Advertencia: No se pudieron cargar los datos de las tablas. El asistente y los resúmenes podrían no funcionar como se espera.")
+
+# ----------------------------------------
+# 10. Diagnóstico de tiempos de la última pregunta
+# ----------------------------------------
+if st.session_state.traza is not None:
+    traza = st.session_state.traza
+    with st.expander("⏱ Diagnóstico"):
+        st.caption(f"Traza {traza.id} · {traza.duracion_ms() / 1000:.2f} s en total")
+        st.dataframe(pd.DataFrame(trazas.tabla_tramos(traza)), hide_index=True, use_container_width=True)
\ No newline at end of file
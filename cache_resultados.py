@@ -0,0 +1,148 @@
+# === Caché de resultados de consultas SQL ===
+# Guarda los DataFrames devueltos por ejecutar_sql con una clave que combina el SQL
+# normalizado y un "sello de versión" de cada tabla que la consulta toca. Si alguna
+# tabla cambia (INSERT/UPDATE/DELETE), su sello cambia y la entrada deja de valer.
+
+import re
+import threading
+from collections import OrderedDict
+
+from sqlalchemy import bindparam, text
+
+MAX_BYTES = 256 * 1024 * 1024  # Presupuesto de memoria total de la caché
+
+_PATRON_FROM = re.compile(
+    r"\b(?:from|join)\s+([^()]+?)(?=\b(?:where|group|order|having|limit|union|on|using|left|right|inner|"
+    r"outer|cross|natural|join|straight_join)\b|[()]|;|$)",
+    re.IGNORECASE | re.DOTALL,
+)
+_PATRON_TABLA = re.compile(r"^`?(\w+)`?(?:\s*\.\s*`?(\w+)`?)?")
+_PATRON_CADENAS = re.compile(r"('(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.)*\")")
+
+_SQL_SELLOS = text(
+    "SELECT TABLE_NAME, UPDATE_TIME, TABLE_ROWS, AUTO_INCREMENT, DATA_LENGTH, "
+    "COALESCE(UPDATE_TIME >= NOW(), 0) AS en_curso "
+    "FROM information_schema.TABLES "
+    "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME IN :tablas"
+).bindparams(bindparam("tablas", expanding=True))
+
+
+def normalizar_sql(sql):
+    """Minúsculas y espacios colapsados fuera de los literales; sin ';' final."""
+    partes = _PATRON_CADENAS.split(sql.strip().rstrip(";").strip())
+    normalizado = []
+    for i, parte in enumerate(partes):
+        # Las posiciones impares son literales de cadena: se conservan tal cual
+        normalizado.append(parte if i % 2 else " ".join(parte.lower().split()))
+    return "".join(normalizado)
+
+
+def tablas_de_consulta(sql):
+    """Nombres de tabla que aparecen tras FROM/JOIN (sin esquema), en minúsculas.
+
+    Contempla listas separadas por comas ("FROM afiliados a, polizas p").
+    """
+    tablas = set()
+    for m in _PATRON_FROM.finditer(_PATRON_CADENAS.sub("''", sql)):
+        for elemento in m.group(1).split(","):
+            t = _PATRON_TABLA.match(elemento.strip())
+            if t:
+                tablas.add((t.group(2) or t.group(1)).lower())
+    return sorted(tablas)
+
+
+def sellos_version(connection, sql):
+    """Sello de versión por tabla a partir de information_schema.TABLES.
+
+    Combina UPDATE_TIME con filas estimadas, AUTO_INCREMENT y tamaño de datos: así
+    también se detectan escrituras en servidores donde UPDATE_TIME es NULL tras un
+    reinicio. Devuelve None si no se pudo obtener (la consulta no se cachea).
+
+    UPDATE_TIME tiene resolución de un segundo y un UPDATE en sitio no cambia filas,
+    AUTO_INCREMENT ni tamaño: si alguna tabla se escribió en el segundo en curso, otra
+    escritura en ese mismo segundo no cambiaría el sello, así que tampoco se cachea.
+    La caducidad de las estadísticas (MySQL 8) se desactiva al abrir cada conexión
+    (conexion_db).
+    """
+    tablas = tablas_de_consulta(sql)
+    if not tablas:
+        return None
+    try:
+        filas = connection.execute(_SQL_SELLOS, {"tablas": tablas}).fetchall()
+    except Exception:
+        return None
+    if any(fila[5] for fila in filas):
+        return None
+    sellos = {fila[0].lower(): tuple(str(v) for v in fila[1:5]) for fila in filas}
+    # Si la consulta usa una tabla desconocida (vista, alias raro...) no arriesgamos
+    if set(sellos) != set(tablas):
+        return None
+    return tuple(sorted(sellos.items()))
+
+
+def _tamano_df(df):
+    try:
+        return int(df.memory_usage(index=True, deep=True).sum())
+    except Exception:
+        return 0
+
+
+class CacheResultados:
+    """Caché LRU de DataFrames acotada por bytes (no por número de entradas)."""
+
+    def __init__(self, max_bytes=MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entradas = OrderedDict()  # sql normalizado -> (sellos, df, bytes)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+
+    def buscar(self, sql, sellos):
+        """Devuelve el DataFrame cacheado si los sellos coinciden. No modificar el resultado."""
+        if sellos is None:
+            return None
+        clave = normalizar_sql(sql)
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is None or entrada[0] != sellos:
+                if entrada is not None:
+                    self._quitar(clave)  # Los datos cambiaron: la entrada ya no sirve
+                self.fallos += 1
+                return None
+            self._entradas.move_to_end(clave)
+            self.aciertos += 1
+            return entrada[1]
+
+    def guardar(self, sql, sellos, df):
+        if sellos is None or df is None:
+            return
+        tamano = _tamano_df(df)
+        if tamano > self.max_bytes:
+            return  # Un resultado más grande que toda la caché no se guarda
+        clave = normalizar_sql(sql)
+        with self._lock:
+            self._quitar(clave)
+            self._entradas[clave] = (sellos, df, tamano)
+            self._bytes += tamano
+            while self._bytes > self.max_bytes and self._entradas:
+                self._quitar(next(iter(self._entradas)))
+
+    def _quitar(self, clave):
+        entrada = self._entradas.pop(clave, None)
+        if entrada is not None:
+            self._bytes -= entrada[2]
+
+    def estadisticas(self):
+        with self._lock:
+            return {
+                "entradas": len(self._entradas),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "aciertos": self.aciertos,
+                "fallos": self.fallos,
+            }
+
+
+# Instancia compartida por todas las sesiones del proceso
+cache_global = CacheResultados()
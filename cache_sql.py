@@ -0,0 +1,242 @@
+# === Caché semántica pregunta → SQL ===
+# Evita repetir la llamada al LLM cuando los analistas hacen la misma pregunta
+# (o una variante casi idéntica). Se persiste en disco para sobrevivir reinicios.
+
+import json
+import math
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import Counter, OrderedDict
+
+RUTA_CACHE = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache_sql.json")
+MAX_ENTRADAS = 500
+TTL_SEGUNDOS = 7 * 24 * 3600  # Una semana
+UMBRAL_SIMILITUD = 0.9  # Coseno mínimo para aceptar una pregunta "casi igual"
+
+# Palabras que no cambian el significado de la consulta
+PALABRAS_VACIAS = {
+    "a", "al", "con", "de", "del", "el", "en", "es", "la", "las", "lo", "los", "me", "mi",
+    "muestra", "muestrame", "para", "por", "que", "se", "su", "sus", "un", "una", "y", "o",
+    "dame", "quiero", "ver", "cual", "cuales", "favor", "genera", "visualiza", "grafico",
+    "resultados", "hay",
+}
+
+_PATRON_LITERAL = re.compile(r"'([^']*)'|\"([^\"]*)\"")
+
+
+def _quitar_acentos(texto):
+    texto = unicodedata.normalize("NFKD", texto)
+    return "".join(c for c in texto if not unicodedata.combining(c))
+
+
+def extraer_literales(pregunta):
+    """Devuelve los literales entre comillas de la pregunta, en orden de aparición."""
+    return [m.group(1) if m.group(1) is not None else m.group(2) for m in _PATRON_LITERAL.finditer(pregunta)]
+
+
+def normalizar_pregunta(pregunta):
+    """Normaliza mayúsculas, acentos, espacios y literales entre comillas.
+
+    Los literales se sustituyen por marcadores para que "pólizas en 'Florida'" y
+    "pólizas en 'Michigan'" compartan la misma entrada; el SQL se guarda como
+    plantilla y se rellena con los literales de la pregunta nueva.
+    """
+    contador = iter(range(1000))
+    texto = _PATRON_LITERAL.sub(lambda _: f" lit{next(contador)} ", pregunta)
+    texto = _quitar_acentos(texto.lower())
+    texto = re.sub(r"[^\w\s]", " ", texto)
+    return " ".join(texto.split())
+
+
+def _tokens(pregunta_normalizada):
+    tokens = []
+    for palabra in pregunta_normalizada.split():
+        if palabra in PALABRAS_VACIAS:
+            continue
+        # Stemming mínimo para igualar singular/plural ("poliza"/"polizas")
+        if len(palabra) > 4 and palabra.endswith("es"):
+            palabra = palabra[:-2]
+        elif len(palabra) > 3 and palabra.endswith("s"):
+            palabra = palabra[:-1]
+        tokens.append(palabra)
+    return Counter(tokens)
+
+
+def _coseno(a, b):
+    comunes = set(a) & set(b)
+    if not comunes:
+        return 0.0
+    producto = sum(a[t] * b[t] for t in comunes)
+    norma = math.sqrt(sum(v * v for v in a.values())) * math.sqrt(sum(v * v for v in b.values()))
+    return producto / norma if norma else 0.0
+
+
+def _sql_a_plantilla(sql, literales):
+    """Sustituye en el SQL los literales de la pregunta por marcadores {{L0}}, {{L1}}..."""
+    plantilla = sql
+    for i, literal in enumerate(literales):
+        if not literal:
+            return None
+        patron = re.compile(r"'" + re.escape(literal) + r"'", re.IGNORECASE)
+        if not patron.search(plantilla):
+            return None  # Si algún literal no aparece en el SQL no es seguro reutilizarlo
+        plantilla = patron.sub("{{L%d}}" % i, plantilla)
+    return plantilla
+
+
+def _rellenar_plantilla(plantilla, literales):
+    sql = plantilla
+    for i, literal in enumerate(literales):
+        sql = sql.replace("{{L%d}}" % i, "'" + literal.replace("'", "''") + "'")
+    return sql
+
+
+class CacheSQL:
+    """Caché LRU con TTL y búsqueda por similitud de preguntas normalizadas."""
+
+    def __init__(self, ruta=RUTA_CACHE, max_entradas=MAX_ENTRADAS, ttl=TTL_SEGUNDOS, umbral=UMBRAL_SIMILITUD):
+        self.ruta = ruta
+        self.max_entradas = max_entradas
+        self.ttl = ttl
+        self.umbral = umbral
+        self._entradas = OrderedDict()  # clave normalizada -> {"sql", "creado", "literales"}
+        self._indice = {}  # token -> set(claves), índice invertido para la búsqueda aproximada
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.aciertos_similares = 0
+        self.fallos = 0
+        self._cargar()
+
+    # --- Persistencia ---
+    def _cargar(self):
+        if not self.ruta or not os.path.exists(self.ruta):
+            return
+        try:
+            with open(self.ruta, "r", encoding="utf-8") as f:
+                datos = json.load(f)
+        except (OSError, ValueError):
+            return
+        for clave, entrada in datos.get("entradas", []):
+            self._insertar(clave, entrada)
+        self._purgar()
+
+    def _guardar(self):
+        if not self.ruta:
+            return
+        temporal = self.ruta + ".tmp"
+        try:
+            with open(temporal, "w", encoding="utf-8") as f:
+                json.dump({"entradas": list(self._entradas.items())}, f, ensure_ascii=False)
+            os.replace(temporal, self.ruta)
+        except OSError:
+            pass  # La caché es una optimización; un fallo de disco no debe romper la app
+
+    # --- Índice ---
+    def _insertar(self, clave, entrada):
+        self._entradas[clave] = entrada
+        self._entradas.move_to_end(clave)
+        for token in _tokens(clave):
+            self._indice.setdefault(token, set()).add(clave)
+
+    def _eliminar(self, clave):
+        self._entradas.pop(clave, None)
+        for token in _tokens(clave):
+            claves = self._indice.get(token)
+            if claves:
+                claves.discard(clave)
+                if not claves:
+                    del self._indice[token]
+
+    def _purgar(self):
+        ahora = time.time()
+        for clave in [c for c, e in self._entradas.items() if ahora - e["creado"] > self.ttl]:
+            self._eliminar(clave)
+        while len(self._entradas) > self.max_entradas:
+            self._eliminar(next(iter(self._entradas)))
+
+    def _buscar_similar(self, clave, num_literales):
+        tokens = _tokens(clave)
+        candidatos = set()
+        for token in tokens:
+            candidatos |= self._indice.get(token, set())
+        mejor, mejor_puntaje = None, 0.0
+        for candidato in candidatos:
+            if self._entradas[candidato]["literales"] != num_literales:
+                continue
+            # Los números ("50 años", "2023") cambian la consulta: deben coincidir exactamente
+            if re.findall(r"\d+", candidato) != re.findall(r"\d+", clave):
+                continue
+            # Una sola palabra distinta puede invertir la pregunta ("procesados" / "pendientes")
+            # con un coseno alto: solo se aceptan variantes de orden, plural o palabras vacías
+            tokens_candidato = _tokens(candidato)
+            if set(tokens_candidato) != set(tokens):
+                continue
+            puntaje = _coseno(tokens, tokens_candidato)
+            if puntaje > mejor_puntaje:
+                mejor, mejor_puntaje = candidato, puntaje
+        return mejor if mejor_puntaje >= self.umbral else None
+
+    # --- API pública ---
+    def buscar(self, pregunta):
+        """(SQL cacheado, clave de la entrada usada) para la pregunta o una casi idéntica, o
+        (None, None). La clave es la que hay que pasar a `invalidar` si ese SQL falla."""
+        clave = normalizar_pregunta(pregunta)
+        literales = extraer_literales(pregunta)
+        with self._lock:
+            self._purgar()
+            encontrada = clave if clave in self._entradas else None
+            if encontrada is None:
+                encontrada = self._buscar_similar(clave, len(literales))
+                if encontrada is not None:
+                    self.aciertos_similares += 1
+            if encontrada is None:
+                self.fallos += 1
+                return None, None
+            self.aciertos += 1
+            self._entradas.move_to_end(encontrada)
+            return _rellenar_plantilla(self._entradas[encontrada]["sql"], literales), encontrada
+
+    def guardar(self, pregunta, sql):
+        literales = extraer_literales(pregunta)
+        plantilla = _sql_a_plantilla(sql, literales)
+        if plantilla is None:
+            return
+        clave = normalizar_pregunta(pregunta)
+        with self._lock:
+            self._eliminar(clave)
+            self._insertar(clave, {"sql": plantilla, "creado": time.time(), "literales": len(literales)})
+            self._purgar()
+            self._guardar()
+
+    def invalidar(self, pregunta, clave=None):
+        """Elimina la entrada de una pregunta (por ejemplo, si su SQL falló al ejecutarse).
+
+        `clave` es la entrada que devolvió `buscar`: con un acierto por similitud no coincide
+        con la pregunta normalizada, y sin ella el SQL fallido se seguiría sirviendo.
+        """
+        claves = {normalizar_pregunta(pregunta)} | ({clave} if clave else set())
+        with self._lock:
+            quitadas = [c for c in claves if c in self._entradas]
+            for c in quitadas:
+                self._eliminar(c)
+            if quitadas:
+                self._guardar()
+
+    def estadisticas(self):
+        with self._lock:
+            total = self.aciertos + self.fallos
+            return {
+                "entradas": len(self._entradas),
+                "aciertos": self.aciertos,
+                "aciertos_similares": self.aciertos_similares,
+                "fallos": self.fallos,
+                "tasa_aciertos": (self.aciertos / total) if total else 0.0,
+            }
+
+
+# Instancia compartida por todas las sesiones del proceso (los módulos importados
+# no se re-ejecutan en cada rerun de Streamlit).
+cache_global = CacheSQL()
@@ -0,0 +1,147 @@
+# === SQL por candidatos: generación en paralelo, validación con EXPLAIN y reparación ===
+# Un SQL generado que falla (p. ej. YEAR() sobre una columna de texto) obligaba al usuario
+# a reformular y pagar otra vuelta completa al LLM.
+#
+# - `generar_validada` pide varias consultas a la vez (distintas temperaturas o modelos),
+#   valida cada una con EXPLAIN según van llegando y se queda con la válida de la variante
+#   preferida (la primera de la lista, normalmente la de menor temperatura): una variante
+#   posterior válida solo gana si las anteriores ya fallaron. Las que quedan se cancelan
+#   (la cola del planificador corta su generación si nadie la espera).
+# - `reparar` devuelve al LLM la consulta fallida con el mensaje de error de MySQL para
+#   un único intento de corrección.
+
+import contextvars
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import trazas
+from guardia_sql import explicar
+
+INTERVALO_AVISO = 0.5  # Segundos entre actualizaciones de la posición en cola
+MAX_WORKERS = 16  # Hilos propios: esperan al LLM y no deben ocupar el pool del pipeline
+
+executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="candidatos")
+
+
+def limpiar_sql(texto):
+    """Quita las marcas ```sql y deja un único ';' final ("" si no queda nada)."""
+    sql = texto.replace('```sql', '').replace('```', '').strip()
+    while sql.endswith(';'):
+        sql = sql[:-1].strip()
+    return sql + ';' if sql else ""
+
+
+def validar(engine, sql):
+    """None si MySQL acepta la consulta (EXPLAIN sin ejecutarla), o el mensaje de error."""
+    if not sql.lower().startswith(("select", "with")):
+        return "No es una consulta SELECT."
+    try:
+        with engine.connect() as connection:
+            explicar(connection, sql)
+        return None
+    except Exception as e:
+        return str(e)
+
+
+def _generar(planificador, mensajes, modelo, temperatura, detener, avisos, indice):
+    with trazas.tramo("sql.candidato", modelo=modelo, temperatura=temperatura) as tramo:
+        metrica = {}
+        partes = []
+
+        def al_esperar(posicion, eta):
+            avisos[indice] = (posicion, eta)
+
+        try:
+            for fragmento in planificador.chat_stream(mensajes, modelo=modelo, opciones={"temperature": temperatura},
+                                                      al_esperar=al_esperar, al_terminar=metrica.update,
+                                                      cancelar=detener):
+                avisos.pop(indice, None)
+                partes.append(fragmento)
+        finally:
+            avisos.pop(indice, None)
+        if detener.is_set():
+            tramo["cancelado"] = True  # Otro candidato ya pasó la validación
+            return None
+        return {"modelo": modelo, "temperatura": temperatura, "texto": "".join(partes), "metrica": metrica}
+
+
+def generar_validada(planificador, engine, mensajes, variantes, al_esperar=None):
+    """Pide un candidato por cada (modelo, temperatura) y devuelve el válido (pasa EXPLAIN)
+    de la variante que aparece antes en la lista, sin esperar a las posteriores.
+
+    Devuelve {"texto", "sql", "modelo", "temperatura", "metrica", "error", "candidatos"}:
+    si ninguno es válido, el primero que llegó con su error (para que la ejecución lo
+    muestre o lo repare). Lanza la excepción del LLM si todos los candidatos fallaron.
+    `al_esperar` se llama desde el hilo que invoca, con la mejor posición en cola.
+    """
+    detener = threading.Event()
+    avisos = {}
+    futuros = {executor.submit(contextvars.copy_context().run, _generar, planificador, mensajes, modelo,
+                               temperatura, detener, avisos, i): i
+               for i, (modelo, temperatura) in enumerate(variantes)}
+    pendientes = set(futuros)
+    validos = {}  # índice de la variante -> candidato válido
+    descartados = []
+    ultimo_aviso = None
+    error_llm = None
+    try:
+        while pendientes:
+            hechos, pendientes = wait(pendientes, timeout=INTERVALO_AVISO, return_when=FIRST_COMPLETED)
+            if al_esperar is not None and avisos:
+                posicion, eta = min(list(avisos.values()))
+                if (posicion, round(eta)) != ultimo_aviso:
+                    ultimo_aviso = (posicion, round(eta))
+                    al_esperar(posicion, eta)
+            for futuro in hechos:
+                try:
+                    candidato = futuro.result()
+                except Exception as e:
+                    error_llm = error_llm or e
+                    continue
+                if candidato is None:
+                    continue
+                candidato["sql"] = limpiar_sql(candidato["texto"])
+                with trazas.tramo("sql.validacion", temperatura=candidato["temperatura"]) as tramo:
+                    candidato["error"] = validar(engine, candidato["sql"]) if candidato["sql"] else "Respuesta vacía."
+                    tramo["valido"] = candidato["error"] is None
+                if candidato["error"] is None:
+                    validos[futuros[futuro]] = candidato
+                else:
+                    descartados.append(candidato)
+            if validos:
+                mejor = min(validos)
+                # Sirve en cuanto ninguna variante preferida a ella sigue generando
+                if all(futuros[f] > mejor for f in pendientes):
+                    validos[mejor]["candidatos"] = len(futuros) - len(pendientes)
+                    return validos[mejor]
+    finally:
+        detener.set()  # Los candidatos que siguen generando se cancelan
+    if descartados:
+        primero = descartados[0]
+        primero["candidatos"] = len(descartados)
+        return primero
+    if error_llm is not None:
+        raise error_llm
+    return {"texto": "", "sql": "", "modelo": None, "temperatura": None, "metrica": {}, "error": "Sin respuesta.",
+            "candidatos": 0}
+
+
+def mensajes_reparacion(mensajes, sql, error):
+    """Conversación original + la consulta fallida + el error, pidiendo solo la corrección."""
+    return list(mensajes) + [
+        {"role": "assistant", "content": sql},
+        {"role": "user", "content": (
+            f"La consulta anterior falló en MySQL con este error:\n{error}\n\n"
+            "Corrígela respetando los tipos de las columnas del esquema (por ejemplo, no uses YEAR() "
+            "ni funciones de fecha sobre columnas de texto). Devuelve solo la consulta SQL corregida, "
+            "sin explicaciones.")},
+    ]
+
+
+def reparar(planificador, mensajes, modelo, sql, error):
+    """Un intento de corrección: el SQL reparado (limpio) o "" si el modelo devolvió lo mismo o nada."""
+    with trazas.tramo("sql.reparacion", modelo=modelo) as tramo:
+        texto = planificador.chat(mensajes_reparacion(mensajes, sql, error), modelo=modelo, opciones={"temperature": 0})
+        reparado = limpiar_sql(texto)
+        tramo["cambiado"] = bool(reparado) and reparado != limpiar_sql(sql)
+    return reparado if tramo["cambiado"] else ""
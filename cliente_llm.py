@@ -0,0 +1,165 @@
+# === Cliente compartido para Ollama ===
+# Un único cliente por proceso con sesión HTTP persistente (keep-alive TCP), parámetro
+# keep_alive para que Ollama no descargue el modelo entre preguntas, precalentamiento
+# al arrancar, reintentos acotados con backoff y métricas de cada llamada.
+#
+# La URL se puede cambiar con la variable de entorno OLLAMA_URL (por ejemplo, para
+# apuntar a un servidor /api/chat de prueba en local).
+
+import json
+import os
+import threading
+import time
+from collections import deque
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import trazas
+
+OLLAMA_URL = os.environ.get("OLLAMA_URL", "http://localhost:11434")
+KEEP_ALIVE = "30m"  # Tiempo que Ollama mantiene el modelo cargado tras la última petición
+MAX_REINTENTOS = 2
+BACKOFF_SEGUNDOS = 0.5  # Espera base; se duplica en cada reintento
+TAMANO_POOL_HTTP = 10
+METRICAS_GUARDADAS = 200
+
+
+class ClienteOllama:
+    def __init__(self, url=OLLAMA_URL, keep_alive=KEEP_ALIVE, max_reintentos=MAX_REINTENTOS,
+                 backoff=BACKOFF_SEGUNDOS, tamano_pool=TAMANO_POOL_HTTP):
+        self.url = url.rstrip("/")
+        self.keep_alive = keep_alive
+        self.max_reintentos = max_reintentos
+        self.backoff = backoff
+        self.sesion = requests.Session()
+        adaptador = HTTPAdapter(pool_connections=tamano_pool, pool_maxsize=tamano_pool)
+        self.sesion.mount("http://", adaptador)
+        self.sesion.mount("https://", adaptador)
+        self.metricas = deque(maxlen=METRICAS_GUARDADAS)
+        self._calentados = set()
+        self._lock = threading.Lock()
+
+    # --- Envío con reintentos ---
+    def _post(self, payload, timeout, stream):
+        """POST a /api/chat reintentando errores de conexión y 5xx (antes de recibir datos)."""
+        intento = 0
+        while True:
+            try:
+                respuesta = self.sesion.post(f"{self.url}/api/chat", json=payload, stream=stream, timeout=timeout)
+            except requests.exceptions.ConnectionError:
+                if intento >= self.max_reintentos:
+                    raise
+            else:
+                if respuesta.status_code < 500 or intento >= self.max_reintentos:
+                    respuesta.raise_for_status()  # Los 4xx no se reintentan
+                    return respuesta
+                respuesta.close()
+            time.sleep(self.backoff * (2 ** intento))
+            intento += 1
+
+    def _payload(self, mensajes, modelo, stream, opciones):
+        payload = {"model": modelo, "messages": mensajes, "stream": stream, "keep_alive": self.keep_alive}
+        if opciones:
+            payload["options"] = opciones
+        return payload
+
+    def _registrar(self, modelo, inicio, primer_token, fin, final):
+        final = final or {}
+        eval_count = final.get("eval_count")
+        eval_duration = final.get("eval_duration")  # nanosegundos
+        metrica = {
+            "modelo": modelo,
+            "segundos_total": fin - inicio,
+            "segundos_primer_token": (primer_token - inicio) if primer_token else None,
+            "tokens_generados": eval_count,
+            "tokens_por_segundo": (eval_count / (eval_duration / 1e9)) if eval_count and eval_duration else None,
+            "tokens_prompt": final.get("prompt_eval_count"),
+            "segundos_prompt": (final["prompt_eval_duration"] / 1e9) if final.get("prompt_eval_duration") else None,
+            "segundos_carga_modelo": (final["load_duration"] / 1e9) if final.get("load_duration") else None,
+        }
+        with self._lock:  # Se registra desde los hilos del LLM mientras la app lee el resumen
+            self.metricas.append(metrica)
+        # Tramo "llm" en la traza de la pregunta en curso (si la hay), con la misma métrica
+        trazas.registrar_tramo("llm", metrica["segundos_total"], **{k: v for k, v in metrica.items()
+                                                                      if k != "segundos_total"})
+        return metrica
+
+    # --- API pública ---
+    def chat_stream(self, mensajes, modelo, timeout=60, opciones=None, al_terminar=None):
+        """Generador de fragmentos de texto de la respuesta (stream=True).
+
+        `al_terminar(metrica)` recibe la métrica de esta llamada (ultima_metrica puede ser la de otro hilo).
+        """
+        inicio = time.perf_counter()
+        primer_token = None
+        final = None
+        respuesta = self._post(self._payload(mensajes, modelo, True, opciones), timeout, stream=True)
+        try:
+            for linea in respuesta.iter_lines():
+                if not linea:
+                    continue
+                try:
+                    datos = json.loads(linea.decode("utf-8"))
+                except json.JSONDecodeError:
+                    continue  # Línea incompleta o corrupta: se ignora
+                contenido = datos.get("message", {}).get("content")
+                if contenido:
+                    if primer_token is None:
+                        primer_token = time.perf_counter()
+                    yield contenido
+                if datos.get("done"):
+                    final = datos
+        finally:
+            respuesta.close()
+            metrica = self._registrar(modelo, inicio, primer_token, time.perf_counter(), final)
+            if al_terminar:
+                al_terminar(metrica)
+
+    def chat(self, mensajes, modelo, timeout=60, opciones=None):
+        """Devuelve la respuesta completa (stream=False)."""
+        inicio = time.perf_counter()
+        respuesta = self._post(self._payload(mensajes, modelo, False, opciones), timeout, stream=False)
+        datos = respuesta.json()
+        fin = time.perf_counter()
+        self._registrar(modelo, inicio, fin, fin, datos)
+        return datos.get("message", {}).get("content", "")
+
+    def calentar(self, modelo, timeout=120):
+        """Carga el modelo en memoria (petición sin mensajes) una sola vez por proceso."""
+        with self._lock:
+            if modelo in self._calentados:
+                return
+            self._calentados.add(modelo)
+        try:
+            self._post(self._payload([], modelo, False, None), timeout, stream=False).close()
+        except requests.exceptions.RequestException:
+            with self._lock:
+                self._calentados.discard(modelo)  # Se reintentará en el próximo arranque de la app
+
+    def calentar_en_segundo_plano(self, modelo):
+        threading.Thread(target=self.calentar, args=(modelo,), daemon=True, name=f"calentar-{modelo}").start()
+
+    def _copia_metricas(self):
+        """Lista de las métricas guardadas, tomada bajo el lock (el deque cambia desde otros hilos)."""
+        with self._lock:
+            return list(self.metricas)
+
+    def ultima_metrica(self):
+        metricas = self._copia_metricas()
+        return metricas[-1] if metricas else None
+
+    def resumen_metricas(self):
+        """Promedios de primer token y tokens/s sobre las últimas llamadas."""
+        metricas = self._copia_metricas()
+        primeros = [m["segundos_primer_token"] for m in metricas if m["segundos_primer_token"] is not None]
+        velocidades = [m["tokens_por_segundo"] for m in metricas if m["tokens_por_segundo"]]
+        return {
+            "llamadas": len(metricas),
+            "primer_token_promedio": sum(primeros) / len(primeros) if primeros else None,
+            "tokens_por_segundo_promedio": sum(velocidades) / len(velocidades) if velocidades else None,
+        }
+
+
+# Instancia compartida por todas las sesiones del proceso
+cliente_global = ClienteOllama()
@@ -0,0 +1,143 @@
+# === Capa compartida de conexión a la base de datos ===
+# Streamlit re-ejecuta los scripts en cada interacción, pero los módulos importados
+# se cargan una sola vez por proceso. Aquí vive un único engine con pool por URL,
+# reutilizado por todas las sesiones de main.py y appretail.py.
+
+import threading
+import time
+
+from sqlalchemy import create_engine, event, text
+
+# Parámetros del pool (ajustar según el número de analistas concurrentes)
+POOL_SIZE = 5
+MAX_OVERFLOW = 10
+POOL_TIMEOUT = 30  # Segundos esperando una conexión libre antes de fallar
+POOL_RECYCLE = 1800  # Reciclar conexiones antes del wait_timeout de MySQL
+POOL_PRE_PING = True
+CONEXIONES_PRECALENTADAS = 2  # Conexiones abiertas al arrancar
+SALUD_CADUCIDAD = 15  # Segundos que se reutiliza el último SELECT 1 (cada rerun de Streamlit lo pediría)
+
+_engines = {}
+_metricas = {}
+_salud = {}  # id(engine) -> (instante, (ok, ms, error))
+_lock = threading.Lock()
+
+
+def _registrar_metricas(engine, clave):
+    metricas = {"conexiones_nuevas": 0, "checkouts": 0, "checkins": 0, "segundos_conectando": 0.0}
+    _metricas[clave] = metricas
+
+    @event.listens_for(engine, "do_connect")
+    def _inicio_conexion(dialect, conn_rec, cargs, cparams):
+        conn_rec.info["inicio_conexion"] = time.perf_counter()
+
+    @event.listens_for(engine, "connect")
+    def _conexion_nueva(dbapi_connection, connection_record):
+        metricas["conexiones_nuevas"] += 1
+        inicio = connection_record.info.pop("inicio_conexion", None)
+        if inicio is not None:
+            metricas["segundos_conectando"] += time.perf_counter() - inicio
+
+    @event.listens_for(engine, "checkout")
+    def _checkout(dbapi_connection, connection_record, connection_proxy):
+        metricas["checkouts"] += 1
+
+    @event.listens_for(engine, "checkin")
+    def _checkin(dbapi_connection, connection_record):
+        metricas["checkins"] += 1
+
+
+def _configurar_sesion(engine):
+    @event.listens_for(engine, "connect")
+    def _sesion_nueva(dbapi_connection, connection_record):
+        # Una vez por conexión física, no en cada uso del pool. MySQL 8 cachea las
+        # estadísticas de information_schema (24 h por defecto) y los sellos de
+        # cache_resultados necesitan UPDATE_TIME al día.
+        cursor = dbapi_connection.cursor()
+        try:
+            cursor.execute("SET SESSION information_schema_stats_expiry = 0")
+        except Exception:
+            pass  # MySQL 5.7 / SingleStore no tienen esta variable
+        finally:
+            cursor.close()
+
+
+def precalentar(engine, conexiones=CONEXIONES_PRECALENTADAS):
+    """Abre varias conexiones a la vez y las devuelve al pool para que queden listas."""
+    abiertas = []
+    try:
+        for _ in range(conexiones):
+            conexion = engine.connect()
+            abiertas.append(conexion)
+            conexion.execute(text("SELECT 1"))
+    finally:
+        for conexion in abiertas:
+            conexion.close()
+
+
+def obtener_engine(url, pool_size=POOL_SIZE, max_overflow=MAX_OVERFLOW, pool_recycle=POOL_RECYCLE,
+                   pool_pre_ping=POOL_PRE_PING, pool_timeout=POOL_TIMEOUT, precalentar_conexiones=CONEXIONES_PRECALENTADAS):
+    """Devuelve el engine compartido para la URL, creándolo (y precalentándolo) la primera vez."""
+    with _lock:
+        engine = _engines.get(url)
+        if engine is not None:
+            return engine
+        engine = create_engine(
+            url,
+            pool_size=pool_size,
+            max_overflow=max_overflow,
+            pool_recycle=pool_recycle,
+            pool_pre_ping=pool_pre_ping,
+            pool_timeout=pool_timeout,
+        )
+        _registrar_metricas(engine, url)
+        if engine.dialect.name == "mysql":
+            _configurar_sesion(engine)
+        _engines[url] = engine
+    if precalentar_conexiones:
+        try:
+            precalentar(engine, precalentar_conexiones)
+        except Exception:
+            pass  # Si la BD no está disponible todavía, el error se verá en la primera consulta
+    return engine
+
+
+def verificar_salud(engine, caducidad=SALUD_CADUCIDAD):
+    """Ejecuta SELECT 1 y devuelve (ok, milisegundos, mensaje_error).
+
+    El resultado se comparte en el proceso durante `caducidad` segundos: con la BD caída,
+    cada comprobación espera el timeout de conexión, y no debe pagarse en cada rerun.
+    """
+    ahora = time.monotonic()
+    with _lock:
+        anterior = _salud.get(id(engine))
+        if anterior is not None and ahora - anterior[0] < caducidad:
+            return anterior[1]
+        # Las sesiones que lleguen mientras se comprueba reutilizan el resultado anterior
+        _salud[id(engine)] = (ahora, anterior[1] if anterior is not None else (True, 0.0, None))
+    inicio = time.perf_counter()
+    try:
+        with engine.connect() as conexion:
+            conexion.execute(text("SELECT 1"))
+        resultado = True, (time.perf_counter() - inicio) * 1000, None
+    except Exception as e:
+        resultado = False, (time.perf_counter() - inicio) * 1000, str(e)
+    with _lock:
+        _salud[id(engine)] = (time.monotonic(), resultado)
+    return resultado
+
+
+def estadisticas_pool(engine):
+    """Estado actual del pool (conexiones en uso, libres, overflow) y contadores acumulados."""
+    pool = engine.pool
+    estado = {
+        "tamano": pool.size() if hasattr(pool, "size") else None,
+        "en_uso": pool.checkedout() if hasattr(pool, "checkedout") else None,
+        "libres": pool.checkedin() if hasattr(pool, "checkedin") else None,
+        "overflow": pool.overflow() if hasattr(pool, "overflow") else None,
+    }
+    for clave, e in _engines.items():
+        if e is engine:
+            estado.update(_metricas.get(clave, {}))
+            break
+    return estado
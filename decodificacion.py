@@ -0,0 +1,134 @@
+# === Decodificación de resultados según los tipos de MySQL ===
+# pd.DataFrame.from_records deja los DECIMAL (monto_asegurado, prima, monto_pagado...) como
+# objetos Decimal en columnas object, lentas y pesadas, y las fechas había que adivinarlas
+# por el nombre de la columna. Aquí el tipo sale de la descripción del cursor y cada
+# columna se convierte de una sola vez a un dtype compacto:
+#
+# - DATE / DATETIME / TIMESTAMP -> datetime64[us] (cubre de '1000-01-01' a '9999-12-31')
+# - DECIMAL -> float64, o int64 si no tiene decimales (p. ej. SUM de enteros)
+# - ENUM -> category
+# - CHAR(36) (UUID) -> cadenas respaldadas por Arrow (si pyarrow está instalado)
+# El resto de columnas queda a la inferencia habitual de pandas.
+#
+# Con `sin_conversion_python` PyMySQL entrega fechas y DECIMAL como texto (sin crear un
+# objeto date/Decimal por celda) y se parsean después por columna, de una vez.
+
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+from pymysql.constants import FIELD_TYPE, FLAG
+
+try:
+    import pyarrow  # noqa: F401
+    TIPO_UUID = "string[pyarrow]"
+except ImportError:  # Sin pyarrow los UUID quedan como texto normal
+    TIPO_UUID = None
+
+TIPOS_FECHA = {FIELD_TYPE.DATE, FIELD_TYPE.NEWDATE, FIELD_TYPE.DATETIME, FIELD_TYPE.TIMESTAMP}
+TIPOS_DECIMAL = {FIELD_TYPE.DECIMAL, FIELD_TYPE.NEWDECIMAL}
+TIPOS_TEXTO_CRUDO = TIPOS_FECHA | TIPOS_DECIMAL  # Tipos que se dejan como texto al leer
+LARGO_UUID = 36
+BYTES_POR_CARACTER = (1, 3, 4)  # latin1, utf8mb3, utf8mb4: CHAR(36) llega como 36, 108 o 144 bytes
+
+
+@contextmanager
+def sin_conversion_python(conexion_dbapi):
+    """Durante el `execute` hecho dentro del bloque, fechas y DECIMAL llegan como texto.
+
+    PyMySQL fija los conversores por columna al leer la descripción del resultado, así que
+    basta con cambiarlos mientras se ejecuta; luego se restauran para el resto del pool.
+    """
+    originales = conexion_dbapi.decoders
+    conexion_dbapi.decoders = {t: f for t, f in originales.items() if t not in TIPOS_TEXTO_CRUDO}
+    try:
+        yield
+    finally:
+        conexion_dbapi.decoders = originales
+
+
+def describir(cursor):
+    """[(nombre, clase)] de las columnas del cursor; clase: "fecha", "decimal", "entero",
+    "enum", "uuid" o None (sin conversión especial).
+
+    La descripción PEP 249 no distingue un ENUM de un CHAR: si el cursor de PyMySQL expone
+    los campos del resultado se usan sus flags y su juego de caracteres.
+    """
+    if not cursor.description:
+        return []
+    campos = getattr(getattr(cursor, "_result", None), "fields", None)
+    if campos is not None and len(campos) != len(cursor.description):
+        campos = None
+    columnas = []
+    for i, (nombre, tipo, _, largo, _, escala, _) in enumerate(cursor.description):
+        campo = campos[i] if campos is not None else None
+        clase = None
+        if tipo in TIPOS_FECHA:
+            clase = "fecha"
+        elif tipo in TIPOS_DECIMAL:
+            clase = "entero" if not escala else "decimal"
+        elif tipo == FIELD_TYPE.ENUM or (campo is not None and campo.flags & FLAG.ENUM):
+            clase = "enum"
+        elif tipo == FIELD_TYPE.STRING and TIPO_UUID is not None:
+            if campo is not None:
+                es_uuid = campo.length in {LARGO_UUID * n for n in BYTES_POR_CARACTER} \
+                    and not campo.flags & FLAG.BINARY
+            else:
+                es_uuid = largo in {LARGO_UUID * n for n in BYTES_POR_CARACTER}
+            clase = "uuid" if es_uuid else None
+        columnas.append((nombre, clase))
+    return columnas
+
+
+def _convertir(valores, clase):
+    """Una columna (tupla de valores del cursor) como Series del dtype de su clase."""
+    if clase is None:
+        return pd.Series(valores)  # Inferencia de pandas, como from_records
+    crudos = np.fromiter(valores, dtype=object, count=len(valores))
+    if clase == "fecha":
+        # Texto ISO u objetos date; las fechas inválidas ('0000-00-00') quedan en NaT.
+        # Siempre en us para que todos los bloques (y la exportación) tengan el mismo tipo:
+        # en ns no caben fechas válidas de MySQL como '9999-12-31' ("sin fecha de fin").
+        return pd.Series(pd.to_datetime(crudos, errors="coerce", format="ISO8601")).astype("datetime64[us]")
+    if clase in ("decimal", "entero"):
+        numeros = crudos.astype(np.float64)  # Texto o Decimal -> float; NULL -> NaN
+        if clase == "entero":
+            nulos = np.isnan(numeros)
+            if np.abs(numeros[~nulos]).max(initial=0) < 2**53:  # Exacto en float64: cabe sin pérdida
+                enteros = np.where(nulos, 0, numeros).astype(np.int64)
+                # Con NULL, entero con máscara: así todos los bloques tienen el mismo tipo
+                return pd.Series(pd.arrays.IntegerArray(enteros, nulos) if nulos.any() else enteros)
+        return pd.Series(numeros)
+    if clase == "enum":
+        return pd.Series(pd.Categorical(crudos))
+    return pd.Series(pd.array(crudos, dtype=TIPO_UUID))
+
+
+def a_dataframe(filas, columnas):
+    """DataFrame de las filas (tuplas del cursor) con los dtypes de `describir`.
+
+    Se traspone una vez (una tupla por columna) y cada columna se convierte en una sola
+    operación vectorizada, sin pasar por objetos date/Decimal ni por la inferencia de tipos.
+    """
+    nombres = [nombre for nombre, _ in columnas]
+    if not filas:
+        return pd.DataFrame(columns=nombres)
+    df = pd.concat([_convertir(valores, clase) for valores, (_, clase) in zip(zip(*filas), columnas)],
+                   axis=1, ignore_index=True)
+    df.columns = nombres  # Puede haber nombres repetidos (SELECT a.id, b.id)
+    return df
+
+
+def concatenar(bloques, columnas):
+    """Une bloques de `a_dataframe` conservando las columnas ENUM como category."""
+    if not bloques:
+        return pd.DataFrame(columns=[nombre for nombre, _ in columnas])
+    if len(bloques) == 1:
+        return bloques[0]
+    df = pd.concat(bloques, ignore_index=True)
+    # Cada bloque tiene sus propias categorías: pd.concat las convertiría a object
+    for i, (_, clase) in enumerate(columnas):
+        if clase == "enum":
+            df.isetitem(i, pd.Series(union_categoricals([b.iloc[:, i] for b in bloques]), index=df.index))
+    return df
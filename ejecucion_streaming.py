@@ -0,0 +1,121 @@
+# === Ejecución de SQL en streaming con presupuesto de memoria ===
+# Usa el cursor sin buffer de PyMySQL (SSCursor): las filas se leen del socket por
+# bloques en lugar de cargar todo el resultado en memoria de una vez. Si se supera
+# el presupuesto de filas o bytes se corta la lectura y se marca el resultado como
+# truncado, en vez de tumbar el worker de Streamlit. Cada bloque se decodifica según
+# los tipos del cursor (fechas, DECIMAL, ENUM...) con `decodificacion`.
+
+import pymysql
+from sqlalchemy import text
+
+from decodificacion import a_dataframe, concatenar, describir, sin_conversion_python
+
+MAX_FILAS = 200_000
+MAX_BYTES = 200 * 1024 * 1024
+TAMANO_BLOQUE = 5_000
+
+
+def _cancelar_consulta(engine, thread_id):
+    """Pide al servidor que detenga la consulta en curso desde otra conexión del pool."""
+    try:
+        with engine.connect() as otra:
+            otra.execute(text(f"KILL QUERY {int(thread_id)}"))
+    except Exception:
+        pass  # Sin permisos de KILL el servidor la terminará al detectar el socket cerrado
+
+
+def ejecutar_en_streaming(engine, sql, max_filas=MAX_FILAS, max_bytes=MAX_BYTES,
+                          tamano_bloque=TAMANO_BLOQUE, al_recibir_bloque=None):
+    """Ejecuta `sql` leyendo por bloques y devuelve un DataFrame acotado.
+
+    `al_recibir_bloque(bloque, filas_leidas)` se llama tras cada bloque, lo que
+    permite mostrar las primeras filas mientras el resto sigue llegando.
+    El DataFrame resultante lleva en `df.attrs["streaming"]` las filas y bytes leídos
+    y, si se cortó la lectura, el motivo del truncado.
+    """
+    conexion = engine.raw_connection()
+    bloques = []
+    filas_leidas = 0
+    bytes_leidos = 0
+    motivo_truncado = None
+    cursor = None
+    try:
+        cursor = conexion.cursor(pymysql.cursors.SSCursor)
+        # Sin argumentos PyMySQL no interpreta '%', así que el SQL va tal cual
+        with sin_conversion_python(conexion.dbapi_connection):
+            cursor.execute(sql)
+        columnas = describir(cursor)
+        while True:
+            # Se pide como mucho una fila más del límite para saber si hay que truncar
+            filas = cursor.fetchmany(min(tamano_bloque, max_filas + 1 - filas_leidas))
+            if not filas:
+                break
+            bloque = a_dataframe(filas, columnas)
+            filas_leidas += len(bloque)
+            bytes_leidos += int(bloque.memory_usage(index=False, deep=True).sum())
+            bloques.append(bloque)
+            if al_recibir_bloque is not None:
+                al_recibir_bloque(bloque, filas_leidas)
+            if filas_leidas > max_filas:
+                motivo_truncado = f"se alcanzó el límite de {max_filas:,} filas"
+                break
+            if bytes_leidos >= max_bytes:
+                motivo_truncado = f"se alcanzó el límite de {max_bytes / 1024**2:,.0f} MB"
+                break
+
+        if motivo_truncado:
+            # Cerrar un SSCursor con filas pendientes las lee todas: se cancela la consulta
+            # y se descarta la conexión en lugar de devolverla al pool.
+            _cancelar_consulta(engine, conexion.dbapi_connection.thread_id())
+            conexion.invalidate()
+            cursor = None
+        df = concatenar(bloques, columnas)
+        if filas_leidas > max_filas:
+            df = df.iloc[:max_filas]
+        df.attrs["streaming"] = {
+            "filas": len(df),
+            "bytes": bytes_leidos,
+            "truncado": motivo_truncado is not None,
+            "motivo": motivo_truncado,
+        }
+        return df
+    except Exception:
+        conexion.invalidate()
+        cursor = None
+        raise
+    finally:
+        if cursor is not None:
+            cursor.close()
+        conexion.close()
+
+
+def iterar_bloques(engine, sql, tamano_bloque=TAMANO_BLOQUE):
+    """Genera el resultado completo de `sql` en DataFrames de `tamano_bloque` filas.
+
+    Sin presupuesto: pensado para volcar resultados a disco (exportación) sin tenerlos
+    enteros en memoria. Si el consumidor abandona el generador antes del final, la
+    consulta se cancela igual que en ejecutar_en_streaming.
+    """
+    conexion = engine.raw_connection()
+    cursor = None
+    completo = False
+    try:
+        cursor = conexion.cursor(pymysql.cursors.SSCursor)
+        with sin_conversion_python(conexion.dbapi_connection):
+            cursor.execute(sql)
+        columnas = describir(cursor)
+        while True:
+            filas = cursor.fetchmany(tamano_bloque)
+            if not filas:
+                break
+            yield a_dataframe(filas, columnas)
+        completo = True
+    finally:
+        if not completo:
+            if cursor is not None:
+                _cancelar_consulta(engine, conexion.dbapi_connection.thread_id())
+            conexion.invalidate()
+            cursor = None
+        if cursor is not None:
+            cursor.close()
+        conexion.close()
@@ -0,0 +1,216 @@
+# === Exportación de resultados bajo demanda (XLSX, CSV, Parquet) ===
+# El archivo solo se genera cuando el usuario pulsa "Descargar" y se escribe a disco
+# por bloques, con memoria constante:
+#   - XLSX con openpyxl en modo write_only (las filas se vuelcan según se añaden).
+#   - CSV con pandas, bloque a bloque.
+#   - Parquet con pyarrow.ParquetWriter (opcional: solo si pyarrow está instalado).
+# Si el resultado en pantalla se truncó, las filas se leen directamente del cursor de
+# MySQL, así la exportación contiene el resultado completo.
+# Los archivos generados se cachean en disco por huella del resultado y formato.
+
+import atexit
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+from openpyxl import Workbook
+
+from ejecucion_streaming import iterar_bloques
+from perfil_resultados import huella_resultado
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet es opcional
+    pa = None
+    pq = None
+
+TAMANO_BLOQUE = 20_000
+MAX_FILAS_HOJA_XLSX = 1_048_575  # Límite de Excel (sin contar la cabecera)
+MAX_BYTES_DISCO = 2 * 1024 ** 3  # Presupuesto de la caché de archivos en disco
+
+FORMATOS = {
+    "xlsx": {"etiqueta": "Excel (.xlsx)", "extension": "xlsx",
+             "mime": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"},
+    "csv": {"etiqueta": "CSV (.csv)", "extension": "csv", "mime": "text/csv"},
+}
+if pq is not None:
+    FORMATOS["parquet"] = {"etiqueta": "Parquet (.parquet)", "extension": "parquet",
+                           "mime": "application/vnd.apache.parquet"}
+
+
+# --- Fuentes de filas ---
+def bloques_dataframe(df, tamano=TAMANO_BLOQUE):
+    for inicio in range(0, len(df), tamano):
+        yield df.iloc[inicio:inicio + tamano]
+
+
+def bloques_resultado(df, engine=None, tamano=TAMANO_BLOQUE):
+    """Bloques del resultado: del cursor de MySQL si lo mostrado se truncó, si no del DataFrame."""
+    streaming = df.attrs.get("streaming") or {}
+    sql = df.attrs.get("sql")
+    if streaming.get("truncado") and engine is not None and sql:
+        return iterar_bloques(engine, sql, tamano)
+    return bloques_dataframe(df, tamano)
+
+
+def _celdas(bloque):
+    """Filas del bloque como tuplas listas para openpyxl (NaN/NaT -> celda vacía)."""
+    bloque = bloque.astype(object).where(bloque.notna(), None)
+    return bloque.itertuples(index=False, name=None)
+
+
+# --- Escritores (de bloques a archivo) ---
+def escribir_xlsx(bloques, ruta, hojas_extra=()):
+    libro = Workbook(write_only=True)
+    hoja = None
+    filas_hoja = 0
+    numero_hoja = 1
+    for bloque in bloques:
+        for col in bloque.columns:
+            # Mismo criterio que el reporte original: el año como texto, sin separador de miles
+            if str(col).lower() == 'anio' and pd.api.types.is_integer_dtype(bloque[col]):
+                bloque = bloque.assign(**{col: bloque[col].astype(str)})
+        for fila in _celdas(bloque):
+            if hoja is None or filas_hoja >= MAX_FILAS_HOJA_XLSX:
+                titulo = "Resultado Consulta" if numero_hoja == 1 else f"Resultado Consulta ({numero_hoja})"
+                hoja = libro.create_sheet(titulo)
+                hoja.append([str(c) for c in bloque.columns])
+                filas_hoja = 0
+                numero_hoja += 1
+            hoja.append(fila)
+            filas_hoja += 1
+    if hoja is None:
+        libro.create_sheet("Resultado Consulta")
+    for titulo, df_extra in hojas_extra:
+        hoja_extra = libro.create_sheet(titulo)
+        hoja_extra.append([str(c) for c in df_extra.columns])
+        for fila in _celdas(df_extra):
+            hoja_extra.append(fila)
+    libro.save(ruta)
+
+
+def escribir_csv(bloques, ruta, hojas_extra=()):
+    with open(ruta, "w", encoding="utf-8-sig", newline="") as f:  # BOM: Excel detecta UTF-8
+        for i, bloque in enumerate(bloques):
+            bloque.to_csv(f, index=False, header=(i == 0))
+
+
+def escribir_parquet(bloques, ruta, hojas_extra=()):
+    if pq is None:
+        raise RuntimeError("Para exportar a Parquet hay que instalar pyarrow.")
+    escritor = None
+    try:
+        for bloque in bloques:
+            if escritor is None:
+                tabla = pa.Table.from_pandas(bloque, preserve_index=False)
+                escritor = pq.ParquetWriter(ruta, tabla.schema)
+            else:
+                # El esquema lo fija el primer bloque (un bloque todo NULL no puede cambiarlo)
+                tabla = pa.Table.from_pandas(bloque, schema=escritor.schema, preserve_index=False)
+            escritor.write_table(tabla)
+    finally:
+        if escritor is not None:
+            escritor.close()
+    if escritor is None:
+        pq.write_table(pa.table({}), ruta)
+
+
+_ESCRITORES = {"xlsx": escribir_xlsx, "csv": escribir_csv, "parquet": escribir_parquet}
+
+
+# === Caché de archivos exportados ===
+class CacheExportaciones:
+    """Archivos ya generados en disco, por (huella del resultado, formato, metadatos)."""
+
+    def __init__(self, directorio=None, max_bytes=MAX_BYTES_DISCO):
+        self.directorio = directorio or tempfile.mkdtemp(prefix="exportaciones_")
+        self.max_bytes = max_bytes
+        self._entradas = OrderedDict()  # clave -> (ruta, bytes)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._en_curso = {}  # clave -> Lock: dos clics seguidos no generan el archivo dos veces
+        self.aciertos = 0
+        self.fallos = 0
+
+    def obtener(self, clave, extension, generar):
+        """Ruta del archivo para `clave`; lo crea con `generar(ruta)` si no está en caché."""
+        with self._lock:
+            lock_clave = self._en_curso.setdefault(clave, threading.Lock())
+        with lock_clave:
+            with self._lock:
+                entrada = self._entradas.get(clave)
+                if entrada is not None and os.path.exists(entrada[0]):
+                    self._entradas.move_to_end(clave)
+                    self.aciertos += 1
+                    return entrada[0]
+                self.fallos += 1
+            ruta = os.path.join(self.directorio, f"{clave}.{extension}")
+            temporal = ruta + ".parcial"
+            try:
+                generar(temporal)
+                os.replace(temporal, ruta)
+            finally:
+                if os.path.exists(temporal):
+                    os.remove(temporal)
+            self._guardar(clave, ruta, os.path.getsize(ruta))
+            return ruta
+
+    def _guardar(self, clave, ruta, tamano):
+        with self._lock:
+            self._quitar(clave)
+            self._entradas[clave] = (ruta, tamano)
+            self._bytes += tamano
+            while self._bytes > self.max_bytes and len(self._entradas) > 1:
+                self._quitar(next(iter(self._entradas)))
+
+    def _quitar(self, clave):
+        entrada = self._entradas.pop(clave, None)
+        if entrada is None:
+            return
+        self._bytes -= entrada[1]
+        self._en_curso.pop(clave, None)
+        try:
+            os.remove(entrada[0])
+        except OSError:
+            pass
+
+    def limpiar(self):
+        shutil.rmtree(self.directorio, ignore_errors=True)
+
+    def estadisticas(self):
+        with self._lock:
+            return {"archivos": len(self._entradas), "bytes": self._bytes,
+                    "aciertos": self.aciertos, "fallos": self.fallos}
+
+
+# Instancia compartida por todas las sesiones del proceso
+cache_global = CacheExportaciones()
+atexit.register(cache_global.limpiar)
+
+
+# --- Punto de entrada ---
+def exportar(df, formato, engine=None, hojas_extra=()):
+    """Genera (o recupera de la caché) el archivo del resultado y devuelve sus bytes.
+
+    `hojas_extra` son pares (título, DataFrame) que se añaden como hojas en XLSX.
+    """
+    if formato not in FORMATOS:
+        raise ValueError(f"Formato de exportación no disponible: {formato}")
+    h = hashlib.sha1(huella_resultado(df).encode("utf-8"))
+    h.update(formato.encode("utf-8"))
+    if formato == "xlsx":
+        for titulo, df_extra in hojas_extra:
+            h.update(titulo.encode("utf-8"))
+            h.update(huella_resultado(df_extra).encode("utf-8"))
+    escribir = _ESCRITORES[formato]
+    ruta = cache_global.obtener(
+        h.hexdigest(), FORMATOS[formato]["extension"],
+        lambda destino: escribir(bloques_resultado(df, engine), destino, hojas_extra),
+    )
+    with open(ruta, "rb") as f:
+        return f.read()
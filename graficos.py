@@ -0,0 +1,183 @@
+# === Servicio de gráficos compartido (Matplotlib orientado a objetos + caché PNG) ===
+# Las figuras se crean con matplotlib.figure.Figure y el lienzo Agg, sin pasar por
+# pyplot: no quedan registradas en su lista global de figuras, así que un worker que
+# lleva días en marcha no acumula memoria. Cada figura se renderiza a PNG y se libera
+# en el acto; la interfaz solo guarda los bytes.
+#
+# El PNG se cachea por un hash de (tipo, categorías, valores, etiquetas, tamaño, estilo):
+# los reruns de Streamlit y las preguntas repetidas no vuelven a dibujar nada.
+
+import hashlib
+import threading
+from collections import OrderedDict
+from io import BytesIO
+
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from matplotlib.patches import Circle
+
+MAX_BYTES = 64 * 1024 * 1024  # Presupuesto de memoria de la caché de PNG
+
+# Estilo por defecto del gráfico de barras; cada app puede sobrescribir claves sueltas
+ESTILO_BARRAS = {
+    "color": "skyblue",
+    "titulo": None,  # None: "Distribución de <valor> por <categoría>"
+    "fuente_titulo": 8,
+    "fuente_ejes": 6,
+    "fuente_ticks": 5,
+    "fuente_valores": 4,
+    "rotacion": 45,  # Grados, o "auto" según el número de categorías y el ancho
+    "max_largo_etiqueta": None,  # Recorta etiquetas largas del eje X
+    "pad": 0.3,
+}
+ESTILO_PASTEL = {
+    "fuente": 4,
+    "hueco": 0.70,  # Radio del círculo blanco central (gráfico de anillo); 0 = pastel lleno
+}
+
+
+def _rotacion_automatica(num_categorias, ancho):
+    if num_categorias > 8 and ancho < num_categorias * 0.5:
+        return 60, "right"
+    if num_categorias > 5 and ancho < num_categorias * 0.7:
+        return 45, "right"
+    if num_categorias > 3 and ancho < num_categorias * 0.9:
+        return 30, "right"
+    return 0, "center"
+
+
+def _formatear_valor(valor):
+    valor = float(valor)
+    return f"{valor:,.0f}" if valor.is_integer() else f"{valor:,.2f}"
+
+
+def _dibujar_barras(fig, categorias, valores, etiqueta_categoria, etiqueta_valor, estilo):
+    ax = fig.subplots()
+    largo = estilo["max_largo_etiqueta"]
+    etiquetas = [c if not largo or len(c) <= largo else c[:largo - 3] + "..." for c in categorias]
+    barras = ax.bar(etiquetas, valores, color=estilo["color"])
+
+    titulo = estilo["titulo"] or f"Distribución de {etiqueta_valor} por {etiqueta_categoria}"
+    ax.set_title(titulo, fontsize=estilo["fuente_titulo"])
+    ax.set_xlabel(etiqueta_categoria, fontsize=estilo["fuente_ejes"])
+    ax.set_ylabel(etiqueta_valor, fontsize=estilo["fuente_ejes"])
+
+    if estilo["rotacion"] == "auto":
+        rotacion, alineacion = _rotacion_automatica(len(etiquetas), fig.get_figwidth())
+    else:
+        rotacion, alineacion = estilo["rotacion"], ("right" if estilo["rotacion"] else "center")
+    ax.tick_params(axis="x", labelrotation=rotacion, labelsize=estilo["fuente_ticks"])
+    for etiqueta in ax.get_xticklabels():
+        etiqueta.set_horizontalalignment(alineacion)
+    ax.tick_params(axis="y", labelsize=estilo["fuente_ticks"])
+
+    maximo = max(valores)
+    ax.set_ylim(0, maximo * 1.25 if maximo > 0 else 1.25)
+    separacion = maximo * 0.02 if maximo > 0 else 0.02
+    for barra in barras:
+        altura = barra.get_height()
+        ax.text(barra.get_x() + barra.get_width() / 2.0, altura + separacion, _formatear_valor(altura),
+                ha="center", va="bottom", fontsize=estilo["fuente_valores"])
+    fig.tight_layout(pad=estilo["pad"])
+
+
+def _dibujar_pastel(fig, categorias, valores, etiqueta_categoria, etiqueta_valor, estilo):
+    ax = fig.subplots()
+    ax.pie(valores, labels=categorias, autopct="%1.1f%%", startangle=90, pctdistance=0.85,
+           textprops={"fontsize": estilo["fuente"]})
+    ax.axis("equal")
+    if estilo["hueco"]:
+        ax.add_artist(Circle((0, 0), estilo["hueco"], fc="white"))
+
+
+_DIBUJANTES = {
+    "barras": (_dibujar_barras, ESTILO_BARRAS),
+    "pastel": (_dibujar_pastel, ESTILO_PASTEL),
+}
+
+
+class ServicioGraficos:
+    """Renderiza gráficos a PNG y los guarda en una caché LRU acotada por bytes."""
+
+    def __init__(self, max_bytes=MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entradas = OrderedDict()  # clave -> bytes PNG
+        self._bytes = 0
+        self._lock = threading.Lock()
+        # Matplotlib no garantiza seguridad entre hilos (caché de fuentes, mathtext):
+        # el dibujo se serializa, la búsqueda en caché no
+        self._lock_render = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+        self.renderizados = 0
+
+    @staticmethod
+    def _clave(tipo, categorias, valores, etiqueta_categoria, etiqueta_valor, tamano, dpi, estilo):
+        datos = repr((tipo, categorias, valores, etiqueta_categoria, etiqueta_valor, tuple(tamano), dpi,
+                      sorted(estilo.items())))
+        return hashlib.sha1(datos.encode("utf-8")).hexdigest()
+
+    def renderizar(self, tipo, categorias, valores, etiqueta_categoria="", etiqueta_valor="",
+                   tamano=(5, 2), dpi=100, **estilo):
+        """Devuelve los bytes PNG del gráfico `tipo` ('barras' o 'pastel').
+
+        Lanza ValueError si los datos no se pueden graficar.
+        """
+        if tipo not in _DIBUJANTES:
+            raise ValueError(f"Tipo de gráfico desconocido: {tipo}")
+        if not categorias or not valores or len(categorias) != len(valores):
+            raise ValueError("Se necesitan categorías y valores de la misma longitud.")
+        dibujar, estilo_base = _DIBUJANTES[tipo]
+        estilo = {**estilo_base, **estilo}
+        categorias = [str(c) for c in categorias]
+        valores = [float(v) for v in valores]
+
+        clave = self._clave(tipo, categorias, valores, etiqueta_categoria, etiqueta_valor, tamano, dpi, estilo)
+        with self._lock:
+            png = self._entradas.get(clave)
+            if png is not None:
+                self._entradas.move_to_end(clave)
+                self.aciertos += 1
+                return png
+            self.fallos += 1
+
+        with self._lock_render:
+            fig = Figure(figsize=tamano, dpi=dpi)
+            FigureCanvasAgg(fig)
+            try:
+                dibujar(fig, categorias, valores, etiqueta_categoria, etiqueta_valor, estilo)
+                buffer = BytesIO()
+                fig.savefig(buffer, format="png")
+            finally:
+                fig.clear()  # Libera ejes y artistas en el acto, sin esperar al recolector
+            self.renderizados += 1
+        png = buffer.getvalue()
+        self._guardar(clave, png)
+        return png
+
+    def _guardar(self, clave, png):
+        if len(png) > self.max_bytes:
+            return
+        with self._lock:
+            anterior = self._entradas.pop(clave, None)
+            if anterior is not None:
+                self._bytes -= len(anterior)
+            self._entradas[clave] = png
+            self._bytes += len(png)
+            while self._bytes > self.max_bytes and self._entradas:
+                _, expulsado = self._entradas.popitem(last=False)
+                self._bytes -= len(expulsado)
+
+    def estadisticas(self):
+        with self._lock:
+            return {
+                "entradas": len(self._entradas),
+                "bytes": self._bytes,
+                "aciertos": self.aciertos,
+                "fallos": self.fallos,
+                "renderizados": self.renderizados,
+            }
+
+
+# Instancia compartida por todas las sesiones (y las dos apps) del proceso
+servicio_graficos = ServicioGraficos()
@@ -0,0 +1,128 @@
+# === Revisión previa (pre-flight) del SQL generado por el LLM ===
+# Antes de ejecutar una consulta se pide su plan con EXPLAIN FORMAT=JSON y se estiman
+# las filas que examinará. Según umbrales configurables se rechaza, se le inyecta un
+# LIMIT o se le añade el hint MAX_EXECUTION_TIME para que no dispare la CPU de MySQL.
+
+import json
+import re
+
+# --- Umbrales (filas estimadas por el optimizador) ---
+FILAS_TABLA_GRANDE = 1_000_000  # Un escaneo completo por encima de esto se considera caro
+UMBRAL_RECHAZO_FILAS = 200_000_000  # Filas examinadas totales a partir de las cuales se rechaza
+UMBRAL_CARTESIANO_FILAS = 1_000_000  # Producto cartesiano tolerado (tablas pequeñas)
+LIMITE_INYECTADO = 10_000  # LIMIT que se añade a consultas sin agregación sobre tablas grandes
+TIEMPO_MAXIMO_MS = 30_000  # Hint MAX_EXECUTION_TIME para consultas caras pero aceptables
+
+_PATRON_LIMIT_FINAL = re.compile(r"\blimit\s+\d+(\s*(,|offset)\s*\d+)?\s*$", re.IGNORECASE)
+_PATRON_AGREGACION = re.compile(r"\b(group\s+by|count|sum|avg|min|max|distinct)\b", re.IGNORECASE)
+
+
+def explicar(connection, sql):
+    """Devuelve el plan de EXPLAIN FORMAT=JSON como dict."""
+    # Se usa el cursor DB-API sin parámetros para que PyMySQL no interprete '%'
+    cursor = connection.connection.cursor()
+    try:
+        cursor.execute("EXPLAIN FORMAT=JSON " + sql.strip().rstrip(";"))
+        return json.loads(cursor.fetchone()[0])
+    finally:
+        cursor.close()
+
+
+def _tablas_del_plan(nodo, tablas=None):
+    """Recorre el plan y devuelve los nodos 'table' en el orden del nested loop."""
+    if tablas is None:
+        tablas = []
+    if isinstance(nodo, dict):
+        for clave, valor in nodo.items():
+            if clave == "table" and isinstance(valor, dict):
+                tablas.append(valor)
+                _tablas_del_plan({k: v for k, v in valor.items() if k != "table"}, tablas)
+            else:
+                _tablas_del_plan(valor, tablas)
+    elif isinstance(nodo, list):
+        for elemento in nodo:
+            _tablas_del_plan(elemento, tablas)
+    return tablas
+
+
+def analizar_plan(plan):
+    """Resume el plan: filas examinadas y producidas estimadas, escaneos completos y productos cartesianos."""
+    filas_examinadas = 0
+    filas_previas = 1
+    escaneos_completos = []
+    cartesiano = False
+    for i, tabla in enumerate(_tablas_del_plan(plan)):
+        por_escaneo = float(tabla.get("rows_examined_per_scan", 0) or 0)
+        producidas = float(tabla.get("rows_produced_per_join", por_escaneo) or 0)
+        filas_examinadas += filas_previas * por_escaneo
+        nombre = tabla.get("table_name", "?")
+        if tabla.get("access_type") == "ALL" and por_escaneo >= FILAS_TABLA_GRANDE:
+            escaneos_completos.append((nombre, int(por_escaneo)))
+        # Join buffer sin condición de unión = producto cartesiano
+        if i > 0 and tabla.get("using_join_buffer") and not tabla.get("attached_condition"):
+            cartesiano = True
+        filas_previas = max(producidas, 1)
+    return {
+        "filas_examinadas": int(filas_examinadas),
+        "filas_resultado": int(filas_previas),  # Filas que salen del último join (antes de agrupar)
+        "escaneos_completos": escaneos_completos,
+        "cartesiano": cartesiano,
+    }
+
+
+def _inyectar_limit(sql, limite):
+    cuerpo = sql.strip().rstrip(";").rstrip()
+    if _PATRON_LIMIT_FINAL.search(cuerpo):
+        return None  # Ya tiene LIMIT
+    return f"{cuerpo} LIMIT {limite}"
+
+
+def _inyectar_tiempo_maximo(sql, milisegundos):
+    cuerpo = sql.strip().rstrip(";").rstrip()
+    # El hint solo vale en el SELECT de primer nivel; en consultas WITH no se toca
+    if not re.match(r"select\b", cuerpo, re.IGNORECASE) or "MAX_EXECUTION_TIME" in cuerpo.upper():
+        return None
+    return re.sub(r"^select\b", f"SELECT /*+ MAX_EXECUTION_TIME({int(milisegundos)}) */", cuerpo, count=1, flags=re.IGNORECASE)
+
+
+def revisar_consulta(connection, sql):
+    """Decide si la consulta se ejecuta tal cual, modificada o se rechaza.
+
+    Devuelve un dict con:
+      - accion: 'permitir', 'modificar', 'rechazar' o 'error'
+      - sql: el SQL a ejecutar (con LIMIT / hint añadidos si corresponde)
+      - motivos: lista de explicaciones legibles para el usuario
+      - analisis: resumen del plan (ver analizar_plan)
+    """
+    try:
+        plan = explicar(connection, sql)
+    except Exception as e:
+        return {"accion": "error", "sql": sql, "motivos": [f"EXPLAIN falló: {e}"], "analisis": None}
+
+    analisis = analizar_plan(plan)
+    motivos = []
+    filas = analisis["filas_examinadas"]
+
+    if analisis["cartesiano"] and filas > UMBRAL_CARTESIANO_FILAS:
+        motivos.append(f"La consulta hace un producto cartesiano (~{filas:,} filas). Revisa las condiciones de JOIN.")
+        return {"accion": "rechazar", "sql": sql, "motivos": motivos, "analisis": analisis}
+    if filas > UMBRAL_RECHAZO_FILAS:
+        motivos.append(f"La consulta examinaría ~{filas:,} filas (límite {UMBRAL_RECHAZO_FILAS:,}).")
+        return {"accion": "rechazar", "sql": sql, "motivos": motivos, "analisis": analisis}
+
+    sql_final = sql.strip().rstrip(";").rstrip()
+    if analisis["escaneos_completos"]:
+        tablas = ", ".join(f"{t} (~{n:,} filas)" for t, n in analisis["escaneos_completos"])
+        if not _PATRON_AGREGACION.search(sql_final):
+            con_limit = _inyectar_limit(sql_final, LIMITE_INYECTADO)
+            if con_limit:
+                sql_final = con_limit
+                motivos.append(f"Escaneo completo de {tablas}: se limitó el resultado a {LIMITE_INYECTADO:,} filas.")
+        con_tiempo = _inyectar_tiempo_maximo(sql_final, TIEMPO_MAXIMO_MS)
+        if con_tiempo:
+            sql_final = con_tiempo
+            motivos.append(f"Escaneo completo de {tablas}: tiempo máximo de ejecución {TIEMPO_MAXIMO_MS / 1000:.0f} s.")
+
+    if sql_final == sql.strip().rstrip(";").rstrip():
+        return {"accion": "permitir", "sql": sql, "motivos": motivos, "analisis": analisis}
+    return {"accion": "modificar", "sql": sql_final + ";", "motivos": motivos, "analisis": analisis}
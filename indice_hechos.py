@@ -0,0 +1,187 @@
+# === Índice de hechos para el contexto del asistente (appretail) ===
+# El resumen listaba una línea por empresa y el prompt crecía con la tabla hasta pasarse
+# del contexto del modelo. Aquí cada empresa, producto y recomendación es una frase
+# ("hecho") en un índice BM25 local, en Python puro, y a cada pregunta solo se le agregan
+# los hechos más relevantes dentro de un presupuesto de tokens.
+#
+# El índice se mantiene como el resumen: con `cambios_desde` del almacén se quitan y
+# agregan solo los hechos de las filas que cambiaron (y de las empresas afectadas).
+
+import heapq
+import math
+import re
+import threading
+from collections import Counter, defaultdict
+
+import pandas as pd
+
+from cache_sql import PALABRAS_VACIAS
+from prompt_esquema import _normalizar, _raiz, contar_tokens
+
+TOP_K = 20
+PRESUPUESTO_TOKENS = 1200
+K1 = 1.2  # Saturación de la frecuencia del término (BM25)
+B = 0.75  # Normalización por largo del documento (BM25)
+TABLA_EMPLEADOS = "empresas_empleados"
+# Tabla -> (prefijo del hecho, columna que lo encabeza)
+TABLAS_FILAS = {
+    "productos_ofrecibles": ("Producto", "nombre_producto"),
+    "recomendaciones_empresa_producto": ("Recomendación para", "nombre_empresa"),
+}
+
+
+def terminos(texto):
+    """Términos normalizados (sin acentos, sin palabras vacías, singular) del texto."""
+    return [_raiz(p) for p in re.findall(r"[a-z0-9]+", _normalizar(str(texto))) if p not in PALABRAS_VACIAS]
+
+
+def _formatear(valor):
+    if isinstance(valor, float) and valor.is_integer():
+        return str(int(valor))
+    if isinstance(valor, float):
+        return f"{valor:,.2f}"
+    return str(valor)
+
+
+def hecho_fila(tabla, fila):
+    """Frase con los valores no nulos de una fila de productos o recomendaciones."""
+    prefijo, principal = TABLAS_FILAS[tabla]
+    partes = [f"{columna}: {_formatear(valor)}" for columna, valor in fila.items()
+              if columna != principal and not columna.endswith("_id") and not pd.isna(valor)]
+    return f"{prefijo} {fila.get(principal, '')}: " + "; ".join(partes)
+
+
+class IndiceBM25:
+    """Índice invertido con puntuación BM25; admite agregar y quitar documentos sueltos."""
+
+    def __init__(self):
+        self.documentos = {}  # id -> (texto, términos, tokens del texto)
+        self.postings = defaultdict(dict)  # término -> {id: frecuencia}
+        self.largo_total = 0
+
+    def agregar(self, id_doc, texto):
+        self.quitar(id_doc)
+        lista = terminos(texto)
+        for termino, frecuencia in Counter(lista).items():
+            self.postings[termino][id_doc] = frecuencia
+        self.documentos[id_doc] = (texto, lista, contar_tokens(texto))
+        self.largo_total += len(lista)
+
+    def quitar(self, id_doc):
+        documento = self.documentos.pop(id_doc, None)
+        if documento is None:
+            return
+        for termino in set(documento[1]):
+            del self.postings[termino][id_doc]
+            if not self.postings[termino]:
+                del self.postings[termino]
+        self.largo_total -= len(documento[1])
+
+    def buscar(self, consulta, k):
+        """[(puntaje, id)] de los k documentos con mayor puntaje (> 0) para la consulta."""
+        n = len(self.documentos)
+        if not n:
+            return []
+        promedio = self.largo_total / n or 1
+        puntajes = defaultdict(float)
+        for termino in set(terminos(consulta)):
+            postings = self.postings.get(termino)
+            if not postings:
+                continue
+            idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for id_doc, frecuencia in postings.items():
+                largo = len(self.documentos[id_doc][1])
+                puntajes[id_doc] += idf * frecuencia * (K1 + 1) / (frecuencia + K1 * (1 - B + B * largo / promedio))
+        return heapq.nlargest(k, ((p, i) for i, p in puntajes.items()), key=lambda par: par[0])
+
+
+class IndiceHechos:
+    """Hechos de empresas (del resumen incremental), productos y recomendaciones."""
+
+    def __init__(self, almacen, resumen):
+        self.almacen = almacen
+        self.resumen = resumen
+        self.indice = IndiceBM25()
+        self._lock = threading.Lock()
+        self._versiones = {}  # tabla -> versión del almacén ya indexada
+        self._ids = defaultdict(set)  # tabla -> ids de sus hechos
+        self.estadisticas = {"reconstrucciones": 0, "hechos_actualizados": 0, "busquedas": 0}
+
+    def _reemplazar(self, tabla, hechos, quitar=()):
+        for id_doc in quitar:
+            self.indice.quitar(id_doc)
+            self._ids[tabla].discard(id_doc)
+        for id_doc, texto in hechos.items():
+            self.indice.agregar(id_doc, texto)
+            self._ids[tabla].add(id_doc)
+        self.estadisticas["hechos_actualizados"] += len(hechos)
+
+    def _sincronizar_empresas(self):
+        # Primero la versión del almacén y después el resumen, que queda en esa versión o una
+        # posterior: así nunca se marca como indexado un cambio con datos anteriores.
+        version, _, deltas = self.almacen.cambios_desde(TABLA_EMPLEADOS, self._versiones.get(TABLA_EMPLEADOS))
+        if version == self._versiones.get(TABLA_EMPLEADOS):
+            return
+        if deltas is None:
+            hechos = self.resumen.hechos_empresas()
+            self._reemplazar(TABLA_EMPLEADOS, {("empresa", e): t for e, t in hechos.items()},
+                             quitar=list(self._ids[TABLA_EMPLEADOS]))
+            self.estadisticas["reconstrucciones"] += 1
+        else:
+            empresas = set()
+            for quitadas, agregadas in deltas:
+                empresas.update(quitadas["nombre_empresa"].dropna().tolist())
+                empresas.update(agregadas["nombre_empresa"].dropna().tolist())
+            hechos = self.resumen.hechos_empresas(empresas)
+            self._reemplazar(TABLA_EMPLEADOS, {("empresa", e): t for e, t in hechos.items()},
+                             quitar=[("empresa", e) for e in empresas if e not in hechos])
+        self._versiones[TABLA_EMPLEADOS] = version
+
+    def _sincronizar_filas(self, tabla):
+        version, df, deltas = self.almacen.cambios_desde(tabla, self._versiones.get(tabla))
+        if version == self._versiones.get(tabla):
+            return
+        clave = self.almacen.clave(tabla)
+        if deltas is None:
+            ids = df[clave].tolist() if clave else range(len(df))  # Sin clave solo hay recargas completas
+            hechos = {(tabla, i): hecho_fila(tabla, fila) for i, fila in zip(ids, df.to_dict("records"))}
+            self._reemplazar(tabla, hechos, quitar=list(self._ids[tabla]))
+            self.estadisticas["reconstrucciones"] += 1
+        else:
+            for quitadas, agregadas in deltas:
+                hechos = {(tabla, fila[clave]): hecho_fila(tabla, fila) for fila in agregadas.to_dict("records")}
+                self._reemplazar(tabla, hechos, quitar=[(tabla, i) for i in quitadas[clave].tolist()])
+        self._versiones[tabla] = version
+
+    def sincronizar(self):
+        """Pone el índice al día con el almacén."""
+        with self._lock:
+            self._sincronizar_empresas()
+            for tabla in TABLAS_FILAS:
+                self._sincronizar_filas(tabla)
+
+    def seleccionar(self, pregunta, k=TOP_K, presupuesto_tokens=PRESUPUESTO_TOKENS):
+        """Textos de los hechos más relevantes para la pregunta, en orden, sin pasar el presupuesto."""
+        self.sincronizar()
+        with self._lock:
+            self.estadisticas["busquedas"] += 1
+            seleccion, tokens = [], 0
+            for _, id_doc in self.indice.buscar(pregunta, k):
+                texto, _, tokens_hecho = self.indice.documentos[id_doc]
+                if tokens + tokens_hecho > presupuesto_tokens:
+                    continue  # Uno más corto aún puede entrar
+                seleccion.append(texto)
+                tokens += tokens_hecho
+            return seleccion
+
+
+_indices = {}
+_lock = threading.Lock()
+
+
+def obtener_indice(almacen, resumen):
+    """Índice compartido por las sesiones que usan el mismo almacén."""
+    with _lock:
+        if id(almacen) not in _indices:
+            _indices[id(almacen)] = IndiceHechos(almacen, resumen)
+        return _indices[id(almacen)]
@@ -1,142 +1,267 @@
+import os
+import time
+import uuid
 import streamlit as st
 import requests
-from sqlalchemy import create_engine
+from conexion_db import obtener_engine, estadisticas_pool, verificar_salud # Engine con pool compartido por el proceso
 import pandas as pd
-import json
-import matplotlib.pyplot as plt
-import matplotlib
-from io import BytesIO # Necesario para la exportación a Excel
+from cache_sql import cache_global as cache_sql # Caché pregunta → SQL compartida por el proceso
+import cache_resultados # Caché de resultados por versión de tablas
+from ejecucion_streaming import ejecutar_en_streaming # Lectura por bloques con SSCursor
+import decodificacion # DataFrames con dtypes según los tipos de MySQL (fechas, DECIMAL, ENUM)
+import pymysql
+import pipeline # Pool de workers para las etapas independientes de cada pregunta
+from cliente_llm import cliente_global as cliente_llm # Cliente Ollama compartido (keep-alive, reintentos, métricas)
+from planificador_llm import planificador_global as planificador_llm, establecer_sesion # Cola justa y coalescencia de llamadas al LLM
+from prompt_esquema import construir_mensajes_sql, contar_tokens # Prompt de esquema para el LLM
+from guardia_sql import revisar_consulta # Revisión previa del plan con EXPLAIN
+import perfil_resultados # Resumen determinista del resultado y caché de recomendaciones
+from graficos import servicio_graficos # Gráficos sin pyplot, cacheados como PNG
+import exportacion # Exportación bajo demanda por bloques (XLSX, CSV, Parquet)
+import agregados # Tablas de agregados (rollups) y reescritura de consultas GROUP BY
+import asesor_indices # Log de la carga de trabajo para el asesor de índices
+import candidatos_sql # Varias consultas candidatas validadas con EXPLAIN y reparación automática
+import plantillas_sql # Preguntas de plantilla respondidas sin LLM
+import paginacion # Visor paginado por clave para resultados grandes
+import trazas # Tiempos por etapa: log JSONL, métricas Prometheus y panel de diagnóstico
 
 # === Configuración de conexión a la base de datos ===
-username = 'root'
-password = 'root'  # Reemplaza con tu contraseña real
-host = 'localhost'
-port = 3306
-db_name = 'dbseguro' # Asegúrate que este sea el nombre correcto de tu BD
+# Las variables de entorno DB_* permiten apuntar a otra BD (por ejemplo, la del benchmark)
+username = os.environ.get('DB_USER', 'root')
+password = os.environ.get('DB_PASS', 'root')  # Reemplaza con tu contraseña real
+host = os.environ.get('DB_HOST', 'localhost')
+port = int(os.environ.get('DB_PORT', 3306))
+db_name = os.environ.get('DB_NAME', 'dbseguro') # Asegúrate que este sea el nombre correcto de tu BD
 
 try:
-    engine = create_engine(f"mysql+pymysql://{username}:{password}@{host}:{port}/{db_name}")
+    # Se crea una sola vez por proceso; los reruns y sesiones siguientes reutilizan el pool ya caliente
+    engine = obtener_engine(f"mysql+pymysql://{username}:{password}@{host}:{port}/{db_name}")
 except Exception as e:
     st.error(f"Error al crear el engine de SQLAlchemy: {e}")
     st.stop()
 
-# === Conversión de pregunta a SQL ===
-def pregunta_a_sql(pregunta):
-    # Prompt actualizado para reflejar el nuevo esquema de la base de datos
-    prompt = (
-        "Tienes las siguientes tablas en la base de datos MySQL llamada dbseguro:\n"
-        "• afiliados(id_afiliado, nombre, documento, fecha_nacimiento, genero, actividad_economica, provincia, ciudad, codigo_postal, antiguedad_meses, fecha_afiliacion)\n"
-        "• productos(id_producto, nombre, tipo_seguro, riesgos_cubiertos, deducible, condiciones_generales)\n"
-        "• polizas(id_poliza, id_afiliado, id_producto, fecha_inicio, fecha_fin, estado, monto_asegurado, prima, tipo_riesgo, vigencia_meses)\n"
-        "• siniestros(id_siniestro, id_poliza, id_afiliado, fecha_siniestro, fecha_denuncia, tipo_siniestro, estado_siniestro, provincia, ciudad, causa, descripcion, gravedad)\n"
-        "• pagos_siniestros(id_pago, id_siniestro, fecha_pago, monto_pagado, estado_pago, tipo_pago, moneda, cuenta_destino)\n"
-        "• evaluaciones_siniestro(id_evaluacion, id_siniestro, id_perito, fecha_evaluacion, monto_estimado, monto_rechazado, motivo_rechazo, puntaje_fraude, comentarios)\n"
-        "\n"
-        "Detalles importantes sobre los valores en las columnas y relaciones:\n"
-        "- La tabla 'afiliados' contiene información de los clientes.\n"
-        "- La tabla 'productos' describe los seguros ofrecidos.\n"
-        "- La tabla 'polizas' vincula a un 'afiliado' (mediante 'id_afiliado') con un 'producto' (mediante 'id_producto') y detalla la cobertura.\n"
-        "  - 'polizas.estado' puede ser: 'Activa', 'Cancelada', 'Vencida'.\n"
-        "  - 'polizas.tipo_riesgo' puede ser: 'Alto', 'Medio', 'Bajo'.\n"
-        "- La tabla 'siniestros' registra los incidentes reportados bajo una 'poliza' (mediante 'id_poliza') por un 'afiliado' (mediante 'id_afiliado').\n"
-        "  - 'siniestros.estado_siniestro' puede ser: 'Pendiente', 'Pagado', 'Rechazado'.\n"
-        "  - 'siniestros.gravedad' puede ser: 'Leve', 'Moderada', 'Grave'.\n"
-        "- La tabla 'pagos_siniestros' detalla los pagos realizados por un 'siniestro' (mediante 'id_siniestro').\n"
-        "  - 'pagos_siniestros.estado_pago' puede ser: 'Procesado', 'Pendiente'.\n"
-        "- La tabla 'evaluaciones_siniestro' contiene los detalles de la evaluación de un 'siniestro' (mediante 'id_siniestro').\n"
-        "- 'afiliados.genero' puede ser: 'M' (Masculino), 'F' (Femenino).\n"
-        "- Las columnas de fecha son: afiliados.fecha_nacimiento, afiliados.fecha_afiliacion, polizas.fecha_inicio, polizas.fecha_fin, siniestros.fecha_siniestro, siniestros.fecha_denuncia, pagos_siniestros.fecha_pago, evaluaciones_siniestro.fecha_evaluacion.\n"
-        "REGLA CRÍTICA PARA FECHAS Y AGRUPACIONES: Las funciones de fecha como YEAR(col_fecha), MONTH(col_fecha), DAY(col_fecha) y DATE_FORMAT(col_fecha, 'formato') SOLO deben usarse en columnas que son explícitamente de tipo fecha (las listadas arriba). NUNCA uses funciones de fecha en columnas de texto como 'provincia', 'ciudad', 'nombre', 'tipo_seguro', 'estado_siniestro', etc. Si la pregunta pide agrupar por 'año-mes' de una columna de fecha real, puedes usar DATE_FORMAT(col_fecha_real, '%Y-%m') AS anio_mes. Para agrupaciones por columnas de texto como 'ciudad' o 'provincia', simplemente usa el nombre de la columna en el SELECT y en el GROUP BY. Por ejemplo, para 'Número de afiliados por ciudad', el SQL sería: SELECT ciudad, COUNT(id_afiliado) FROM afiliados GROUP BY ciudad.\n"
-        f"\nConvierte esta pregunta en SQL compatible con MySQL / SingleStore: '{pregunta}'. "
-        f"Solo devuelve el SQL, sin explicaciones ni comentarios. "
-        "Si la pregunta implica contar o sumar por categorías (por ejemplo, 'cuántos por provincia', 'total por tipo_seguro', 'suma por año de fecha_siniestro', 'conteo por mes de fecha_afiliacion'), "
-        "asegúrate de incluir la función de agregación (COUNT, SUM, etc.) en el SELECT y usar GROUP BY en la consulta SQL para obtener los resultados agregados por categoría. Por ejemplo, para 'conteo por mes de fecha_afiliacion en 2023', el SELECT podría ser DATE_FORMAT(fecha_afiliacion, '%Y-%m') AS anio_mes, COUNT(id_afiliado) AS cantidad_afiliados o YEAR(fecha_afiliacion) AS anio, MONTH(fecha_afiliacion) AS mes, COUNT(id_afiliado) AS cantidad_afiliados, y el WHERE incluiría YEAR(fecha_afiliacion) = 2023."
-        
-    )
-    url = "http://localhost:11434/api/chat"
-    # Asegúrate que "gemma3" sea el nombre correcto del modelo en Ollama (ej. gemma:7b, llama3).
-    # Si usas una variante específica, cámbialo aquí.
-    payload = {"model": "gemma3", "messages": [{"role": "user", "content": prompt}], "stream": True}
-    headers = {"Content-Type": "application/json"}
+# Modelo de Ollama para generar SQL y recomendaciones; se precarga al arrancar el proceso
+MODELO_SQL = "gemma3"
+cliente_llm.calentar_en_segundo_plano(MODELO_SQL)
+trazas.iniciar_servidor_metricas() # Solo si PUERTO_METRICAS está definido
 
-    sql_parts = []
-    try:
-        response = requests.post(url, data=json.dumps(payload), headers=headers, stream=True, timeout=60)
-        response.raise_for_status()
+# True: esquema completo + reglas en un mensaje de sistema fijo (reutiliza la caché KV de Ollama).
+# False: solo las tablas relevantes junto a la pregunta (mejor si el modelo se recarga a menudo).
+PREFIJO_ESTABLE = True
 
-        for line in response.iter_lines():
-            if line:
-                try:
-                    line_json = json.loads(line.decode('utf-8'))
-                    if 'message' in line_json and 'content' in line_json['message']:
-                        sql_parts.append(line_json['message']['content'])
-                    elif line_json.get("done") and not sql_parts and line_json.get("total_duration", 0) > 0:
-                        if not sql_parts:
-                            st.warning("El modelo finalizó la respuesta pero no generó contenido SQL.")
-                            return ""
-                except json.JSONDecodeError:
+# Ejecutar las consultas en streaming (SSCursor) con presupuesto de filas/bytes
+EJECUCION_STREAMING = True
+MAX_FILAS_RESULTADO = 200_000
+MAX_MB_RESULTADO = 200
+
+# Responder las agregaciones que encajan desde las tablas agr_* (si están instaladas)
+USAR_AGREGADOS = True
+
+# Consultas candidatas pedidas a la vez (modelo, temperatura), en orden de preferencia: se
+# ejecuta la primera de la lista que MySQL acepta con EXPLAIN. Por defecto una sola (se recibe
+# en streaming); agregar variantes, p. ej. (MODELO_SQL, 0.4), multiplica la carga del LLM.
+CANDIDATOS_SQL = [(MODELO_SQL, 0.0)]
+# Si la consulta falla en MySQL, devolver el error al LLM para un único intento de corrección
+REPARAR_SQL = True
+
+# Responder sin LLM las preguntas que encajan con seguridad en una plantilla (conteos, promedios
+# y totales por columna/mes/año con filtros por valores conocidos de la BD)
+USAR_PLANTILLAS = True
+if USAR_PLANTILLAS:
+    plantillas_sql.precargar(engine) # Diccionario de valores en segundo plano
+
+# === Conversión de pregunta a SQL ===
+def pregunta_a_sql(pregunta):
+    with trazas.tramo("generar_sql") as tramo:
+        # Preguntas de plantilla: SQL armado localmente en milisegundos, sin pasar por el modelo
+        if USAR_PLANTILLAS:
+            with trazas.tramo("sql.plantilla") as tramo_plantilla:
+                sql_plantilla = plantillas_sql.responder(engine, pregunta)
+                tramo_plantilla["acierto"] = sql_plantilla is not None
+            if sql_plantilla:
+                tramo["plantilla"] = True
+                return sql_plantilla
+
+        # Si la pregunta (o una casi idéntica) ya se tradujo antes, evitar la llamada al LLM
+        sql_cacheado, st.session_state.clave_cache_sql = cache_sql.buscar(pregunta)
+        tramo["cache"] = bool(sql_cacheado)
+        if sql_cacheado:
+            return sql_cacheado
+
+        # Prefijo estable (esquema + reglas) como mensaje de sistema idéntico en cada pregunta,
+        # para que Ollama reutilice su caché KV; la pregunta va sola en el mensaje de usuario.
+        mensajes, tablas_prompt = construir_mensajes_sql(engine, pregunta, db_name, prefijo_estable=PREFIJO_ESTABLE)
+        st.session_state.info_prompt = {
+            "tablas": tablas_prompt,
+            "tokens_estimados": contar_tokens("".join(m["content"] for m in mensajes)),
+        }
+        tramo["tablas"] = len(tablas_prompt) if tablas_prompt else "todas"
+        tramo["tokens_estimados"] = st.session_state.info_prompt["tokens_estimados"]
+
+        # Asegúrate que "gemma3" sea el nombre correcto del modelo en Ollama (ej. gemma:7b, llama3).
+        # Si usas una variante específica, cámbiala en MODELO_SQL.
+
+        sql_parts = []
+        aviso_cola = st.empty()
+        metrica = {}
+
+        def avisar_cola(posicion, eta):
+            aviso_cola.info(f"⏳ En cola para el modelo: posición {posicion}, empieza en ~{eta:.0f} s")
+
+        try:
+            # Pasa por la cola compartida: concurrencia acotada, turnos por sesión y timeout según lo medido
+            if len(CANDIDATOS_SQL) > 1:
+                eleccion = candidatos_sql.generar_validada(planificador_llm, engine, mensajes, CANDIDATOS_SQL,
+                                                           al_esperar=avisar_cola)
+                aviso_cola.empty()
+                if eleccion["texto"]:
+                    sql_parts.append(eleccion["texto"])
+                metrica = eleccion["metrica"]
+                tramo["candidatos"] = eleccion["candidatos"]
+                tramo["temperatura"] = eleccion["temperatura"]
+                tramo["valido"] = eleccion["error"] is None
+            else:
+                for fragmento in planificador_llm.chat_stream(mensajes, modelo=MODELO_SQL, al_terminar=metrica.update,
+                                                              al_esperar=avisar_cola):
                     if not sql_parts:
-                        st.warning(f"No se pudo decodificar una línea de la respuesta del modelo: {line.decode('utf-8')}")
-                    continue
+                        aviso_cola.empty()
+                    sql_parts.append(fragmento)
+            if metrica:
+                st.session_state.info_prompt["tokens_evaluados"] = metrica["tokens_prompt"]
         
-        if not sql_parts:
-            st.warning("No se recibieron partes de SQL válidas del modelo.")
-            return ""
+            if not sql_parts:
+                st.warning("No se recibieron partes de SQL válidas del modelo.")
+                return ""
 
-        sql = ''.join(sql_parts)
-        sql = sql.replace('```sql', '').replace('```', '').strip()
+            sql = ''.join(sql_parts)
+            sql = sql.replace('```sql', '').replace('```', '').strip()
         
-        if sql.endswith(';'):
-            sql = sql[:-1].strip()
+            if sql.endswith(';'):
+                sql = sql[:-1].strip()
 
-        if sql:
-            sql += ';'
-        else:
-            st.warning("El SQL generado está vacío después de la limpieza.")
-            return ""
+            if sql:
+                sql += ';'
+            else:
+                st.warning("El SQL generado está vacío después de la limpieza.")
+                return ""
         
-        if sql.strip() == ';':
-            st.warning("El SQL generado es inválido (solo un punto y coma).")
-            return ""
+            if sql.strip() == ';':
+                st.warning("El SQL generado es inválido (solo un punto y coma).")
+                return ""
 
-        if not (sql.lower().startswith("select") or sql.lower().startswith("with")):
-            st.warning(f"El SQL generado no parece ser una consulta SELECT válida: {sql}")
-            # Considerar devolver "" o el SQL para que falle y muestre error.
+            if not (sql.lower().startswith("select") or sql.lower().startswith("with")):
+                st.warning(f"El SQL generado no parece ser una consulta SELECT válida: {sql}")
+                # Considerar devolver "" o el SQL para que falle y muestre error.
+            else:
+                cache_sql.guardar(pregunta, sql)
 
-        return sql
+            return sql
 
-    except requests.exceptions.Timeout:
-        st.error("Timeout al conectar con Ollama. El modelo está tardando demasiado en responder.")
-        return ""
-    except requests.exceptions.RequestException as e:
-        st.error(f"Error de conexión con Ollama: {e}")
-        return ""
-    except Exception as e:
-        st.error(f"Error procesando la respuesta de Ollama: {e}")
-        return ""
+        except requests.exceptions.Timeout:
+            st.error("Timeout al conectar con Ollama. El modelo está tardando demasiado en responder.")
+            return ""
+        except requests.exceptions.RequestException as e:
+            st.error(f"Error de conexión con Ollama: {e}")
+            return ""
+        except Exception as e:
+            st.error(f"Error procesando la respuesta de Ollama: {e}")
+            return ""
 
 # === Ejecutar SQL ===
-def ejecutar_sql(sql_query):
+def ejecutar_sql(sql_query, al_fallar=None):
+    # al_fallar(sql, error) puede devolver un SQL corregido: se ejecuta una vez en su lugar
     if not sql_query or not sql_query.strip() or sql_query.strip() == ';':
         st.warning("No se proporcionó una consulta SQL para ejecutar.")
         return None
     try:
-        # Escapar el carácter '%' para que no sea interpretado por el conector DB-API
-        sql_query_escaped = sql_query.replace('%', '%%')
-
         with engine.connect() as connection:
-            df = pd.read_sql_query(sql_query_escaped, connection) # Usar la query escapada
+            # Si ninguna tabla usada cambió desde la última ejecución, reutilizar el resultado
+            with trazas.tramo("sql.cache") as tramo:
+                sellos = cache_resultados.sellos_version(connection, sql_query)
+                df_cacheado = cache_resultados.cache_global.buscar(sql_query, sellos)
+                tramo["acierto"] = df_cacheado is not None
+            if df_cacheado is not None:
+                return df_cacheado
+
+            # Las agregaciones que encajan en una tabla de agregados se responden desde ella
+            sql_reescrito, agregado = sql_query, None
+            if USAR_AGREGADOS:
+                with trazas.tramo("sql.reescritura") as tramo:
+                    sql_reescrito, agregado = agregados.reescribir_consulta(engine, sql_query)
+                    tramo["agregado"] = agregado
+
+            # Revisar el plan antes de ejecutar: rechazar consultas desbocadas o acotarlas
+            with trazas.tramo("sql.revision") as tramo:
+                revision = revisar_consulta(connection, sql_reescrito)
+                tramo["accion"] = revision["accion"]
+            if revision["accion"] == "rechazar":
+                st.error("❌ La consulta generada es demasiado costosa y no se ejecutó. " + " ".join(revision["motivos"]))
+                st.code(f"{sql_query}", language="sql")
+                return None
+            if revision["accion"] == "modificar":
+                st.info("ℹ️ " + " ".join(revision["motivos"]))
+            sql_a_ejecutar = revision["sql"]
+            inicio_ejecucion = time.perf_counter()
+            if not EJECUCION_STREAMING:
+                with trazas.tramo("sql.ejecucion") as tramo:
+                    with decodificacion.sin_conversion_python(connection.connection.dbapi_connection):
+                        resultado_bd = connection.exec_driver_sql(sql_a_ejecutar.replace('%', '%%')) # Usar la query escapada
+                    columnas = decodificacion.describir(resultado_bd.cursor)
+                    df = decodificacion.a_dataframe(resultado_bd.fetchall(), columnas)
+                    tramo["filas"] = len(df)
+                    tramo["bytes"] = int(df.memory_usage(deep=True).sum())
+
+        if EJECUCION_STREAMING:
+            # Mostrar el primer bloque mientras el resto del resultado sigue llegando
+            vista_previa = st.empty()
+            progreso = st.empty()
+
+            def mostrar_bloque(bloque, filas_leidas):
+                if filas_leidas == len(bloque):
+                    vista_previa.dataframe(bloque.head(100))
+                progreso.caption(f"Recibiendo resultados... {filas_leidas:,} filas")
+
+            try:
+                with trazas.tramo("sql.ejecucion") as tramo:
+                    df = ejecutar_en_streaming(engine, sql_a_ejecutar, max_filas=MAX_FILAS_RESULTADO,
+                                               max_bytes=MAX_MB_RESULTADO * 1024 * 1024, al_recibir_bloque=mostrar_bloque)
+                    tramo["filas"] = df.attrs["streaming"]["filas"]
+                    tramo["bytes"] = df.attrs["streaming"]["bytes"]
+                    tramo["truncado"] = df.attrs["streaming"]["truncado"]
+            finally:
+                vista_previa.empty()
+                progreso.empty()
+        if not agregado: # Respondida desde agr_*: no toca las tablas base, no es carga para sus índices
+            asesor_indices.registrar_consulta(sql_query, time.perf_counter() - inicio_ejecucion, len(df)) # La consulta pedida, sin el LIMIT de la guardia
         
-        # Conversión tentativa a datetime para columnas que contengan 'fecha' o 'mes'
-        for col in df.columns:
-            # Ampliar la detección de columnas de fecha
-            if 'fecha' in col.lower() or col.lower().endswith('_at') or col.lower().startswith('date_') or 'nacimiento' in col.lower():
-                try:
-                    df[col] = pd.to_datetime(df[col], errors='coerce') 
-                except Exception: 
-                    pass # Si falla la conversión, se deja la columna como está
+        # DATE/DATETIME, DECIMAL y ENUM ya llegan con su dtype (según el tipo del cursor). Solo el
+        # texto con nombre de fecha (p. ej. fechas guardadas en VARCHAR) se intenta convertir.
+        with trazas.tramo("sql.fechas") as tramo:
+            columnas_fecha = 0
+            for i, col in enumerate(df.columns):
+                if not pd.api.types.is_string_dtype(df.dtypes.iloc[i]):
+                    continue
+                # Ampliar la detección de columnas de fecha
+                if 'fecha' in col.lower() or col.lower().endswith('_at') or col.lower().startswith('date_') or 'nacimiento' in col.lower():
+                    try:
+                        df.isetitem(i, pd.to_datetime(df.iloc[:, i], errors='coerce'))
+                        columnas_fecha += 1
+                    except Exception: 
+                        pass # Si falla la conversión, se deja la columna como está
+            tramo["columnas"] = columnas_fecha
+        df.attrs["sql"] = sql_a_ejecutar # Para perfilar el resultado completo en MySQL si se truncó
+        df.attrs["agregado"] = agregado
+        # Escaneo completo de una tabla grande: el perfil no vuelve a ejecutar la consulta en MySQL
+        df.attrs["escaneo_completo"] = bool(revision["analisis"] and revision["analisis"]["escaneos_completos"])
+        cache_resultados.cache_global.guardar(sql_query, sellos, df)
         return df
-    except pd.errors.DatabaseError as e: # Errores específicos de Pandas/SQLAlchemy al ejecutar SQL
+    except (pd.errors.DatabaseError, pymysql.err.MySQLError) as e: # Errores de la BD al ejecutar SQL
+        st.session_state.error_bd = str(e) # Solo este SQL es culpa del generado: invalida la caché
+        sql_reparado = al_fallar(sql_query, str(e)) if al_fallar is not None else ""
+        if sql_reparado:
+            st.info(f"🔧 La consulta falló ({e}). Se corrigió automáticamente:")
+            st.code(sql_reparado, language="sql")
+            return ejecutar_sql(sql_reparado)
         st.error(f"❌ Error de base de datos al ejecutar SQL: {e}")
         st.code(f"{sql_query}", language="sql") # Mostrar el SQL original que falló
         return None
@@ -145,16 +270,40 @@ def ejecutar_sql(sql_query):
         st.code(f"{sql_query}", language="sql")
         return None
 
+def reparar_sql(pregunta, sql_fallido, error):
+    # Un intento de corrección: el LLM recibe su consulta y el error de MySQL
+    if not REPARAR_SQL:
+        return ""
+    mensajes, _ = construir_mensajes_sql(engine, pregunta, db_name, prefijo_estable=PREFIJO_ESTABLE)
+    try:
+        with st.spinner("La consulta falló; pidiendo una corrección al modelo..."):
+            sql_reparado = candidatos_sql.reparar(planificador_llm, mensajes, MODELO_SQL, sql_fallido, error)
+    except requests.exceptions.RequestException:
+        return ""
+    if sql_reparado:
+        st.session_state.sql_generado = sql_reparado
+    return sql_reparado
+
 # === Generar recomendación ===
-def generar_insight(dataframe):
+def generar_insight_stream(dataframe):
+    """Genera la recomendación token a token (se ejecuta en un worker: sin llamadas a st.*)."""
     if dataframe is None or dataframe.empty:
-        return "No se puede generar una recomendación porque no hay datos."
+        yield "No se puede generar una recomendación porque no hay datos."
+        return
     
-    # Crear un resumen más conciso si el dataframe es muy grande
-    if len(dataframe) > 100:
-        resumen_df = dataframe.sample(n=100).describe(include='all').to_string()
-    else:
-        resumen_df = dataframe.describe(include='all').to_string()
+    # El mismo resultado produce siempre el mismo resumen: si ya se generó una recomendación, reutilizarla
+    with trazas.tramo("insight.cache") as tramo:
+        huella = perfil_resultados.huella_resultado(dataframe)
+        insight_cacheado = perfil_resultados.cache_insights.buscar(huella, MODELO_SQL)
+        tramo["acierto"] = insight_cacheado is not None
+    if insight_cacheado:
+        yield insight_cacheado
+        return
+
+    # Resumen determinista: en memoria, o agregados en MySQL si la lectura se truncó
+    with trazas.tramo("insight.perfil") as tramo:
+        resumen_df = perfil_resultados.perfil_a_texto(perfil_resultados.perfilar(dataframe, engine))
+        tramo["caracteres"] = len(resumen_df)
 
     prompt_insight = (
         f"Analiza el siguiente resumen estadístico de una consulta a una base de datos de seguros:\n\n{resumen_df}\n\n"
@@ -170,81 +319,117 @@ def generar_insight(dataframe):
         # "No repitas los números del resumen, enfócate en la interpretación."
 
     )
-    url = "http://localhost:11434/api/chat"
-    # Asegúrate que "gemma3" sea el nombre correcto del modelo en Ollama.
-    payload = {"model": "gemma3", "messages": [{"role": "user", "content": prompt_insight}], "stream": True}
-    headers = {"Content-Type": "application/json"}
+    # Asegúrate que MODELO_SQL sea el nombre correcto del modelo en Ollama.
+    mensajes = [{"role": "user", "content": prompt_insight}]
     
-    insight_parts = []
+    partes = []
     try:
-        response = requests.post(url, data=json.dumps(payload), headers=headers, stream=True, timeout=45)
-        response.raise_for_status()
-        for line in response.iter_lines():
-            if line:
-                try:
-                    line_json = json.loads(line.decode('utf-8'))
-                    if 'message' in line_json and 'content' in line_json['message']:
-                        insight_parts.append(line_json['message']['content'])
-                except json.JSONDecodeError:
-                    if not insight_parts:
-                         st.warning(f"Error decodificando respuesta para insight: {line.decode('utf-8')}")
-                    continue
+        for fragmento in planificador_llm.chat_stream(mensajes, modelo=MODELO_SQL):
+            partes.append(fragmento)
+            yield fragmento
         
-        if not insight_parts:
-            return "El modelo no generó una recomendación."
-            
-        # Limpiar el texto del insight antes de devolverlo
-        cleaned_insight = ' '.join(''.join(insight_parts).strip().split())
-        return cleaned_insight
+        if not partes:
+            yield "El modelo no generó una recomendación."
+        else:
+            perfil_resultados.cache_insights.guardar(huella, MODELO_SQL, ' '.join(''.join(partes).split()))
 
     except requests.exceptions.Timeout:
-        return "Timeout al generar la recomendación desde el modelo."
+        yield "Timeout al generar la recomendación desde el modelo."
     except Exception as e:
-        return f"Error al generar la recomendación: {e}"
+        yield f"Error al generar la recomendación: {e}"
+
+
+def generar_insight_etapa(dataframe):
+    # Tramo "insight" de punta a punta (caché, perfil y LLM) alrededor del generador
+    with trazas.tramo("insight") as tramo:
+        caracteres = 0
+        for fragmento in generar_insight_stream(dataframe):
+            caracteres += len(fragmento)
+            yield fragmento
+        tramo["caracteres"] = caracteres
+
+
+def generar_insight(dataframe):
+    # Versión bloqueante: devuelve el texto completo y limpio
+    return ' '.join(''.join(generar_insight_stream(dataframe)).strip().split())
 
 
 # === Crear gráfico Matplotlib ===
 def crear_grafico_matplotlib(categorias, valores, etiqueta_categoria, etiqueta_valor):
+    # Devuelve el PNG del gráfico de barras (cacheado por el servicio compartido) o None
     if not categorias or not valores:
         return None
     if len(categorias) != len(valores):
         return None
 
     try:
-        categorias_str = [str(cat) for cat in categorias]
-
         # === AJUSTE DE TAMAÑO DEL GRÁFICO ===
         # Puedes modificar estos valores para cambiar el tamaño del gráfico.
         # El primer valor es el ancho, el segundo es la altura (en pulgadas).
         ancho_grafico = 5 
         alto_grafico = 2
-        fig, ax = plt.subplots(figsize=(ancho_grafico, alto_grafico)) 
         # ===================================
-        
-        bars = ax.bar(categorias_str, valores, color='skyblue')
-
-        ax.set_title(f'Distribución de {etiqueta_valor} por {etiqueta_categoria}', fontsize=8) # Reducido
-        ax.set_xlabel(etiqueta_categoria, fontsize=6) # Reducido
-        ax.set_ylabel(etiqueta_valor, fontsize=6) # Reducido
-        plt.xticks(rotation=45, ha="right", fontsize=5) # Reducido
-        plt.yticks(fontsize=5) # Reducido
-
-        if valores: 
-            ax.set_ylim(0, max(valores) * 1.25 if max(valores) > 0 else 1.25) 
-
-        for bar_item in bars:
-            yval = bar_item.get_height()
-            ax.text(bar_item.get_x() + bar_item.get_width()/2.0, yval + (max(valores)*0.02 if valores and max(valores) > 0 else 0.02), str(round(yval, 2)), ha='center', va='bottom', fontsize=4) # Reducido
-        
-        plt.tight_layout(pad=0.3) # Ajustar padding
-        return fig
-    except Exception as e:
-        st.error(f"Error al crear gráfico Matplotlib: {e}")
-        return None
+        with trazas.tramo("grafico", categorias=len(categorias)) as tramo:
+            png = servicio_graficos.renderizar("barras", categorias, valores, etiqueta_categoria, etiqueta_valor,
+                                               tamano=(ancho_grafico, alto_grafico))
+            tramo["bytes"] = len(png)
+            return png
+    except Exception:
+        return None # El hilo de la UI informa si no hay gráfico
+
+# === Detección de columnas para el gráfico de barras ===
+def detectar_columnas_grafico(resultado_df):
+    # Devuelve (columna_categoria, columna_valor) si el resultado tiene forma categoría + número
+    columnas_resultado = resultado_df.columns.tolist()
+    if len(columnas_resultado) == 2:
+        col1_nombre, col2_nombre = columnas_resultado[0], columnas_resultado[1]
+        if isinstance(col1_nombre, str) and isinstance(col2_nombre, str): # Asegurar que los nombres de columna son strings
+            col1_tipo, col2_tipo = resultado_df[col1_nombre].dtype, resultado_df[col2_nombre].dtype
+            
+            # Lógica para identificar columna categórica (puede ser string o int como año) y numérica
+            es_col1_categoria = pd.api.types.is_string_dtype(col1_tipo) or pd.api.types.is_integer_dtype(col1_tipo) or pd.api.types.is_categorical_dtype(col1_tipo)
+            es_col2_categoria = pd.api.types.is_string_dtype(col2_tipo) or pd.api.types.is_integer_dtype(col2_tipo) or pd.api.types.is_categorical_dtype(col2_tipo)
+
+            if es_col1_categoria and pd.api.types.is_numeric_dtype(col2_tipo):
+                return col1_nombre, col2_nombre
+            elif es_col2_categoria and pd.api.types.is_numeric_dtype(col1_tipo):
+                return col2_nombre, col1_nombre
+    return None, None
+
+# === Preparar reporte para descarga ===
+def preparar_exportacion(resultado_df, formato, pregunta, sql_generado, insight):
+    # Se llama al pulsar "Descargar" (en un hilo aparte, sin st.*): el archivo se escribe
+    # por bloques en disco y se cachea por huella del resultado.
+    hojas_extra = []
+    if insight:
+        hojas_extra.append(("Recomendacion IA", pd.DataFrame({"Recomendacion": [insight]})))
+    hojas_extra.append(("Info Consulta", pd.DataFrame({
+        "Pregunta Original": [pregunta],
+        "SQL Generado": [sql_generado]
+    })))
+    with trazas.tramo("exportacion", formato=formato, filas=len(resultado_df)) as tramo:
+        datos = exportacion.exportar(resultado_df, formato, engine, hojas_extra)
+        tramo["bytes"] = len(datos)
+        return datos
+
+# === Lanzar etapas independientes en paralelo ===
+def lanzar_etapas(resultado_df, pregunta, sql_generado):
+    # Recomendación (LLM) y gráfico se calculan a la vez en el pool de workers;
+    # la exportación se genera solo si el usuario la descarga
+    flujo_insight = pipeline.lanzar_flujo(generar_insight_etapa, resultado_df)
+    col_categoria, col_valor = detectar_columnas_grafico(resultado_df)
+    grafico = None
+    if col_categoria and col_valor:
+        grafico = pipeline.lanzar(crear_grafico_matplotlib, resultado_df[col_categoria].tolist(),
+                                  resultado_df[col_valor].tolist(), col_categoria, col_valor)
+    return {
+        "insight": flujo_insight,
+        "grafico": grafico,
+        "columnas_grafico": (col_categoria, col_valor),
+    }
 
 # === Configuración de página y encabezado visual ===
 st.set_page_config(page_title="Asistente DWConsulware", layout="wide", page_icon="📊")
-matplotlib.use('Agg') # Configurar Matplotlib para backend no interactivo
 
 # Inyectar CSS personalizado para texto más oscuro y cabeceras de tabla en negrita
 st.markdown("""
@@ -324,6 +509,22 @@ if 'resultado' not in st.session_state:
     st.session_state.resultado = None
 if 'insight' not in st.session_state:
     st.session_state.insight = ""
+if 'info_prompt' not in st.session_state:
+    st.session_state.info_prompt = None # Tablas enviadas al LLM y tamaño del prompt de la última pregunta
+if 'clave_cache_sql' not in st.session_state:
+    st.session_state.clave_cache_sql = None # Entrada de la caché SQL que respondió la última pregunta (puede ser una similar)
+if 'trabajos' not in st.session_state:
+    st.session_state.trabajos = {} # Etapas en curso (insight, gráfico, exportación) del último resultado
+if 'vista_resultado' not in st.session_state:
+    st.session_state.vista_resultado = None # Visor paginado (orden, filtros, página) del último resultado
+if 'error_bd' not in st.session_state:
+    st.session_state.error_bd = None # Error de MySQL del último SQL ejecutado (rechazos de la guardia y otros fallos no cuentan)
+if 'traza' not in st.session_state:
+    st.session_state.traza = None # Tiempos por etapa de la última pregunta (panel de diagnóstico)
+trazas.establecer(st.session_state.traza) # Lo que se calcule en este rerun se suma a la última pregunta
+if 'id_sesion' not in st.session_state:
+    st.session_state.id_sesion = uuid.uuid4().hex # Turno propio en la cola del LLM
+establecer_sesion(st.session_state.id_sesion)
 
 
 # === Pregunta del usuario ===
@@ -336,18 +537,80 @@ if st.button("Enviar pregunta", key="btn_enviar_key"):
         st.session_state.resultado = None # Limpiar resultados si la pregunta está vacía
         st.session_state.sql_generado = ""
         st.session_state.insight = ""
+        st.session_state.trabajos = {}
+        st.session_state.vista_resultado = None
     else:
+        st.session_state.trabajos = {}
+        st.session_state.vista_resultado = None
+        st.session_state.traza = trazas.iniciar_traza("pregunta", pregunta=st.session_state.pregunta_usuario)
+        st.session_state.clave_cache_sql = None
+        st.session_state.error_bd = None
         with st.spinner("Generando SQL y obteniendo datos..."):
             st.session_state.sql_generado = pregunta_a_sql(st.session_state.pregunta_usuario)
-            st.session_state.resultado = ejecutar_sql(st.session_state.sql_generado)
+            sql_original = st.session_state.sql_generado
+            with trazas.tramo("ejecutar_sql") as tramo_sql:
+                st.session_state.resultado = ejecutar_sql(
+                    st.session_state.sql_generado,
+                    al_fallar=lambda sql, error: reparar_sql(st.session_state.pregunta_usuario, sql, error))
+                tramo_sql["filas"] = None if st.session_state.resultado is None else len(st.session_state.resultado)
+                tramo_sql["reparado"] = st.session_state.sql_generado != sql_original
+            if st.session_state.resultado is None and st.session_state.error_bd is not None:
+                # No reutilizar un SQL que MySQL rechazó (no si la guardia lo frenó o falló otra cosa)
+                cache_sql.invalidar(st.session_state.pregunta_usuario, st.session_state.clave_cache_sql)
+            elif st.session_state.sql_generado != sql_original:
+                cache_sql.invalidar(st.session_state.pregunta_usuario, st.session_state.clave_cache_sql) # También la similar que falló
+                cache_sql.guardar(st.session_state.pregunta_usuario, st.session_state.sql_generado) # Guardar la versión corregida
         
         if st.session_state.resultado is not None and not st.session_state.resultado.empty:
-            with st.spinner("Generando recomendación..."):
-                st.session_state.insight = generar_insight(st.session_state.resultado)
+            # La tabla se muestra ya; la recomendación se irá escribiendo mientras tanto
+            st.session_state.insight = ""
+            st.session_state.trabajos = lanzar_etapas(st.session_state.resultado, st.session_state.pregunta_usuario,
+                                                      st.session_state.sql_generado)
         else:
             st.session_state.insight = "No hay datos para generar una recomendación."
 
 
+stats_cache = cache_sql.estadisticas()
+stats_resultados = cache_resultados.cache_global.estadisticas()
+stats_insights = perfil_resultados.cache_insights.estadisticas()
+st.caption(f"Caché SQL: {stats_cache['aciertos']} aciertos ({stats_cache['aciertos_similares']} por similitud), {stats_cache['fallos']} fallos, {stats_cache['entradas']} entradas · "
+           f"Caché de resultados: {stats_resultados['aciertos']} aciertos, {stats_resultados['fallos']} fallos, {stats_resultados['bytes'] / 1024**2:.1f} MB · "
+           f"Caché de recomendaciones: {stats_insights['aciertos']} aciertos, {stats_insights['fallos']} fallos")
+stats_plantillas = plantillas_sql.estadisticas()
+if stats_plantillas["consultas"]:
+    st.caption(f"Plantillas sin LLM: {stats_plantillas['aciertos']} de {stats_plantillas['consultas']} preguntas "
+               f"({stats_plantillas['tasa']:.0%}), {stats_plantillas['ms_medio']:.1f} ms de media")
+stats_pool = estadisticas_pool(engine)
+bd_ok, bd_ms, bd_error = verificar_salud(engine) # SELECT 1 con una conexión del pool, como mucho cada SALUD_CADUCIDAD s
+st.caption(f"Pool BD: {stats_pool['en_uso']} en uso, {stats_pool['libres']} libres, overflow {stats_pool['overflow']}, "
+           f"{stats_pool.get('conexiones_nuevas', 0)} conexiones abiertas, {stats_pool.get('checkouts', 0)} checkouts"
+           + (f" · SELECT 1 en {bd_ms:.1f} ms" if bd_ok else ""))
+if not bd_ok:
+    st.warning(f"⚠️ La base de datos no responde ({bd_error}); las consultas fallarán hasta que vuelva.")
+if st.session_state.info_prompt:
+    info_prompt = st.session_state.info_prompt
+    tablas_texto = ", ".join(info_prompt["tablas"]) if info_prompt["tablas"] else "esquema completo"
+    tokens_evaluados = info_prompt.get("tokens_evaluados")
+    # Si Ollama evaluó muchos menos tokens que los enviados, reutilizó el prefijo de su caché KV
+    reutilizado = tokens_evaluados is not None and tokens_evaluados < info_prompt['tokens_estimados'] / 2
+    st.caption(f"Prompt SQL: ~{info_prompt['tokens_estimados']} tokens estimados ({tablas_texto})"
+               + (f", {tokens_evaluados} tokens evaluados por Ollama" if tokens_evaluados is not None else "")
+               + (" — prefijo reutilizado" if reutilizado else ""))
+stats_llm = cliente_llm.resumen_metricas()
+if stats_llm["llamadas"]:
+    primer_token = stats_llm["primer_token_promedio"]
+    velocidad = stats_llm["tokens_por_segundo_promedio"]
+    st.caption(f"LLM: {stats_llm['llamadas']} llamadas"
+               + (f", primer token {primer_token:.2f} s de media" if primer_token is not None else "")
+               + (f", {velocidad:.1f} tokens/s" if velocidad else ""))
+estado_cola = planificador_llm.estado()
+if estado_cola["solicitudes"]:
+    timeout_sql = estado_cola["timeouts"].get(MODELO_SQL)
+    st.caption(f"Cola LLM: {estado_cola['en_curso']}/{estado_cola['concurrencia']} en curso, {estado_cola['en_cola']} en espera "
+               f"({estado_cola['sesiones_en_cola']} sesiones), {estado_cola['coalescidas']} de {estado_cola['solicitudes']} "
+               f"peticiones servidas por otra idéntica, {estado_cola['rechazadas']} rechazadas"
+               + (f", timeout actual {timeout_sql:.0f} s" if timeout_sql else ""))
+
 # === Mostrar resultados si existen usando pestañas ===
 if st.session_state.resultado is not None:
     resultado_df = st.session_state.resultado # Usar el resultado del estado de sesión
@@ -361,44 +624,61 @@ if st.session_state.resultado is not None:
         # Pestaña de Consulta
         with tabs[0]:
             st.markdown("### 📄 Resultado de la consulta")
-            st.dataframe(resultado_df)
+            info_streaming = resultado_df.attrs.get("streaming")
+            if info_streaming and info_streaming["truncado"]:
+                st.warning(f"⚠️ Resultado truncado a {info_streaming['filas']:,} filas: {info_streaming['motivo']}. "
+                           "Agrega filtros o agregaciones a la pregunta para ver el resultado completo.")
+            if resultado_df.attrs.get("agregado"):
+                st.caption(f"⚡ Respondida desde la tabla de agregados `{resultado_df.attrs['agregado']}` "
+                           "(mantenida al día con disparadores).")
+            truncado = bool(info_streaming and info_streaming["truncado"])
+            if (truncado and resultado_df.attrs.get("sql")) or len(resultado_df) > paginacion.TAMANO_PAGINA:
+                try:
+                    if st.session_state.vista_resultado is None:
+                        if truncado:
+                            # Solo se leyó una parte: las páginas se piden a MySQL
+                            st.session_state.vista_resultado = paginacion.VistaPaginada(
+                                engine, resultado_df.attrs["sql"], resultado_df.columns,
+                                numericas=[c for c, t in resultado_df.dtypes.items() if pd.api.types.is_numeric_dtype(t)],
+                                fechas=[c for c, t in resultado_df.dtypes.items() if pd.api.types.is_datetime64_any_dtype(t)])
+                            if not st.session_state.vista_resultado.paginable:
+                                # Sin clave ni ORDER BY (JOIN, GROUP BY...): se paginan las filas ya leídas
+                                st.session_state.vista_resultado = paginacion.VistaMemoria(resultado_df)
+                        else:
+                            # Resultado completo ya en memoria: cada página es un corte del DataFrame
+                            st.session_state.vista_resultado = paginacion.VistaMemoria(resultado_df)
+                    paginacion.mostrar(st.session_state.vista_resultado, "vista_resultado")
+                except Exception as e:
+                    st.caption(f"Visor paginado no disponible ({e}); se muestran las filas ya leídas.")
+                    st.dataframe(resultado_df)
+            else:
+                st.dataframe(resultado_df)
 
         # Pestaña de Gráficos y Recomendación (índice 1)
         with tabs[1]: 
             st.markdown("### 📊 Visualización")
             grafico_mostrado = False
-            columnas_resultado = resultado_df.columns.tolist()
-            
-            col_conteo_detectada = None
-            col_categoria_detectada = None
-
-            if len(columnas_resultado) == 2:
-                col1_nombre, col2_nombre = columnas_resultado[0], columnas_resultado[1]
-                if isinstance(col1_nombre, str) and isinstance(col2_nombre, str): # Asegurar que los nombres de columna son strings
-                    col1_tipo, col2_tipo = resultado_df[col1_nombre].dtype, resultado_df[col2_nombre].dtype
-                    
-                    # Lógica para identificar columna categórica (puede ser string o int como año) y numérica
-                    es_col1_categoria = pd.api.types.is_string_dtype(col1_tipo) or pd.api.types.is_integer_dtype(col1_tipo) or pd.api.types.is_categorical_dtype(col1_tipo)
-                    es_col2_categoria = pd.api.types.is_string_dtype(col2_tipo) or pd.api.types.is_integer_dtype(col2_tipo) or pd.api.types.is_categorical_dtype(col2_tipo)
-
-                    if es_col1_categoria and pd.api.types.is_numeric_dtype(col2_tipo):
-                        col_categoria_detectada, col_conteo_detectada = col1_nombre, col2_nombre
-                    elif es_col2_categoria and pd.api.types.is_numeric_dtype(col1_tipo):
-                        col_categoria_detectada, col_conteo_detectada = col2_nombre, col1_nombre
+            trabajos = st.session_state.trabajos
+            col_categoria_detectada, col_conteo_detectada = trabajos.get("columnas_grafico") or detectar_columnas_grafico(resultado_df)
             
             if col_categoria_detectada and col_conteo_detectada:
                 # Usar columnas para controlar el ancho del gráfico
                 grafico_col, _ = st.columns([1.5, 1]) # Ajustar para que el gráfico sea más pequeño (ej. 1.5 de 2.5 partes)
                 with grafico_col:
-                    figura_matplotlib = crear_grafico_matplotlib(
-                        resultado_df[col_categoria_detectada].tolist(),
-                        resultado_df[col_conteo_detectada].tolist(),
-                        col_categoria_detectada,
-                        col_conteo_detectada
-                    )
-                    if figura_matplotlib:
-                        st.pyplot(figura_matplotlib, use_container_width=True) 
+                    if trabajos.get("grafico") is not None:
+                        png_grafico = trabajos["grafico"].result() # Ya calculado en paralelo
+                    else:
+                        png_grafico = crear_grafico_matplotlib(
+                            resultado_df[col_categoria_detectada].tolist(),
+                            resultado_df[col_conteo_detectada].tolist(),
+                            col_categoria_detectada,
+                            col_conteo_detectada
+                        )
+                    if png_grafico:
+                        st.image(png_grafico, use_container_width=True) 
                         grafico_mostrado = True
+                    else:
+                        st.error("Error al crear gráfico Matplotlib.")
                 
                 # Gráfico de pastel como opción adicional si hay pocas categorías
                 if len(resultado_df[col_categoria_detectada].unique()) <= 10: 
@@ -407,13 +687,12 @@ if st.session_state.resultado is not None:
                         pastel_col, _ = st.columns([1,1]) # Más pequeño para el pastel
                         with pastel_col:
                             try:
-                                fig_pastel, ax_pastel = plt.subplots(figsize=(3,1.8)) # Tamaño más pequeño para el pastel
-                                labels_pastel = resultado_df[col_categoria_detectada].astype(str).tolist()
-                                ax_pastel.pie(resultado_df[col_conteo_detectada], labels=labels_pastel, autopct='%1.1f%%', startangle=90, pctdistance=0.85, textprops={'fontsize': 4}) # Fuente más pequeña
-                                ax_pastel.axis('equal') 
-                                centre_circle = plt.Circle((0,0),0.70,fc='white')
-                                fig_pastel.gca().add_artist(centre_circle)
-                                st.pyplot(fig_pastel, use_container_width=True)
+                                png_pastel = servicio_graficos.renderizar(
+                                    "pastel",
+                                    resultado_df[col_categoria_detectada].astype(str).tolist(),
+                                    resultado_df[col_conteo_detectada].tolist(),
+                                    tamano=(3, 1.8)) # Tamaño más pequeño para el pastel
+                                st.image(png_pastel, use_container_width=True)
                             except Exception as e_pie:
                                 st.error(f"No se pudo generar el gráfico de pastel: {e_pie}")
 
@@ -437,45 +716,47 @@ if st.session_state.resultado is not None:
             # Mostrar la recomendación debajo de los gráficos
             st.markdown("---") # Separador visual
             st.markdown("### 💡 Recomendación del modelo")
+            panel_insight = st.empty() # Se rellena al final del script, token a token
             if st.session_state.insight:
                  cleaned_insight = ' '.join(st.session_state.insight.split())
-                 st.info(cleaned_insight) 
+                 panel_insight.info(cleaned_insight) 
             else:
-                 st.info("Generando recomendación...")
+                 panel_insight.info("Generando recomendación...")
         
         # Pestaña de Exportar (índice 2, ya que Recomendación se movió)
         with tabs[2]: 
             st.markdown("### 📥 Exportar reporte")
-            buffer = BytesIO()
-            try:
-                with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
-                    df_exportar = resultado_df.copy()
-                    for col in df_exportar.columns:
-                        if pd.api.types.is_datetime64_any_dtype(df_exportar[col]):
-                            df_exportar[col] = df_exportar[col].astype(str)
-                        if col.lower() == 'anio' and pd.api.types.is_integer_dtype(df_exportar[col]):
-                            df_exportar[col] = df_exportar[col].astype(str)
-
-                    df_exportar.to_excel(writer, index=False, sheet_name="Resultado Consulta")
-                    
-                    if st.session_state.insight:
-                         pd.DataFrame({"Recomendacion": [st.session_state.insight]}).to_excel(writer, index=False, sheet_name="Recomendacion IA")
-                    
-                    info_consulta_df = pd.DataFrame({
-                        "Pregunta Original": [st.session_state.pregunta_usuario],
-                        "SQL Generado": [st.session_state.sql_generado]
-                    })
-                    info_consulta_df.to_excel(writer, index=False, sheet_name="Info Consulta")
-
-                buffer.seek(0)
-                st.download_button(
-                    label="📥 Descargar Reporte Excel",
-                    data=buffer,
-                    file_name="reporte_aseguradora.xlsx",
-                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-                )
-            except Exception as e_export:
-                st.error(f"Error al generar el archivo Excel: {e_export}")
+            formato_exportacion = st.radio("Formato:", list(exportacion.FORMATOS), horizontal=True,
+                                           format_func=lambda f: exportacion.FORMATOS[f]["etiqueta"], key="formato_exportacion")
+            panel_exportacion = st.empty() # El botón se muestra cuando la recomendación está lista
+            panel_exportacion.info("Preparando el reporte...")
+
+        # === Completar las etapas en curso sin bloquear lo ya mostrado ===
+        trabajos = st.session_state.trabajos
+        flujo_insight = trabajos.get("insight")
+        if flujo_insight is not None and not st.session_state.insight:
+            for texto_parcial in flujo_insight.iterar_textos():
+                panel_insight.info(' '.join(texto_parcial.split()) + " ▌")
+            st.session_state.insight = ' '.join(flujo_insight.texto.split()) or "El modelo no generó una recomendación."
+            panel_insight.info(st.session_state.insight)
+
+        # El archivo no se genera en cada rerun: download_button llama a la función al hacer clic
+        datos_formato = exportacion.FORMATOS[formato_exportacion]
+        pregunta_exportar, sql_exportar, insight_exportar = (st.session_state.pregunta_usuario, st.session_state.sql_generado,
+                                                             st.session_state.insight)
+        traza_exportar = st.session_state.traza # El callback corre en otro hilo: la traza se pasa explícitamente
+
+        def datos_exportacion():
+            with trazas.activar(traza_exportar):
+                return preparar_exportacion(resultado_df, formato_exportacion, pregunta_exportar, sql_exportar, insight_exportar)
+
+        panel_exportacion.download_button(
+            label=f"📥 Descargar Reporte {datos_formato['etiqueta']}",
+            data=datos_exportacion,
+            file_name=f"reporte_aseguradora.{datos_formato['extension']}",
+            mime=datos_formato["mime"],
+            on_click="ignore" # Descargar no vuelve a ejecutar el script
+        )
         
 
     elif st.session_state.sql_generado: 
@@ -485,3 +766,10 @@ if st.session_state.resultado is not None:
             st.code(st.session_state.sql_generado, language='sql')
     # No mostrar nada si no se ha presionado el botón y no hay resultados previos en sesión.
 
+# === Diagnóstico de tiempos de la última pregunta ===
+if st.session_state.traza is not None:
+    traza = st.session_state.traza
+    with st.expander("⏱ Diagnóstico"):
+        st.caption(f"Traza {traza.id} · {traza.duracion_ms() / 1000:.2f} s desde que se envió la pregunta "
+                   f"(las etapas en paralelo se solapan; la exportación aparece al descargar)")
+        st.dataframe(pd.DataFrame(trazas.tabla_tramos(traza)), hide_index=True, use_container_width=True)
@@ -0,0 +1,326 @@
+# === Visor paginado de resultados (paginación por clave en el servidor) ===
+# st.dataframe con el resultado entero serializa todas las filas al navegador en cada
+# rerun. El visor deja la consulta en MySQL y pide solo la página que se muestra:
+#
+# - Paginación por clave (keyset): la consulta se envuelve como tabla derivada y cada
+#   página continúa desde la última fila de la anterior (`WHERE (orden, id) > (...)
+#   ORDER BY orden, id LIMIT n`), así la página 1.000 cuesta lo mismo que la primera.
+#   La clave es la clave primaria completa de la tabla cuando la consulta lee una sola
+#   (sin JOIN, GROUP BY, DISTINCT...) y la selecciona; si no, o si la última clave tiene
+#   NULL, se usa OFFSET: un id_afiliado tras un JOIN se repite y saltaría filas.
+#   Sin orden elegido y con ORDER BY en la consulta se respeta su orden (MySQL lo propaga
+#   desde la tabla derivada si la consulta externa no ordena) y se pagina con OFFSET.
+# - OFFSET es limitado: cada página vuelve a ejecutar la consulta base y descarta las filas
+#   anteriores, y con un orden elegido sin clave las filas empatadas pueden repetirse o
+#   faltar entre páginas. Sin clave ni ORDER BY propio la consulta no es paginable en el
+#   servidor (`paginable` es False): se usa `VistaMemoria` sobre las filas ya leídas.
+# - Orden y filtros se aplican en el SQL, no sobre lo ya descargado.
+# - La página siguiente se precarga en el pool mientras el usuario mira la actual.
+# - El total sale del resultado si se leyó completo, o de la estimación de EXPLAIN.
+#
+# Si el resultado ya se leyó completo, `VistaMemoria` pagina el DataFrame (misma interfaz,
+# sin volver a MySQL) y `mostrar` dibuja cualquiera de las dos con sus controles.
+
+import json
+import re
+
+import pandas as pd
+import pymysql
+
+import pipeline
+from cache_resultados import _PATRON_CADENAS, tablas_de_consulta
+from decodificacion import a_dataframe, describir, sin_conversion_python
+from guardia_sql import analizar_plan
+from prompt_esquema import leer_esquema
+
+TAMANO_PAGINA = 100
+
+
+def _q(columna):
+    return "r.`" + str(columna).replace("`", "``") + "`"
+
+
+def _valor_sql(valor):
+    """Valor de pandas/numpy como parámetro que PyMySQL sabe escapar (None si es nulo)."""
+    if pd.isna(valor):
+        return None
+    if hasattr(valor, "to_pydatetime"):
+        return valor.to_pydatetime()
+    if hasattr(valor, "item"):
+        return valor.item()
+    return valor
+
+
+# Con cualquiera de estas la clave de una tabla ya no identifica las filas del resultado
+_PATRON_NO_SIMPLE = re.compile(r"\b(?:join|group\s+by|distinct|union|having)\b", re.IGNORECASE)
+
+
+def columnas_clave(engine, sql, columnas):
+    """Clave primaria completa de la única tabla de la consulta, si está en el resultado.
+
+    Solo sirve de clave de paginación cuando identifica las filas del resultado: una tabla
+    en el FROM, sin JOIN, GROUP BY, DISTINCT, UNION ni subconsultas, y todas las columnas
+    de su clave primaria seleccionadas sin renombrar. Si no, [] (se pagina con OFFSET).
+    """
+    sin_cadenas = _PATRON_CADENAS.sub("''", sql)
+    tablas = tablas_de_consulta(sql)
+    if (len(tablas) != 1 or len(re.findall(r"\bselect\b", sin_cadenas, re.IGNORECASE)) != 1
+            or _PATRON_NO_SIMPLE.search(sin_cadenas)):
+        return []
+    try:
+        esquema = leer_esquema(engine)
+    except Exception:
+        return []
+    columnas_tabla = next((cols for t, cols in esquema["tablas"].items() if t.lower() == tablas[0]), [])
+    primarias = [c["nombre"] for c in columnas_tabla if c["clave"] == "PRI"]
+    if not primarias or any(c not in columnas for c in primarias):
+        return []
+    # "SELECT otra AS id_afiliado": el nombre está pero no es la clave
+    if any(re.search(rf"\bas\s+[`'\"]?{re.escape(c)}\b", sin_cadenas, re.IGNORECASE) for c in primarias):
+        return []
+    return primarias
+
+
+def ejecutar(engine, sql, parametros):
+    """Ejecuta una consulta con parámetros y la decodifica por tipos (página o EXPLAIN)."""
+    conexion = engine.raw_connection()
+    try:
+        cursor = conexion.cursor(pymysql.cursors.Cursor)
+        try:
+            with sin_conversion_python(conexion.dbapi_connection):
+                cursor.execute(sql, parametros)
+            return a_dataframe(cursor.fetchall(), describir(cursor))
+        finally:
+            cursor.close()
+    finally:
+        conexion.close()
+
+
+def _convertir_fechas(df, fechas):
+    """Copia de la página con las columnas de texto indicadas convertidas a datetime."""
+    columnas = [c for c in fechas if c in df.columns and pd.api.types.is_string_dtype(df[c].dtype)]
+    if not columnas:
+        return df
+    df = df.copy()
+    for columna in columnas:
+        df[columna] = pd.to_datetime(df[columna], errors="coerce")
+    return df
+
+
+class VistaPaginada:
+    """Estado de un visor: consulta base, orden, filtros y límites de las páginas vistas.
+
+    Se guarda en st.session_state; `leer()` devuelve la página actual y precarga la siguiente.
+    """
+
+    def __init__(self, engine, sql, columnas, numericas=(), filas_exactas=None, tamano=TAMANO_PAGINA, fechas=()):
+        self.engine = engine
+        # Como tabla derivada: sin ';' final y con '%' escapado (la consulta lleva parámetros)
+        self.sql_base = sql.strip().rstrip(";").rstrip().replace("%", "%%")
+        self.columnas = list(columnas)
+        self.orden_base = re.search(r"\border\s+by\b", self.sql_base, re.IGNORECASE) is not None
+        self.numericas = set(numericas)
+        self.fechas = [c for c in fechas if c in self.columnas]  # Texto que el resultado ya mostró como fecha
+        self.clave = columnas_clave(engine, sql, self.columnas)
+        # Sin clave ni ORDER BY no hay un orden estable barato: ordenar por todas las columnas
+        # obligaría a MySQL a ejecutar y ordenar la consulta entera en cada página
+        self.paginable = bool(self.clave) or self.orden_base
+        self.filas_exactas = filas_exactas  # Total conocido sin filtros (resultado leído completo)
+        self.tamano = tamano
+        self.orden = None
+        self.descendente = False
+        self.filtros = {}
+        self._reiniciar()
+
+    def _reiniciar(self):
+        self.pagina = 0
+        self._limites = [None]  # Clave de la última fila de cada página vista (None: desde el inicio)
+        self._futuros = {}  # página -> Future con su DataFrame (la actual y la precargada)
+        self._total = None
+        self.hay_siguiente = False
+
+    def configurar(self, orden=None, descendente=False, filtros=None):
+        """Cambia orden y filtros; si algo cambió se vuelve a la primera página."""
+        filtros = {c: t for c, t in (filtros or {}).items() if str(t).strip()}
+        if (orden, descendente, filtros) != (self.orden, self.descendente, self.filtros):
+            self.orden, self.descendente, self.filtros = orden, descendente, filtros
+            self._reiniciar()
+
+    # --- Navegación (pensadas como on_click de los botones) ---
+    def siguiente(self):
+        if self.hay_siguiente:
+            self.pagina += 1
+
+    def anterior(self):
+        self.pagina = max(self.pagina - 1, 0)
+
+    def primera(self):
+        self.pagina = 0
+
+    # --- SQL ---
+    def _columnas_orden(self):
+        if not self.orden and self.orden_base:
+            return []  # Se conserva el ORDER BY de la consulta
+        if not self.clave:
+            return [self.orden] if self.orden else []  # OFFSET (ver la cabecera)
+        return ([self.orden] if self.orden else []) + [c for c in self.clave if c != self.orden]
+
+    def _condiciones_filtro(self):
+        condiciones, parametros = [], []
+        for columna, texto in self.filtros.items():
+            texto = str(texto).strip()
+            if columna in self.numericas:
+                condiciones.append(f"{_q(columna)} = %s")
+                parametros.append(texto)
+            else:
+                condiciones.append(f"CAST({_q(columna)} AS CHAR) LIKE %s")
+                parametros.append("%" + texto.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%")
+        return condiciones, parametros
+
+    def _sql_pagina(self, limite, offset):
+        condiciones, parametros = self._condiciones_filtro()
+        columnas = self._columnas_orden()
+        direccion, operador = ("DESC", "<") if self.descendente else ("ASC", ">")
+        if limite is not None:
+            # (c1, c2) > (v1, v2) expandido; la primera condición deja usar un índice sobre c1
+            alternativas, valores = [], []
+            for i, columna in enumerate(columnas):
+                partes = [f"{_q(c)} = %s" for c in columnas[:i]] + [f"{_q(columna)} {operador} %s"]
+                alternativas.append("(" + " AND ".join(partes) + ")")
+                valores.extend(limite[:i + 1])
+            condiciones.append(f"{_q(columnas[0])} {operador}= %s AND ({' OR '.join(alternativas)})")
+            parametros.extend([limite[0]] + valores)
+        sql = f"SELECT * FROM (\n{self.sql_base}\n) AS r"
+        if condiciones:
+            sql += " WHERE " + " AND ".join(condiciones)
+        if columnas:
+            sql += " ORDER BY " + ", ".join(f"{_q(c)} {direccion}" for c in columnas)
+        sql += f" LIMIT {self.tamano + 1}"  # Una fila de más para saber si hay página siguiente
+        if limite is None and offset:
+            sql += f" OFFSET {int(offset)}"
+        return sql, parametros
+
+    # --- Lectura ---
+    def _lanzar(self, pagina):
+        limite = self._limites[pagina]
+        if limite is not None and (not self.clave or not limite or None in limite):
+            limite = None  # Sin clave única, con el orden de la consulta o con NULL en el límite: OFFSET
+        sql, parametros = self._sql_pagina(limite, pagina * self.tamano)
+        self._futuros[pagina] = pipeline.lanzar(ejecutar, self.engine, sql, parametros)
+
+    def leer(self):
+        """DataFrame de la página actual; deja la siguiente precargándose en el pool."""
+        if self.pagina not in self._futuros:
+            self._lanzar(self.pagina)
+        df = self._futuros[self.pagina].result()
+        self.hay_siguiente = len(df) > self.tamano
+        df = df.iloc[:self.tamano]
+        if self.hay_siguiente:
+            if len(self._limites) == self.pagina + 1:
+                ultima = df.iloc[-1]
+                self._limites.append(tuple(_valor_sql(ultima[c]) for c in self._columnas_orden()))
+            if self.pagina + 1 not in self._futuros:
+                self._lanzar(self.pagina + 1)
+        # Solo se guardan la página actual y sus vecinas
+        for pagina in [p for p in self._futuros if abs(p - self.pagina) > 1]:
+            del self._futuros[pagina]
+        return _convertir_fechas(df, self.fechas)  # Después de tomar el límite: MySQL compara el texto
+
+    def total(self):
+        """(filas, exacto): el total del resultado leído completo, o la estimación de EXPLAIN."""
+        if self.filas_exactas is not None and not self.filtros:
+            return self.filas_exactas, True
+        if self._total is None:
+            condiciones, parametros = self._condiciones_filtro()
+            sql = f"SELECT * FROM (\n{self.sql_base}\n) AS r"
+            if condiciones:
+                sql += " WHERE " + " AND ".join(condiciones)
+            try:
+                plan = ejecutar(self.engine, "EXPLAIN FORMAT=JSON " + sql, parametros).iloc[0, 0]
+                self._total = analizar_plan(json.loads(plan))["filas_resultado"]
+            except Exception:
+                self._total = -1  # Sin estimación
+        return (self._total, False) if self._total >= 0 else (None, False)
+
+
+class VistaMemoria:
+    """Visor de un DataFrame ya leído completo: misma interfaz que VistaPaginada, sin MySQL.
+
+    Orden y filtros se aplican con pandas y cada página es un corte del resultado.
+    """
+
+    def __init__(self, df, tamano=TAMANO_PAGINA):
+        self.df = df
+        self.columnas = list(df.columns)
+        self.numericas = {c for c, t in df.dtypes.items() if pd.api.types.is_numeric_dtype(t)}
+        self.tamano = tamano
+        self.orden = None
+        self.descendente = False
+        self.filtros = {}
+        self._vista = df
+        self.pagina = 0
+        self.hay_siguiente = False
+
+    def configurar(self, orden=None, descendente=False, filtros=None):
+        """Cambia orden y filtros; si algo cambió se vuelve a la primera página."""
+        filtros = {c: t for c, t in (filtros or {}).items() if str(t).strip()}
+        if (orden, descendente, filtros) == (self.orden, self.descendente, self.filtros):
+            return
+        self.orden, self.descendente, self.filtros = orden, descendente, filtros
+        vista = self.df
+        for columna, texto in filtros.items():
+            texto = str(texto).strip()
+            if columna in self.numericas:
+                valor = pd.to_numeric(texto, errors="coerce")
+                vista = vista[vista[columna] == valor] if not pd.isna(valor) else vista.iloc[:0]
+            else:
+                vista = vista[vista[columna].astype(str).str.contains(texto, case=False, regex=False, na=False)]
+        if orden:
+            vista = vista.sort_values(orden, ascending=not descendente, kind="stable")
+        elif descendente:
+            vista = vista.iloc[::-1]
+        self._vista = vista
+        self.pagina = 0
+
+    def siguiente(self):
+        if self.hay_siguiente:
+            self.pagina += 1
+
+    def anterior(self):
+        self.pagina = max(self.pagina - 1, 0)
+
+    def primera(self):
+        self.pagina = 0
+
+    def leer(self):
+        desde = self.pagina * self.tamano
+        self.hay_siguiente = desde + self.tamano < len(self._vista)
+        return self._vista.iloc[desde:desde + self.tamano]
+
+    def total(self):
+        return len(self._vista), True
+
+
+def mostrar(vista, clave, altura=None):
+    """Dibuja la página actual de un visor (VistaPaginada o VistaMemoria) con orden, filtro y
+    botones de página; `clave` distingue los widgets de cada visor de la página."""
+    import streamlit as st  # Solo las apps dependen de streamlit; el resto del módulo no
+
+    col_orden, col_desc, col_filtro_col, col_filtro = st.columns([2, 1, 2, 3])
+    orden = col_orden.selectbox("Ordenar por", ["(sin orden)"] + vista.columnas, key=f"{clave}_orden")
+    descendente = col_desc.checkbox("Descendente", key=f"{clave}_desc")
+    columna_filtro = col_filtro_col.selectbox("Filtrar columna", vista.columnas, key=f"{clave}_filtro_col")
+    texto_filtro = col_filtro.text_input("Contiene (igual a, si es numérica)", key=f"{clave}_filtro")
+    vista.configurar(None if orden == "(sin orden)" else orden, descendente, {columna_filtro: texto_filtro})
+    pagina_df = vista.leer()
+    if altura is None:
+        st.dataframe(pagina_df, use_container_width=True)
+    else:
+        st.dataframe(pagina_df, use_container_width=True, height=altura)
+    total, exacto = vista.total()
+    desde = vista.pagina * vista.tamano
+    col_anterior, col_siguiente, col_info = st.columns([1, 1, 4])
+    col_anterior.button("◀ Anterior", key=f"{clave}_anterior", on_click=vista.anterior, disabled=vista.pagina == 0)
+    col_siguiente.button("Siguiente ▶", key=f"{clave}_siguiente", on_click=vista.siguiente, disabled=not vista.hay_siguiente)
+    texto_total = f" de {'' if exacto else '~'}{total:,}" if total is not None else ""
+    col_info.caption(f"Página {vista.pagina + 1} · filas {desde + min(len(pagina_df), 1):,}–{desde + len(pagina_df):,}{texto_total}")
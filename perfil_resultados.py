@@ -0,0 +1,288 @@
+# === Perfil estadístico de resultados y caché de recomendaciones ===
+# El resumen que recibe el LLM para la recomendación se calcula de forma determinista:
+#   - Si el resultado está completo en memoria, en una sola pasada vectorizada de pandas
+#     (con muestreo sistemático si fuese enorme, nunca aleatorio).
+#   - Si la lectura en streaming se truncó, las estadísticas se piden a MySQL con
+#     agregados sobre la consulta original (pushdown), así describen el resultado real
+#     y no solo las primeras filas leídas. La consulta se ejecuta una sola vez, a una
+#     tabla temporal que se perfila después; si la guardia vio un escaneo completo de
+#     una tabla grande no se repite y se perfila lo leído.
+# Como el mismo resultado produce siempre el mismo resumen, la recomendación se cachea
+# por una huella del contenido del DataFrame: repetir una consulta la devuelve al instante.
+
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+MAX_FILAS_EN_MEMORIA = 1_000_000  # Por encima se perfila una muestra sistemática
+TOP_CATEGORIAS = 5
+MAX_COLUMNAS_PERFIL = 30
+MAX_COLUMNAS_CUANTILES_SQL = 5  # Los cuantiles en SQL ordenan el resultado: se acotan
+MAX_COLUMNAS_TOP_SQL = 5  # Cada top de categorías es un GROUP BY sobre el resultado: también
+TIEMPO_MAXIMO_PERFIL_MS = 20_000
+MAX_INSIGHTS = 500
+CUANTILES = (0.25, 0.5, 0.75)
+
+
+# --- Utilidades ---
+def _formatear(valor):
+    """Texto estable para el prompt (mismos datos, mismo texto)."""
+    if valor is None or (isinstance(valor, float) and np.isnan(valor)):
+        return "-"
+    if isinstance(valor, (float, np.floating)):
+        return f"{float(valor):.6g}"
+    if isinstance(valor, pd.Timestamp):
+        return valor.isoformat(sep=" ")
+    return str(valor)
+
+
+def _tipo_columna(serie):
+    if pd.api.types.is_bool_dtype(serie):
+        return "categorica"
+    if pd.api.types.is_numeric_dtype(serie):
+        return "numerica"
+    if pd.api.types.is_datetime64_any_dtype(serie):
+        return "fecha"
+    return "categorica"
+
+
+def _muestra_sistematica(df, max_filas):
+    """Filas equiespaciadas: la misma entrada da siempre la misma muestra."""
+    if len(df) <= max_filas:
+        return df
+    posiciones = np.linspace(0, len(df) - 1, max_filas).astype(np.int64)
+    return df.iloc[posiciones]
+
+
+def huella_resultado(df):
+    """Hash del contenido del DataFrame (columnas, tipos y valores)."""
+    h = hashlib.sha1()
+    h.update(repr([(str(c), str(t)) for c, t in df.dtypes.items()]).encode("utf-8"))
+    try:
+        h.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+    except TypeError:
+        # Celdas no hashables (listas, dicts...): se recurre a su representación en texto
+        h.update(pd.util.hash_pandas_object(df.astype(str), index=False).values.tobytes())
+    streaming = df.attrs.get("streaming") or {}
+    if streaming.get("truncado"):
+        # El perfil de un resultado truncado depende de la consulta completa, no de lo leído
+        h.update(str(df.attrs.get("sql", "")).encode("utf-8"))
+    return h.hexdigest()
+
+
+# --- Perfil en memoria (una pasada vectorizada) ---
+def perfil_en_memoria(df):
+    """Lista de estadísticas por columna calculadas con pandas."""
+    filas_totales = len(df)
+    datos = _muestra_sistematica(df, MAX_FILAS_EN_MEMORIA)
+    columnas = list(datos.columns[:MAX_COLUMNAS_PERFIL])
+    tipos = {c: _tipo_columna(datos[c]) for c in columnas}
+    numericas = [c for c in columnas if tipos[c] == "numerica"]
+
+    no_nulos = datos[columnas].count()
+    if numericas:
+        valores = datos[numericas].astype("float64")
+        medias, desviaciones = valores.mean(), valores.std()
+        minimos, maximos = valores.min(), valores.max()
+        cuantiles = valores.quantile(list(CUANTILES))
+
+    perfil = []
+    for c in columnas:
+        estadisticas = {"columna": str(c), "tipo": tipos[c], "no_nulos": int(no_nulos[c])}
+        if tipos[c] == "numerica":
+            estadisticas.update({
+                "media": medias[c], "desviacion": desviaciones[c], "min": minimos[c], "max": maximos[c],
+                "cuantiles": [cuantiles.at[q, c] for q in CUANTILES],
+            })
+        elif tipos[c] == "fecha":
+            estadisticas.update({"min": datos[c].min(), "max": datos[c].max()})
+        else:
+            frecuencias = datos[c].astype(str).where(datos[c].notna()).value_counts()
+            estadisticas.update({
+                "distintos": int(len(frecuencias)),
+                # Empates ordenados por valor para que el texto sea siempre el mismo
+                "top": sorted(frecuencias.items(), key=lambda x: (-x[1], x[0]))[:TOP_CATEGORIAS],
+            })
+        perfil.append(estadisticas)
+    return {"filas": filas_totales, "filas_perfiladas": len(datos), "origen": "memoria", "columnas": perfil}
+
+
+# --- Perfil en MySQL (pushdown) ---
+def _citar(columna):
+    return "`" + str(columna).replace("`", "``") + "`"
+
+
+def _ejecutar(cursor, sql):
+    # Cursor DB-API sin parámetros para que PyMySQL no interprete '%'
+    cursor.execute(f"SELECT /*+ MAX_EXECUTION_TIME({TIEMPO_MAXIMO_PERFIL_MS}) */ " + sql)
+    return cursor.fetchall()
+
+
+def _materializar(cursor, sql):
+    """Ejecuta la consulta una vez a una tabla temporal de la conexión; su nombre, o None si
+    no se pudo (sin permiso CREATE TEMPORARY TABLES): entonces se usa como tabla derivada."""
+    nombre = "_perfil_" + hashlib.sha1(sql.encode("utf-8")).hexdigest()[:16]
+    try:
+        cursor.execute(f"CREATE TEMPORARY TABLE {nombre} AS {sql}")
+    except Exception:
+        return None
+    return nombre
+
+
+def perfil_en_sql(engine, sql, df_muestra):
+    """Estadísticas agregadas por MySQL sobre el resultado completo de `sql`.
+
+    Los tipos de columna se toman de las filas ya leídas (`df_muestra`).
+    """
+    sql = sql.strip().rstrip(';')
+    columnas = list(df_muestra.columns[:MAX_COLUMNAS_PERFIL])
+    tipos = {c: _tipo_columna(df_muestra[c]) for c in columnas}
+
+    agregados = ["COUNT(*)"]
+    for c in columnas:
+        q = _citar(c)
+        agregados.append(f"COUNT({q})")
+        if tipos[c] == "numerica":
+            agregados += [f"AVG({q})", f"STDDEV_SAMP({q})", f"MIN({q})", f"MAX({q})"]
+        elif tipos[c] == "fecha":
+            agregados += [f"MIN({q})", f"MAX({q})"]
+        else:
+            agregados.append(f"COUNT(DISTINCT {q})")
+
+    conexion = engine.raw_connection()
+    try:
+        cursor = conexion.cursor()
+        temporal = None
+        try:
+            temporal = _materializar(cursor, sql)
+            base = temporal or f"({sql}) AS _perfil"
+            tops = 0
+            fila = list(_ejecutar(cursor, f"{', '.join(agregados)} FROM {base}")[0])
+            filas_totales = int(fila.pop(0))
+            perfil = []
+            for c in columnas:
+                q = _citar(c)
+                estadisticas = {"columna": str(c), "tipo": tipos[c], "no_nulos": int(fila.pop(0))}
+                if tipos[c] == "numerica":
+                    media, desviacion, minimo, maximo = (float(v) if v is not None else None for v in fila[:4])
+                    del fila[:4]
+                    estadisticas.update({"media": media, "desviacion": desviacion, "min": minimo, "max": maximo})
+                    if sum(1 for e in perfil if "cuantiles" in e) < MAX_COLUMNAS_CUANTILES_SQL:
+                        estadisticas["cuantiles"] = _cuantiles_sql(cursor, base, q, estadisticas["no_nulos"])
+                elif tipos[c] == "fecha":
+                    estadisticas.update({"min": fila.pop(0), "max": fila.pop(0)})
+                else:
+                    estadisticas["distintos"] = int(fila.pop(0))
+                    estadisticas["top"] = []
+                    if tops < MAX_COLUMNAS_TOP_SQL:
+                        tops += 1
+                        top = _ejecutar(cursor, f"{q}, COUNT(*) AS n FROM {base} WHERE {q} IS NOT NULL "
+                                                f"GROUP BY {q} ORDER BY n DESC, {q} LIMIT {TOP_CATEGORIAS}")
+                        estadisticas["top"] = [(str(v), int(n)) for v, n in top]
+                perfil.append(estadisticas)
+        finally:
+            if temporal is not None:
+                try:
+                    cursor.execute(f"DROP TEMPORARY TABLE IF EXISTS {temporal}")  # La conexión vuelve al pool
+                except Exception:
+                    conexion.invalidate()  # Que no vuelva al pool con la tabla temporal
+            cursor.close()
+    finally:
+        conexion.close()
+    return {"filas": filas_totales, "filas_perfiladas": filas_totales, "origen": "sql", "columnas": perfil}
+
+
+def _cuantiles_sql(cursor, base, columna, no_nulos):
+    """Cuantiles exactos con ROW_NUMBER (MySQL 8); None si el servidor no lo admite."""
+    if not no_nulos:
+        return None
+    posiciones = [int(q * (no_nulos - 1)) + 1 for q in CUANTILES]
+    try:
+        filas = _ejecutar(cursor, f"rn, v FROM (SELECT {columna} AS v, ROW_NUMBER() OVER (ORDER BY {columna}) AS rn "
+                                  f"FROM {base} WHERE {columna} IS NOT NULL) AS _orden "
+                                  f"WHERE rn IN ({', '.join(str(p) for p in posiciones)})")
+    except Exception:
+        return None
+    por_posicion = {int(rn): float(v) for rn, v in filas}
+    return [por_posicion.get(p) for p in posiciones]
+
+
+# --- Punto de entrada ---
+def perfilar(df, engine=None):
+    """Perfil del resultado: pushdown a MySQL si la lectura se truncó, si no en memoria.
+
+    Si la guardia marcó un escaneo completo (`attrs["escaneo_completo"]`) no se vuelve a
+    ejecutar la consulta: se perfilan las filas leídas.
+    """
+    streaming = df.attrs.get("streaming") or {}
+    sql = df.attrs.get("sql")
+    if streaming.get("truncado") and engine is not None and sql and not df.attrs.get("escaneo_completo"):
+        try:
+            return perfil_en_sql(engine, sql, df)
+        except Exception:
+            pass  # Sin pushdown se perfila lo que se llegó a leer
+    return perfil_en_memoria(df)
+
+
+def perfil_a_texto(perfil):
+    """Resumen compacto y estable para el prompt del LLM."""
+    lineas = [f"Filas del resultado: {perfil['filas']:,}"]
+    if perfil["filas_perfiladas"] != perfil["filas"]:
+        lineas[0] += f" (perfil sobre una muestra sistemática de {perfil['filas_perfiladas']:,})"
+    for e in perfil["columnas"]:
+        nulos = perfil["filas_perfiladas"] - e["no_nulos"]
+        linea = f"- {e['columna']} ({e['tipo']}, {nulos:,} nulos)"
+        if e["tipo"] == "numerica":
+            linea += f": media {_formatear(e['media'])}, desv. {_formatear(e['desviacion'])}, min {_formatear(e['min'])}, max {_formatear(e['max'])}"
+            if e.get("cuantiles"):
+                linea += ", p25/p50/p75 " + "/".join(_formatear(v) for v in e["cuantiles"])
+        elif e["tipo"] == "fecha":
+            linea += f": desde {_formatear(e['min'])} hasta {_formatear(e['max'])}"
+        else:
+            linea += f": {e['distintos']:,} valores distintos"
+            if e["top"]:
+                linea += "; más frecuentes: " + ", ".join(f"{v} ({n:,})" for v, n in e["top"])
+        lineas.append(linea)
+    return "\n".join(lineas)
+
+
+# === Caché de recomendaciones por huella del resultado ===
+class CacheInsights:
+    """LRU de recomendaciones ya generadas: (huella, modelo) -> texto."""
+
+    def __init__(self, max_entradas=MAX_INSIGHTS):
+        self.max_entradas = max_entradas
+        self._entradas = OrderedDict()
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+
+    def buscar(self, huella, modelo):
+        with self._lock:
+            texto = self._entradas.get((huella, modelo))
+            if texto is None:
+                self.fallos += 1
+                return None
+            self._entradas.move_to_end((huella, modelo))
+            self.aciertos += 1
+            return texto
+
+    def guardar(self, huella, modelo, texto):
+        if not texto:
+            return
+        with self._lock:
+            self._entradas[(huella, modelo)] = texto
+            self._entradas.move_to_end((huella, modelo))
+            while len(self._entradas) > self.max_entradas:
+                self._entradas.popitem(last=False)
+
+    def estadisticas(self):
+        with self._lock:
+            return {"entradas": len(self._entradas), "aciertos": self.aciertos, "fallos": self.fallos}
+
+
+# Instancia compartida por todas las sesiones del proceso
+cache_insights = CacheInsights()
@@ -0,0 +1,90 @@
+# === Pipeline concurrente para las etapas de una pregunta ===
+# Una vez que el DataFrame está listo, el gráfico, la exportación y la recomendación
+# del LLM no dependen entre sí: se lanzan en un pool de workers compartido por el
+# proceso y la interfaz muestra cada parte en cuanto está disponible.
+#
+# Los workers NO llaman a funciones de Streamlit (no tienen contexto de sesión);
+# todo lo que se pinta en pantalla lo hace el hilo del script. Sí heredan el contexto
+# (contextvars) de quien los lanza, así sus tramos caen en la traza de la pregunta.
+
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+MAX_WORKERS = 8
+
+executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="pipeline")
+
+
+class FlujoTexto:
+    """Buffer de tokens que un worker va llenando y el hilo de la UI va leyendo."""
+
+    def __init__(self):
+        self._partes = []
+        self._terminado = False
+        self._condicion = threading.Condition()
+
+    def agregar(self, token):
+        with self._condicion:
+            self._partes.append(token)
+            self._condicion.notify_all()
+
+    def terminar(self):
+        with self._condicion:
+            self._terminado = True
+            self._condicion.notify_all()
+
+    @property
+    def terminado(self):
+        with self._condicion:
+            return self._terminado
+
+    @property
+    def texto(self):
+        with self._condicion:
+            return "".join(self._partes)
+
+    def esperar(self, timeout=None):
+        """Bloquea hasta que el flujo termine. Devuelve True si terminó."""
+        with self._condicion:
+            return self._condicion.wait_for(lambda: self._terminado, timeout=timeout)
+
+    def iterar_textos(self, intervalo=0.1):
+        """Genera el texto acumulado cada vez que llegan tokens nuevos, hasta terminar."""
+        vistos = -1
+        while True:
+            with self._condicion:
+                self._condicion.wait_for(lambda: self._terminado or len(self._partes) != vistos, timeout=intervalo)
+                terminado = self._terminado
+                if len(self._partes) != vistos:
+                    vistos = len(self._partes)
+                    texto = "".join(self._partes)
+                else:
+                    texto = None
+            if texto is not None:
+                yield texto
+            if terminado:
+                return
+
+
+def lanzar_flujo(generador_tokens, *args, **kwargs):
+    """Ejecuta un generador de tokens en el pool y devuelve el FlujoTexto que lo recibe."""
+    flujo = FlujoTexto()
+
+    def _trabajo():
+        try:
+            for token in generador_tokens(*args, **kwargs):
+                flujo.agregar(token)
+        except Exception as e:
+            flujo.agregar(f"Error al generar la recomendación: {e}")
+        finally:
+            flujo.terminar()
+
+    executor.submit(contextvars.copy_context().run, _trabajo)
+    return flujo
+
+
+def lanzar(funcion, *args, **kwargs):
+    """Envía una etapa independiente al pool y devuelve su Future."""
+    return executor.submit(contextvars.copy_context().run, funcion, *args, **kwargs)
+
@@ -0,0 +1,329 @@
+# === Planificador de llamadas al LLM ===
+# Con muchos analistas sobre el mismo despliegue, todas las llamadas (SQL, recomendación,
+# asistente) iban directas a la única instancia de Ollama: al saturarse aparecían
+# timeouts, y dos preguntas idénticas enviadas a la vez se generaban dos veces.
+#
+# - Concurrencia acotada: como mucho MAX_CONCURRENTES generaciones a la vez (conviene
+#   igualarlo a OLLAMA_NUM_PARALLEL); el resto espera en cola en este proceso.
+# - Cola justa por sesión: cada sesión tiene su propia cola y se atienden por turnos,
+#   así un analista que lanza muchas preguntas no deja esperando a los demás.
+# - Coalescencia: si llega un prompt idéntico (modelo, mensajes y opciones) a uno en cola
+#   o en curso, se suma como oyente y recibe los mismos fragmentos desde el principio.
+# - Posición y ETA en cola para la interfaz (callback `al_esperar`).
+# - Timeouts según el rendimiento medido (percentil 95 del primer token por modelo,
+#   con margen), en lugar de valores fijos. Si el modelo lleva más que su keep_alive sin
+#   usarse puede estar descargado y se usa TIMEOUT_INICIAL; un timeout de lectura antes
+#   del primer fragmento (recarga, prefill largo sin caché) se reintenta una vez con él.
+#
+# La sesión se toma de una contextvar (`establecer_sesion` en cada rerun); pipeline.py
+# copia el contexto a sus workers, así la recomendación cuenta para la misma sesión.
+
+import contextvars
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import deque
+
+import requests
+from urllib3.exceptions import ReadTimeoutError
+
+import trazas
+from cliente_llm import cliente_global
+
+MAX_CONCURRENTES = int(os.environ.get("LLM_CONCURRENCIA", 2))
+MAX_EN_COLA = 200  # Peticiones en espera a partir de las que se rechaza (el servicio está saturado)
+INTERVALO_AVISO = 0.5  # Segundos entre actualizaciones de la posición en cola
+MUESTRAS_RENDIMIENTO = 50  # Llamadas recientes por modelo para estimar duración y timeout
+MIN_MUESTRAS = 3
+TIMEOUT_INICIAL = 120  # Sin medidas aún (el modelo puede estar cargándose)
+FACTOR_TIMEOUT = 3  # Margen sobre el percentil 95 medido
+TIMEOUT_MINIMO = 10
+TIMEOUT_MAXIMO = 300
+DURACION_INICIAL = 10.0  # Duración supuesta de una generación para la primera ETA
+
+_sesion_actual = contextvars.ContextVar("sesion_llm", default="")
+
+
+class ColaLlena(requests.exceptions.RequestException):
+    """Demasiadas peticiones en espera: se rechaza en lugar de esperar a un timeout."""
+
+
+class _Trabajo:
+    def __init__(self, clave, sesion, mensajes, modelo, opciones):
+        self.clave = clave
+        self.sesion = sesion
+        self.mensajes = mensajes
+        self.modelo = modelo
+        self.opciones = opciones
+        self.contexto = contextvars.copy_context()  # La traza del primero que lo pidió recibe el tramo "llm"
+        self.fragmentos = []
+        self.oyentes = 0
+        self.iniciado = None
+        self.terminado = False
+        self.error = None
+        self.metrica = None
+        self.cancelado = False
+
+
+def establecer_sesion(sesion):
+    """Identifica la sesión de Streamlit en curso para la cola justa (llamar en cada rerun)."""
+    _sesion_actual.set(sesion or "")
+
+
+def _segundos(duracion):
+    """keep_alive de Ollama ("30m", "1h", "90s" o segundos) en segundos."""
+    texto = str(duracion).strip()
+    unidades = {"s": 1, "m": 60, "h": 3600}
+    if texto and texto[-1] in unidades:
+        return float(texto[:-1]) * unidades[texto[-1]]
+    return float(texto)
+
+
+def _es_timeout_lectura(error):
+    """ReadTimeout al esperar la respuesta, o el mismo timeout envuelto al leer el stream."""
+    if isinstance(error, requests.exceptions.ReadTimeout):
+        return True
+    return isinstance(error, requests.exceptions.ConnectionError) and any(
+        isinstance(a, ReadTimeoutError) for a in error.args)
+
+
+def _percentil(valores, p):
+    ordenados = sorted(valores)
+    return ordenados[min(int(len(ordenados) * p), len(ordenados) - 1)]
+
+
+class PlanificadorLLM:
+    def __init__(self, cliente, max_concurrentes=MAX_CONCURRENTES, max_en_cola=MAX_EN_COLA):
+        self.cliente = cliente
+        self.max_concurrentes = max_concurrentes
+        self.max_en_cola = max_en_cola
+        self._condicion = threading.Condition()
+        self._colas = {}  # sesión -> deque de trabajos pendientes
+        self._turnos = deque()  # Sesiones con trabajos pendientes, en orden de atención
+        self._por_clave = {}  # Trabajos en cola o en curso por prompt (coalescencia)
+        self._en_curso = 0
+        self._hilos = []
+        self._rendimiento = {}  # modelo -> deque de (segundos_total, segundos_primer_token)
+        self._ultimo_uso = {}  # modelo -> time.time() de la última generación completa
+        self.estadisticas = {"solicitudes": 0, "coalescidas": 0, "rechazadas": 0, "canceladas": 0}
+
+    # --- Rendimiento medido ---
+    def duracion_estimada(self, modelo):
+        with self._condicion:
+            muestras = [m[0] for m in self._rendimiento.get(modelo, ())]
+        return sum(muestras) / len(muestras) if muestras else DURACION_INICIAL
+
+    def timeout(self, modelo):
+        """Timeout de lectura: margen sobre el p95 del primer token (el stream llega después sin pausas largas)."""
+        with self._condicion:
+            muestras = [m[1] for m in self._rendimiento.get(modelo, ()) if m[1] is not None]
+            ultimo_uso = self._ultimo_uso.get(modelo, 0.0)
+        if len(muestras) < MIN_MUESTRAS or time.time() - ultimo_uso >= _segundos(self.cliente.keep_alive):
+            return TIMEOUT_INICIAL  # Sin medidas, o el modelo puede haberse descargado de Ollama
+        return min(max(_percentil(muestras, 0.95) * FACTOR_TIMEOUT, TIMEOUT_MINIMO), TIMEOUT_MAXIMO)
+
+    def _medir(self, modelo, metrica):
+        if metrica and metrica.get("segundos_total"):
+            with self._condicion:
+                self._rendimiento.setdefault(modelo, deque(maxlen=MUESTRAS_RENDIMIENTO)).append(
+                    (metrica["segundos_total"], metrica.get("segundos_primer_token")))
+                self._ultimo_uso[modelo] = time.time()
+
+    # --- Cola ---
+    def _orden_de_atencion(self):
+        """Trabajos pendientes en el orden en que se atenderán (por turnos entre sesiones)."""
+        colas = [list(self._colas[s]) for s in self._turnos]
+        orden = []
+        for ronda in range(max((len(c) for c in colas), default=0)):
+            orden += [c[ronda] for c in colas if ronda < len(c)]
+        return orden
+
+    def posicion(self, trabajo):
+        """(posición en cola empezando en 1, segundos estimados hasta empezar) o (0, 0) si ya empezó."""
+        with self._condicion:
+            if trabajo.iniciado is not None or trabajo.terminado:
+                return 0, 0.0
+            orden = self._orden_de_atencion()
+            delante = orden.index(trabajo) if trabajo in orden else 0
+        # Cada "tanda" de max_concurrentes trabajos tarda lo que una generación media
+        return delante + 1, (delante // self.max_concurrentes + 1) * self.duracion_estimada(trabajo.modelo)
+
+    def _encolar(self, mensajes, modelo, opciones):
+        clave = hashlib.sha1(json.dumps([modelo, mensajes, opciones], sort_keys=True,
+                                        ensure_ascii=False).encode("utf-8")).hexdigest()
+        with self._condicion:
+            self.estadisticas["solicitudes"] += 1
+            trabajo = self._por_clave.get(clave)
+            if trabajo is not None and not trabajo.cancelado:
+                self.estadisticas["coalescidas"] += 1
+                trabajo.oyentes += 1
+                return trabajo, True
+            if sum(len(c) for c in self._colas.values()) >= self.max_en_cola:
+                self.estadisticas["rechazadas"] += 1
+                raise ColaLlena("El servicio del modelo está saturado; inténtalo de nuevo en unos minutos.")
+            sesion = _sesion_actual.get()
+            trabajo = _Trabajo(clave, sesion, mensajes, modelo, opciones)
+            trabajo.oyentes = 1
+            self._por_clave[clave] = trabajo
+            if sesion not in self._colas:
+                self._colas[sesion] = deque()
+                self._turnos.append(sesion)
+            self._colas[sesion].append(trabajo)
+            self._arrancar_hilos()
+            self._condicion.notify_all()
+            return trabajo, False
+
+    def _siguiente(self):
+        """Saca el próximo trabajo (llamar con el lock tomado y algo en cola)."""
+        sesion = self._turnos.popleft()
+        cola = self._colas[sesion]
+        trabajo = cola.popleft()
+        if cola:
+            self._turnos.append(sesion)  # La sesión vuelve al final de la ronda
+        else:
+            del self._colas[sesion]
+        return trabajo
+
+    def _retirar(self, trabajo):
+        """Quita de la cola un trabajo que ya nadie espera."""
+        cola = self._colas.get(trabajo.sesion)
+        if cola is not None and trabajo in cola:
+            cola.remove(trabajo)
+            if not cola:
+                del self._colas[trabajo.sesion]
+                self._turnos.remove(trabajo.sesion)
+        if self._por_clave.get(trabajo.clave) is trabajo:
+            del self._por_clave[trabajo.clave]
+        trabajo.cancelado = trabajo.terminado = True
+        self.estadisticas["canceladas"] += 1
+
+    # --- Workers ---
+    def _arrancar_hilos(self):
+        while len(self._hilos) < self.max_concurrentes:
+            hilo = threading.Thread(target=self._bucle, daemon=True, name=f"llm-{len(self._hilos)}")
+            self._hilos.append(hilo)
+            hilo.start()
+
+    def _bucle(self):
+        while True:
+            with self._condicion:
+                self._condicion.wait_for(lambda: self._turnos)
+                trabajo = self._siguiente()
+                trabajo.iniciado = time.perf_counter()
+                self._en_curso += 1
+                self._condicion.notify_all()
+            try:
+                trabajo.contexto.run(self._generar, trabajo)
+            finally:
+                with self._condicion:
+                    self._en_curso -= 1
+                    trabajo.terminado = True
+                    if self._por_clave.get(trabajo.clave) is trabajo:
+                        del self._por_clave[trabajo.clave]
+                    self._condicion.notify_all()
+
+    def _generar(self, trabajo):
+        timeout = self.timeout(trabajo.modelo)
+        self._transmitir(trabajo, timeout)
+        if (trabajo.error is not None and not trabajo.fragmentos and timeout < TIMEOUT_INICIAL
+                and _es_timeout_lectura(trabajo.error)):
+            # Sin ningún fragmento: el modelo se estaba cargando o el prefill fue largo
+            trabajo.error = None
+            self._transmitir(trabajo, TIMEOUT_INICIAL)
+
+    def _transmitir(self, trabajo, timeout):
+        generador = self.cliente.chat_stream(trabajo.mensajes, trabajo.modelo, timeout=timeout,
+                                             opciones=trabajo.opciones,
+                                             al_terminar=lambda metrica: setattr(trabajo, "metrica", metrica))
+        try:
+            for fragmento in generador:
+                with self._condicion:
+                    if trabajo.oyentes == 0:
+                        # Nadie lo espera ya: cerrar el stream libera a Ollama (y nadie más se suma)
+                        trabajo.cancelado = True
+                        del self._por_clave[trabajo.clave]
+                        self.estadisticas["canceladas"] += 1
+                        break
+                    trabajo.fragmentos.append(fragmento)
+                    self._condicion.notify_all()
+        except Exception as e:
+            trabajo.error = e
+        finally:
+            generador.close()
+            if trabajo.error is None:
+                self._medir(trabajo.modelo, trabajo.metrica)
+
+    # --- API pública ---
+    def chat_stream(self, mensajes, modelo, opciones=None, al_esperar=None, al_terminar=None, cancelar=None):
+        """Como ClienteOllama.chat_stream, pasando por la cola.
+
+        `al_esperar(posicion, eta_segundos)` se llama mientras la petición espera turno
+        (desde el hilo que itera: en el script de Streamlit puede pintar un aviso).
+        Si el threading.Event `cancelar` se activa, el generador termina sin más fragmentos.
+        """
+        trabajo, coalescida = self._encolar(mensajes, modelo, opciones)
+        inicio_espera = time.perf_counter()
+        posicion_inicial = None
+        aviso = None
+        leidos = 0
+        try:
+            while True:
+                with self._condicion:
+                    self._condicion.wait_for(lambda: trabajo.terminado or len(trabajo.fragmentos) > leidos,
+                                             timeout=INTERVALO_AVISO)
+                    nuevos = trabajo.fragmentos[leidos:]
+                    terminado = trabajo.terminado
+                    iniciado = trabajo.iniciado
+                if cancelar is not None and cancelar.is_set():
+                    return
+                if iniciado is None and not terminado:
+                    posicion, eta = self.posicion(trabajo)
+                    posicion_inicial = posicion_inicial or posicion
+                    if al_esperar is not None and (posicion, round(eta)) != aviso:
+                        aviso = (posicion, round(eta))
+                        al_esperar(posicion, eta)
+                    continue
+                if posicion_inicial is not False:
+                    # Tramo de espera en la traza de quien pregunta (también si se sumó a otra petición)
+                    espera = max((iniciado or time.perf_counter()) - inicio_espera, 0.0)
+                    trazas.registrar_tramo("llm.cola", espera, posicion=posicion_inicial or 0, coalescida=coalescida)
+                    posicion_inicial = False
+                for fragmento in nuevos:
+                    yield fragmento
+                leidos += len(nuevos)
+                if terminado:
+                    break  # Terminado ya no recibe fragmentos: `nuevos` era el resto
+            if trabajo.error is not None:
+                raise trabajo.error
+            if al_terminar and trabajo.metrica:
+                al_terminar(trabajo.metrica)
+        finally:
+            with self._condicion:
+                trabajo.oyentes -= 1
+                if trabajo.oyentes == 0 and trabajo.iniciado is None and not trabajo.terminado:
+                    self._retirar(trabajo)
+
+    def chat(self, mensajes, modelo, opciones=None, al_esperar=None, al_terminar=None):
+        """Respuesta completa, pasando por la cola."""
+        return "".join(self.chat_stream(mensajes, modelo, opciones=opciones, al_esperar=al_esperar,
+                                        al_terminar=al_terminar))
+
+    def estado(self):
+        """Resumen para el panel de diagnóstico."""
+        with self._condicion:
+            estado = {
+                "en_curso": self._en_curso,
+                "en_cola": sum(len(c) for c in self._colas.values()),
+                "sesiones_en_cola": len(self._turnos),
+                "concurrencia": self.max_concurrentes,
+                **self.estadisticas,
+            }
+            modelos = list(self._rendimiento)
+        estado["timeouts"] = {m: self.timeout(m) for m in modelos}
+        return estado
+
+
+# Instancia compartida por todas las sesiones del proceso
+planificador_global = PlanificadorLLM(cliente_global)
@@ -0,0 +1,518 @@
+# === Respuesta sin LLM para preguntas de plantilla ===
+# Buena parte de las preguntas son variaciones de unas pocas formas ("¿cuántas pólizas hay
+# por estado en Texas?", "prima promedio por región del afiliado en 2023") y aun así pagaban
+# una vuelta completa al modelo.
+#
+# - `emparejar` reconoce localmente hecho (afiliados, pólizas, siniestros...), medida
+#   (conteo, promedio o total de una columna numérica), agrupaciones (columnas, mes, año)
+#   y filtros (valores de la BD y años), y rellena una consulta parametrizada.
+# - Los valores se resuelven contra un diccionario cacheado de la BD (ENUMs y DISTINCT de
+#   las columnas de texto), que se construye en segundo plano al arrancar.
+# - Solo responde si reconoce todas las palabras de la pregunta (salvo las de relleno o
+#   presentación); ante cualquier duda devuelve None y la pregunta va al LLM.
+
+import re
+import threading
+import time
+
+from sqlalchemy import text
+
+from prompt_esquema import _normalizar, leer_esquema
+
+TTL_VALORES = 3600  # Segundos que se reutiliza el diccionario de valores
+MAX_VALORES = 300  # Columnas con más valores distintos no se usan como filtro
+
+# Hechos: tabla, alias, sinónimos, columna de fecha, agrupaciones, medidas y columnas filtrables.
+# Las columnas "tabla.columna" de otra tabla se resuelven con la unión indicada en "uniones".
+HECHOS = {
+    "evaluaciones_siniestro": {
+        "alias": "e",
+        "nombres": ["evaluaciones", "evaluacion", "peritajes", "peritaje"],
+        "contexto": ["siniestros", "siniestro"],
+        "fecha": "fecha_evaluacion",
+        "conteo": "cantidad_evaluaciones",
+        "dimensiones": {
+            "evaluaciones_siniestro.id_perito": ["perito", "peritos"],
+            "evaluaciones_siniestro.motivo_rechazo": ["motivo de rechazo", "motivos de rechazo", "motivo", "motivos"],
+        },
+        "medidas": {
+            "puntaje_fraude": ["puntaje de fraude", "puntajes de fraude", "puntaje fraude"],
+            "monto_estimado": ["monto estimado", "montos estimados"],
+            "monto_rechazado": ["monto rechazado", "montos rechazados"],
+        },
+        "filtros": ["evaluaciones_siniestro.motivo_rechazo"],
+        "uniones": {},
+    },
+    "pagos_siniestros": {
+        "alias": "pg",
+        "nombres": ["pagos", "pago"],
+        "contexto": ["siniestros", "siniestro"],
+        "fecha": "fecha_pago",
+        "conteo": "cantidad_pagos",
+        "dimensiones": {
+            "pagos_siniestros.estado_pago": ["estado de pago", "estado del pago", "estados de pago", "estado", "estados"],
+            "pagos_siniestros.tipo_pago": ["tipo de pago", "tipos de pago", "tipo", "tipos"],
+            "pagos_siniestros.moneda": ["moneda", "monedas"],
+        },
+        "medidas": {
+            "monto_pagado": ["monto pagado", "montos pagados", "pagado"],
+        },
+        "filtros": ["pagos_siniestros.estado_pago", "pagos_siniestros.tipo_pago", "pagos_siniestros.moneda"],
+        "uniones": {},
+    },
+    "siniestros": {
+        "alias": "s",
+        "nombres": ["siniestros", "siniestro", "reclamos", "reclamo", "reclamaciones", "reclamacion",
+                    "incidentes", "incidente"],
+        "contexto": ["afiliados", "afiliado", "clientes", "cliente", "asegurados", "asegurado"],
+        "fecha": "fecha_siniestro",
+        "conteo": "cantidad_siniestros",
+        "dimensiones": {
+            "siniestros.tipo_siniestro": ["tipo de siniestro", "tipos de siniestro", "tipo", "tipos"],
+            "siniestros.estado_siniestro": ["estado del siniestro", "estado de siniestro", "estado", "estados"],
+            "siniestros.gravedad": ["nivel de gravedad", "gravedad", "gravedades"],
+            "siniestros.provincia": ["provincia", "provincias", "region", "regiones"],
+            "siniestros.ciudad": ["ciudad", "ciudades"],
+            "siniestros.causa": ["causa", "causas"],
+            "afiliados.genero": ["genero", "sexo"],
+        },
+        "medidas": {},
+        "filtros": ["siniestros.tipo_siniestro", "siniestros.estado_siniestro", "siniestros.gravedad",
+                    "siniestros.provincia", "siniestros.ciudad", "siniestros.causa", "afiliados.genero"],
+        "uniones": {"afiliados": "id_afiliado"},
+    },
+    "polizas": {
+        "alias": "p",
+        "nombres": ["polizas", "poliza"],
+        "contexto": ["afiliados", "afiliado", "clientes", "cliente", "asegurados", "asegurado"],
+        "fecha": "fecha_inicio",
+        "conteo": "cantidad_polizas",
+        "dimensiones": {
+            "polizas.estado": ["estado de la poliza", "estado de las polizas", "estado", "estados"],
+            "polizas.tipo_riesgo": ["tipo de riesgo", "tipos de riesgo", "nivel de riesgo", "riesgo"],
+            "polizas.vigencia_meses": ["meses de vigencia", "vigencia", "vigencias"],
+            "productos.nombre": ["producto", "productos"],
+            "productos.tipo_seguro": ["tipo de seguro", "tipos de seguro"],
+            "afiliados.provincia": ["provincia", "provincias", "region", "regiones"],
+            "afiliados.ciudad": ["ciudad", "ciudades"],
+            "afiliados.genero": ["genero", "sexo"],
+        },
+        "medidas": {
+            "prima": ["primas", "prima"],
+            "monto_asegurado": ["montos asegurados", "monto asegurado", "suma asegurada", "sumas aseguradas"],
+        },
+        "filtros": ["polizas.estado", "polizas.tipo_riesgo", "productos.nombre", "productos.tipo_seguro",
+                    "afiliados.provincia", "afiliados.ciudad", "afiliados.genero"],
+        "uniones": {"afiliados": "id_afiliado", "productos": "id_producto"},
+    },
+    "afiliados": {
+        "alias": "a",
+        "nombres": ["afiliados", "afiliado", "clientes", "cliente", "asegurados", "asegurado"],
+        "contexto": [],
+        "fecha": "fecha_afiliacion",
+        "conteo": "cantidad_afiliados",
+        "dimensiones": {
+            "afiliados.provincia": ["provincia", "provincias", "region", "regiones"],
+            "afiliados.ciudad": ["ciudad", "ciudades"],
+            "afiliados.genero": ["genero", "sexo"],
+            "afiliados.actividad_economica": ["actividad economica", "actividades economicas", "actividad",
+                                              "actividades"],
+        },
+        "medidas": {
+            "antiguedad_meses": ["meses de antiguedad", "antiguedad"],
+        },
+        "filtros": ["afiliados.provincia", "afiliados.ciudad", "afiliados.genero", "afiliados.actividad_economica"],
+        "uniones": {},
+    },
+}
+ALIAS_UNIDAS = {"afiliados": "a", "productos": "pr"}
+
+# Agrupaciones por fecha del hecho: frase -> (expresión, nombre de la columna)
+TIEMPO = {
+    "mes": ("DATE_FORMAT({col}, '%Y-%m')", "anio_mes"),
+    "meses": ("DATE_FORMAT({col}, '%Y-%m')", "anio_mes"),
+    "ano": ("YEAR({col})", "anio"),
+    "anos": ("YEAR({col})", "anio"),
+    "anio": ("YEAR({col})", "anio"),
+}
+AGREGACIONES = {
+    "AVG": (["promedio", "promedios", "media", "medias", "medio", "medios"], "promedio"),
+    "SUM": (["total", "totales", "suma", "sumatoria"], "total"),
+}
+PALABRAS_CONTEO = ["cuantos", "cuantas", "numero", "cantidad", "conteo", "recuento", "total"]
+SINONIMOS_VALORES = {  # Columna -> valor -> formas en que se pregunta
+    "genero": {"M": ["hombres", "hombre", "masculino", "masculinos", "varones"],
+               "F": ["mujeres", "mujer", "femenino", "femeninas"]},
+}
+# Piden agrupar: si quedan sin una dimensión reconocida detrás, la plantilla no sabe hacerlo
+AGRUPADORES = {"por", "cada", "segun"}
+# Palabras que pueden quedar sin reconocer sin que cambie el significado de la consulta
+IGNORABLES = set("""
+a al el la los las lo un una unos unas de del en y e o con para por que cual cuales es son hay cada segun
+se me nos su sus todos todas cuanto cuantos cuantas
+muestra muestrame mostrar muestre muestren dame dime quiero ver obtener obten calcula calcular indica consulta
+grafico grafica graficos graficas graficar grafique visualiza visualizalo visualizala visualizar visualizacion
+genera generar crea crear haz resultados resultado datos tabla distribucion agrupa agrupalos agrupar
+agrupados agrupadas desglose desglosado registrados registradas registrado registrada existen tenemos
+tiene tienen actualmente barras pastel
+""".split())
+
+
+def _frase(opciones):
+    """Alternancia regex de frases completas (la más larga primero)."""
+    return "(?:" + "|".join(re.escape(o) for o in sorted(set(opciones), key=len, reverse=True)) + ")"
+
+
+def _limpiar(texto):
+    """Texto normalizado como palabras separadas por un espacio, con espacios en los extremos."""
+    return " " + " ".join(re.findall(r"[a-z0-9]+", _normalizar(texto))) + " "
+
+
+def _compilar_hecho(hecho):
+    """Patrones fijos de un hecho: nombres, medidas y agrupaciones."""
+    frases_dim = {}
+    for columna, frases in hecho["dimensiones"].items():
+        for f in frases:
+            frases_dim[f] = columna
+    for f in TIEMPO:
+        frases_dim[f] = f
+    dim = _frase(frases_dim)
+    articulo = r"(?: el| la| los| las)?"
+    medidas = []
+    for columna, frases in hecho["medidas"].items():
+        nombre = _frase(frases)
+        for funcion, (palabras, _) in AGREGACIONES.items():
+            agregacion = _frase(palabras)
+            medidas.append((re.compile(rf"(?<= ){agregacion}(?: de| del)?{articulo} {nombre}(?= )"), funcion, columna))
+            medidas.append((re.compile(rf"(?<= ){nombre} {agregacion}(?= )"), funcion, columna))
+    return {
+        "nombres": re.compile(rf"(?<= ){_frase(hecho['nombres'])}(?= )"),
+        "contexto": re.compile(rf"(?<= ){_frase(hecho['contexto'])}(?= )") if hecho["contexto"] else None,
+        "medidas": medidas,
+        "sin_agregar": re.compile(rf"(?<= ){_frase(f for fs in hecho['medidas'].values() for f in fs)}(?= )")
+        if hecho["medidas"] else None,
+        "dimensiones": re.compile(
+            rf"(?<= )(?:agrupad[oa]s? por|por|para cada|de cada|segun){articulo} ({dim})"
+            rf"(?:(?: y| e)(?: por)?{articulo} ({dim}))?(?= )"),
+        "frases_dim": frases_dim,
+        "columnas_dim": {c: re.compile(rf"(?<= ){_frase(fs)}(?= )") for c, fs in hecho["dimensiones"].items()},
+    }
+
+
+_PATRONES = {nombre: _compilar_hecho(hecho) for nombre, hecho in HECHOS.items()}
+_CONTEO = re.compile(rf"(?<= ){_frase(PALABRAS_CONTEO)}(?= )")
+# Lo que se cuenta: el sustantivo tras "cuantos", "numero de", "cantidad de"...
+_CONTADO = re.compile(r"(?<= )(?:cuantos|cuantas|(?:numero|cantidad|total|conteo|recuento) de)"
+                      r"(?: (?:el|la|los|las|de|del|total))* ([a-z0-9]+)(?= )")
+_NOMBRES_HECHOS = {n: set(h["nombres"]) for n, h in HECHOS.items()}
+_ANIOS = re.compile(r"(?<= )(?:entre(?: el)?(?: ano)? (\d{4}) y(?: el)? (\d{4})"
+                    r"|(?:(?:en|del|de|durante)(?: el)?(?: ano)? )?(\d{4}))(?= )")
+
+
+def _consumir(texto, inicio, fin):
+    return texto[:inicio] + " " * (fin - inicio) + texto[fin:]
+
+
+# --- Diccionario de valores ---
+def _variantes(valor):
+    """Formas normalizadas de un valor, con su plural ('Activa' -> 'activa', 'activas')."""
+    base = _limpiar(valor).strip()
+    if len(base) < 2:
+        return []
+    plural = base + ("s" if base[-1] in "aeiou" else "es")
+    return [base, plural]
+
+
+def compilar_valores(valores):
+    """{"tabla.columna": [valores]} -> {"tabla.columna": (regex, {forma: valor})}."""
+    compilado = {}
+    for columna, lista in valores.items():
+        formas = {}
+        for valor in lista:
+            for forma in _variantes(valor):
+                formas.setdefault(forma, valor)
+        for valor, sinonimos in SINONIMOS_VALORES.get(columna.split(".")[1], {}).items():
+            if valor in lista:
+                for forma in sinonimos:
+                    formas.setdefault(forma, valor)
+        if formas:
+            compilado[columna] = (re.compile(rf"(?<= ){_frase(formas)}(?= )"), formas)
+    return compilado
+
+
+def _leer_valores(engine):
+    esquema = leer_esquema(engine)
+    columnas = {c for hecho in HECHOS.values() for c in hecho["filtros"]}
+    valores = {}
+    with engine.connect() as conexion:
+        for clave in sorted(columnas):
+            tabla, columna = clave.split(".")
+            info = next((c for c in esquema["tablas"].get(tabla, []) if c["nombre"] == columna), None)
+            if info is None:
+                continue
+            if info["enum"] is not None:
+                valores[clave] = info["enum"]
+            elif info["tipo"] in ("varchar", "char"):
+                filas = conexion.execute(text(
+                    f"SELECT DISTINCT `{columna}` FROM `{tabla}` WHERE `{columna}` IS NOT NULL LIMIT {MAX_VALORES + 1}"
+                )).fetchall()
+                if len(filas) <= MAX_VALORES:
+                    valores[clave] = [str(f[0]) for f in filas]
+    return valores
+
+
+_cache_valores = {}  # url -> (instante, compilado)
+_construyendo = set()
+_lock = threading.Lock()
+
+
+def _construir(engine, clave):
+    try:
+        compilado = compilar_valores(_leer_valores(engine))
+        with _lock:
+            _cache_valores[clave] = (time.time(), compilado)
+    except Exception:
+        pass  # Sin diccionario las preguntas siguen yendo al LLM; se reintenta en la próxima
+    finally:
+        with _lock:
+            _construyendo.discard(clave)
+
+
+def diccionario_valores(engine):
+    """Valores filtrables compilados, o None mientras se construye por primera vez.
+
+    Si el diccionario venció se sigue usando el anterior mientras se renueva en segundo plano.
+    """
+    clave = str(engine.url)
+    with _lock:
+        cacheado = _cache_valores.get(clave)
+        if cacheado and time.time() - cacheado[0] < TTL_VALORES:
+            return cacheado[1]
+        if clave not in _construyendo:
+            _construyendo.add(clave)
+            threading.Thread(target=_construir, args=(engine, clave), daemon=True,
+                             name="plantillas-valores").start()
+    return cacheado[1] if cacheado else None
+
+
+def precargar(engine):
+    """Empieza a construir el diccionario de valores sin bloquear el arranque."""
+    diccionario_valores(engine)
+
+
+# --- Emparejado ---
+def _filtros_valores(restante, patrones, hecho, valores):
+    """Valores de la BD mencionados: ({columna: [valores]}, texto restante), o None si es ambiguo."""
+    encontrados = []
+    for columna in hecho["filtros"]:
+        if columna not in valores:
+            continue
+        regex, formas = valores[columna]
+        for m in regex.finditer(restante):
+            encontrados.append((m.start(), m.end(), columna, formas[m.group(0)]))
+    # Primero las coincidencias más largas ('Salud Individual' antes que 'Salud')
+    encontrados.sort(key=lambda e: e[0] - e[1])
+    aceptados = []
+    for inicio, fin, columna, valor in encontrados:
+        solapado = [a for a in aceptados if inicio < a[1] and a[0] < fin]
+        if any(a[:2] == (inicio, fin) and a[2] != columna for a in solapado):
+            return None  # El mismo texto es valor de dos columnas: no hay forma segura de elegir
+        if not solapado:
+            aceptados.append((inicio, fin, columna, valor))
+    filtros = {}
+    for inicio, fin, columna, valor in sorted(aceptados):
+        restante = _consumir(restante, inicio, fin)
+        if valor not in filtros.setdefault(columna, []):
+            filtros[columna].append(valor)
+    # "en estado Activa", "de gravedad Grave": el nombre de la columna filtrada no es una agrupación
+    for columna in filtros:
+        regex = patrones["columnas_dim"].get(columna)
+        if regex is not None:
+            restante = regex.sub(lambda m: " " * len(m.group(0)), restante)
+    return filtros, restante
+
+
+def emparejar(pregunta, valores):
+    """SQL para la pregunta si encaja con seguridad en una plantilla, si no None.
+
+    `valores` es el diccionario compilado de `compilar_valores`.
+    """
+    texto = restante = _limpiar(pregunta)
+    nombre = next((n for n, p in _PATRONES.items()
+                   if p["nombres"].search(restante)
+                   or any(regex.search(restante) for regex, _, _ in p["medidas"])), None)
+    if nombre is None:
+        return None
+    hecho, patrones = HECHOS[nombre], _PATRONES[nombre]
+    alias = hecho["alias"]
+    condiciones = []
+
+    # "cuantos afiliados tienen polizas activas": se cuentan afiliados, no pólizas
+    contado = _CONTADO.search(texto)
+    if contado is not None and contado.group(1) not in _NOMBRES_HECHOS[nombre]:
+        otros = set(hecho["contexto"]).union(*(v for n, v in _NOMBRES_HECHOS.items() if n != nombre))
+        if contado.group(1) in otros:
+            return None
+
+    # Años: un año o un rango "entre X y Y", como rango sargable sobre la fecha del hecho
+    anios = list(_ANIOS.finditer(restante))
+    if len(anios) > 1:
+        return None
+    if anios:
+        m = anios[0]
+        desde, hasta = (int(m.group(1)), int(m.group(2))) if m.group(1) else (int(m.group(3)), int(m.group(3)))
+        if not 1900 <= desde <= hasta <= 2100:
+            return None
+        condiciones.append(f"{alias}.{hecho['fecha']} >= '{desde}-01-01' AND {alias}.{hecho['fecha']} < '{hasta + 1}-01-01'")
+        restante = _consumir(restante, m.start(), m.end())
+
+    # Medida: agregación junto al nombre de la columna ("prima promedio", "total pagado"), o conteo
+    medida = None
+    for regex, funcion, columna in patrones["medidas"]:
+        m = regex.search(restante)
+        if m:
+            medida = (f"{funcion}({alias}.{columna})", f"{columna}_{AGREGACIONES[funcion][1]}")
+            restante = _consumir(restante, m.start(), m.end())
+            break
+    if medida is None:
+        if patrones["sin_agregar"] is not None and patrones["sin_agregar"].search(restante):
+            return None  # Menciona una medida sin decir cómo agregarla
+        medida = ("COUNT(*)", hecho["conteo"])
+        restante = _CONTEO.sub(lambda m: " " * len(m.group(0)), restante)
+
+    # Agrupaciones: "por X", "para cada X", "por X y (por) Y"
+    dimensiones = []
+    for m in patrones["dimensiones"].finditer(restante):
+        for frase in m.groups():
+            if frase is not None and patrones["frases_dim"][frase] not in dimensiones:
+                dimensiones.append(patrones["frases_dim"][frase])
+        restante = _consumir(restante, m.start(), m.end())
+
+    # "por afiliado", "cada cliente", "según ...": agrupación que no es una dimensión conocida
+    if any(palabra in AGRUPADORES for palabra in restante.split()):
+        return None
+
+    resultado = _filtros_valores(restante, patrones, hecho, valores)
+    if resultado is None:
+        return None
+    filtros, restante = resultado
+
+    if patrones["contexto"] is not None:
+        for m in patrones["contexto"].finditer(restante):
+            # "por provincia y afiliado": el contexto es otra agrupación, no se puede ignorar
+            anterior = texto[:m.start()].split()[-1:]
+            if anterior and anterior[0] in AGRUPADORES | {"y"}:
+                return None
+    for regex in (patrones["nombres"], patrones["contexto"]):
+        if regex is not None:
+            restante = regex.sub(lambda m: " " * len(m.group(0)), restante)
+    if any(palabra not in IGNORABLES for palabra in restante.split()):
+        return None  # Queda algo que la plantilla no entiende: mejor que lo resuelva el LLM
+
+    def expresion(columna):
+        tabla, nombre_columna = columna.split(".")
+        return f"{alias if tabla == nombre else ALIAS_UNIDAS[tabla]}.{nombre_columna}"
+
+    seleccion, agrupacion, orden = [], [], []
+    for dimension in dimensiones:
+        if dimension in TIEMPO:
+            plantilla, nombre_columna = TIEMPO[dimension]
+            expr = plantilla.format(col=f"{alias}.{hecho['fecha']}")
+            if expr in agrupacion:
+                continue
+            seleccion.append(f"{expr} AS {nombre_columna}")
+            orden.append(nombre_columna)
+        else:
+            expr = expresion(dimension)
+            seleccion.append(expr)
+        agrupacion.append(expr)
+    seleccion.append(f"{medida[0]} AS {medida[1]}")
+
+    for columna, lista in filtros.items():
+        literales = ", ".join("'" + v.replace("'", "''") + "'" for v in lista)
+        condiciones.append(f"{expresion(columna)} = {literales}" if len(lista) == 1
+                           else f"{expresion(columna)} IN ({literales})")
+
+    unidas = {c.split(".")[0] for c in dimensiones + list(filtros) if "." in c} - {nombre}
+    sql = f"SELECT {', '.join(seleccion)} FROM {nombre} {alias}"
+    for tabla in sorted(unidas):
+        clave = hecho["uniones"].get(tabla)
+        if clave is None:
+            return None
+        sql += f" JOIN {tabla} {ALIAS_UNIDAS[tabla]} ON {alias}.{clave} = {ALIAS_UNIDAS[tabla]}.{clave}"
+    if condiciones:
+        sql += " WHERE " + " AND ".join(condiciones)
+    if agrupacion:
+        sql += " GROUP BY " + ", ".join(agrupacion)
+        sql += " ORDER BY " + (", ".join(orden) if orden else f"{medida[1]} DESC")
+    return sql + ";"
+
+
+# --- Punto de entrada y estadísticas ---
+_estadisticas = {"consultas": 0, "aciertos": 0, "segundos": 0.0}
+
+
+def responder(engine, pregunta):
+    """SQL de plantilla para la pregunta, o None si hay que preguntarle al LLM."""
+    inicio = time.perf_counter()
+    valores = diccionario_valores(engine)
+    sql = emparejar(pregunta, valores) if valores is not None else None
+    with _lock:
+        _estadisticas["consultas"] += 1
+        _estadisticas["aciertos"] += sql is not None
+        _estadisticas["segundos"] += time.perf_counter() - inicio
+    return sql
+
+
+def estadisticas():
+    """Consultas evaluadas, aciertos, tasa de aciertos y ms medios por consulta."""
+    with _lock:
+        consultas, aciertos, segundos = (_estadisticas["consultas"], _estadisticas["aciertos"],
+                                         _estadisticas["segundos"])
+    return {
+        "consultas": consultas,
+        "aciertos": aciertos,
+        "tasa": aciertos / consultas if consultas else 0.0,
+        "ms_medio": segundos * 1000 / consultas if consultas else 0.0,
+    }
+
+
+# --- Regresión del emparejado ---
+# Preguntas con la respuesta esperada (un fragmento del SQL, o None si debe ir al LLM),
+# sobre un diccionario de valores fijo: `python plantillas_sql.py` las comprueba sin BD.
+VALORES_REGRESION = {"afiliados.provincia": ["Florida", "Texas"], "afiliados.genero": ["M", "F"],
+                     "polizas.estado": ["Activa", "Vencida"]}
+CASOS_REGRESION = [
+    ("cuantos siniestros por provincia", "GROUP BY s.provincia"),
+    ("cuantas polizas activas hay", "WHERE p.estado = 'Activa'"),
+    ("cuantas polizas por año", "GROUP BY YEAR(p.fecha_inicio)"),
+    ("cuantos siniestros de afiliados mujeres", "WHERE a.genero = 'F'"),
+    # Agrupación por una entidad que no es dimensión: no se puede responder con un conteo total
+    ("cuantos siniestros por afiliado", None),
+    ("cuantas polizas tiene cada cliente", None),
+    ("cuantos siniestros hay por cada asegurado", None),
+    ("cuantos siniestros segun cliente", None),
+    ("cuantos siniestros por provincia y afiliado", None),
+    # Se cuenta el "contexto" u otro hecho, no el hecho reconocido
+    ("cuantos afiliados tienen polizas activas", None),
+    ("cuantos clientes tienen siniestros", None),
+    ("cuantos afiliados con siniestros aprobados", None),
+    ("cuantas evaluaciones de siniestros hay", "FROM evaluaciones_siniestro e"),
+    ("numero de polizas de afiliados mujeres", "WHERE a.genero = 'F'"),
+]
+
+
+def main():
+    valores = compilar_valores(VALORES_REGRESION)
+    fallos = 0
+    for pregunta, esperado in CASOS_REGRESION:
+        sql = emparejar(pregunta, valores)
+        correcto = sql is None if esperado is None else sql is not None and esperado in sql
+        fallos += not correcto
+        print(f"{'OK   ' if correcto else 'FALLO'} {pregunta!r} -> {sql}")
+    print(f"{len(CASOS_REGRESION) - fallos} de {len(CASOS_REGRESION)} correctos")
+    raise SystemExit(1 if fallos else 0)
+
+
+if __name__ == "__main__":
+    main()
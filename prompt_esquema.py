@@ -0,0 +1,320 @@
+# === Constructor de prompt con solo las tablas relevantes (schema linking) ===
+# En vez de enviar siempre las seis tablas de dbseguro, se lee el esquema real desde
+# information_schema (cacheado), se eligen las tablas/columnas que la pregunta menciona
+# y se añaden las tablas puente necesarias según las claves foráneas. Menos tokens de
+# prompt = menos tiempo de evaluación en Ollama (el coste dominante en CPU).
+
+import re
+import threading
+import time
+import unicodedata
+from collections import deque
+
+from sqlalchemy import text
+
+TTL_ESQUEMA = 600  # Segundos que se reutiliza el esquema leído de information_schema
+# Columnas generadas o invisibles (las del asesor de índices); DEFAULT_GENERATED de un
+# TIMESTAMP con DEFAULT CURRENT_TIMESTAMP sí es una columna normal
+_EXTRA_OCULTAS = re.compile(r"\b(?:VIRTUAL|STORED) GENERATED\b|\bINVISIBLE\b", re.IGNORECASE)
+PREFIJO_AGREGADOS = "agr_"  # Tablas de agregados.py (y su catálogo agr_catalogo): internas, no van al LLM
+
+# Descripción de negocio de cada tabla (no está en la BD)
+DESCRIPCIONES_TABLAS = {
+    "afiliados": "contiene información de los clientes",
+    "productos": "describe los seguros ofrecidos",
+    "polizas": "vincula a un afiliado con un producto y detalla la cobertura",
+    "siniestros": "registra los incidentes reportados bajo una póliza por un afiliado",
+    "pagos_siniestros": "detalla los pagos realizados por un siniestro",
+    "evaluaciones_siniestro": "contiene los detalles de la evaluación de un siniestro",
+}
+
+# Palabras de las preguntas que apuntan a una tabla o columna concreta
+SINONIMOS = {
+    "region": ["afiliados.provincia"],
+    "cliente": ["afiliados"],
+    "asegurado": ["afiliados"],
+    "edad": ["afiliados.fecha_nacimiento"],
+    "ano": ["afiliados.fecha_nacimiento"],
+    "reclamo": ["siniestros"],
+    "reclamacion": ["siniestros"],
+    "incidente": ["siniestros"],
+    "aprobado": ["siniestros.estado_siniestro"],
+    "pagado": ["siniestros.estado_siniestro", "pagos_siniestros"],
+    "seguro": ["productos.tipo_seguro"],
+    "perito": ["evaluaciones_siniestro"],
+    "fraude": ["evaluaciones_siniestro.puntaje_fraude"],
+    "rechazo": ["evaluaciones_siniestro.motivo_rechazo"],
+    "cobertura": ["polizas.monto_asegurado"],
+}
+
+# Partes de nombre de columna demasiado genéricas para decidir por sí solas
+PARTES_GENERICAS = {"id", "fecha", "tipo", "estado", "nombre"}
+
+# Esquema completo de dbseguro: respaldo si no se puede leer information_schema
+ESQUEMA_COMPLETO = (
+    "Tienes las siguientes tablas en la base de datos MySQL llamada dbseguro:\n"
+    "• afiliados(id_afiliado, nombre, documento, fecha_nacimiento, genero, actividad_economica, provincia, ciudad, codigo_postal, antiguedad_meses, fecha_afiliacion)\n"
+    "• productos(id_producto, nombre, tipo_seguro, riesgos_cubiertos, deducible, condiciones_generales)\n"
+    "• polizas(id_poliza, id_afiliado, id_producto, fecha_inicio, fecha_fin, estado, monto_asegurado, prima, tipo_riesgo, vigencia_meses)\n"
+    "• siniestros(id_siniestro, id_poliza, id_afiliado, fecha_siniestro, fecha_denuncia, tipo_siniestro, estado_siniestro, provincia, ciudad, causa, descripcion, gravedad)\n"
+    "• pagos_siniestros(id_pago, id_siniestro, fecha_pago, monto_pagado, estado_pago, tipo_pago, moneda, cuenta_destino)\n"
+    "• evaluaciones_siniestro(id_evaluacion, id_siniestro, id_perito, fecha_evaluacion, monto_estimado, monto_rechazado, motivo_rechazo, puntaje_fraude, comentarios)\n"
+    "\n"
+    "Detalles importantes sobre los valores en las columnas y relaciones:\n"
+    "- La tabla 'afiliados' contiene información de los clientes.\n"
+    "- La tabla 'productos' describe los seguros ofrecidos.\n"
+    "- La tabla 'polizas' vincula a un 'afiliado' (mediante 'id_afiliado') con un 'producto' (mediante 'id_producto') y detalla la cobertura.\n"
+    "  - 'polizas.estado' puede ser: 'Activa', 'Cancelada', 'Vencida'.\n"
+    "  - 'polizas.tipo_riesgo' puede ser: 'Alto', 'Medio', 'Bajo'.\n"
+    "- La tabla 'siniestros' registra los incidentes reportados bajo una 'poliza' (mediante 'id_poliza') por un 'afiliado' (mediante 'id_afiliado').\n"
+    "  - 'siniestros.estado_siniestro' puede ser: 'Pendiente', 'Pagado', 'Rechazado'.\n"
+    "  - 'siniestros.gravedad' puede ser: 'Leve', 'Moderada', 'Grave'.\n"
+    "- La tabla 'pagos_siniestros' detalla los pagos realizados por un 'siniestro' (mediante 'id_siniestro').\n"
+    "  - 'pagos_siniestros.estado_pago' puede ser: 'Procesado', 'Pendiente'.\n"
+    "- La tabla 'evaluaciones_siniestro' contiene los detalles de la evaluación de un 'siniestro' (mediante 'id_siniestro').\n"
+    "- 'afiliados.genero' puede ser: 'M' (Masculino), 'F' (Femenino).\n"
+    "- Las columnas de fecha son: afiliados.fecha_nacimiento, afiliados.fecha_afiliacion, polizas.fecha_inicio, polizas.fecha_fin, siniestros.fecha_siniestro, siniestros.fecha_denuncia, pagos_siniestros.fecha_pago, evaluaciones_siniestro.fecha_evaluacion.\n"
+)
+
+# Reglas fijas para generar SQL (no dependen de la pregunta)
+REGLAS_SQL = (
+    "REGLA CRÍTICA PARA FECHAS Y AGRUPACIONES: Las funciones de fecha como YEAR(col_fecha), MONTH(col_fecha), DAY(col_fecha) y DATE_FORMAT(col_fecha, 'formato') SOLO deben usarse en columnas que son explícitamente de tipo fecha (las listadas arriba). NUNCA uses funciones de fecha en columnas de texto como 'provincia', 'ciudad', 'nombre', 'tipo_seguro', 'estado_siniestro', etc. Si la pregunta pide agrupar por 'año-mes' de una columna de fecha real, puedes usar DATE_FORMAT(col_fecha_real, '%Y-%m') AS anio_mes. Para agrupaciones por columnas de texto como 'ciudad' o 'provincia', simplemente usa el nombre de la columna en el SELECT y en el GROUP BY. Por ejemplo, para 'Número de afiliados por ciudad', el SQL sería: SELECT ciudad, COUNT(id_afiliado) FROM afiliados GROUP BY ciudad.\n"
+    "\nConvierte la pregunta del usuario en SQL compatible con MySQL / SingleStore. "
+    "Solo devuelve el SQL, sin explicaciones ni comentarios. "
+    "Si la pregunta implica contar o sumar por categorías (por ejemplo, 'cuántos por provincia', 'total por tipo_seguro', 'suma por año de fecha_siniestro', 'conteo por mes de fecha_afiliacion'), "
+    "asegúrate de incluir la función de agregación (COUNT, SUM, etc.) en el SELECT y usar GROUP BY en la consulta SQL para obtener los resultados agregados por categoría. Por ejemplo, para 'conteo por mes de fecha_afiliacion en 2023', el SELECT podría ser DATE_FORMAT(fecha_afiliacion, '%Y-%m') AS anio_mes, COUNT(id_afiliado) AS cantidad_afiliados o YEAR(fecha_afiliacion) AS anio, MONTH(fecha_afiliacion) AS mes, COUNT(id_afiliado) AS cantidad_afiliados, y el WHERE incluiría YEAR(fecha_afiliacion) = 2023."
+)
+
+_cache_esquemas = {}
+_lock = threading.Lock()
+
+
+def _normalizar(texto):
+    texto = unicodedata.normalize("NFKD", texto.lower())
+    return "".join(c for c in texto if not unicodedata.combining(c))
+
+
+def _raiz(palabra):
+    # Stemming mínimo para igualar singular/plural
+    if len(palabra) > 4 and palabra.endswith("es"):
+        return palabra[:-2]
+    if len(palabra) > 3 and palabra.endswith("s"):
+        return palabra[:-1]
+    return palabra
+
+
+def _raices(texto):
+    return {_raiz(p) for p in re.findall(r"[a-z0-9]+", _normalizar(texto))}
+
+
+def contar_tokens(texto):
+    """Estimación de tokens del prompt (palabras y signos; aproxima el tokenizador del modelo)."""
+    return len(re.findall(r"\w+|[^\w\s]", texto))
+
+
+# --- Introspección ---
+def leer_esquema(engine):
+    """Lee tablas, columnas, ENUMs y claves foráneas del esquema actual (cacheado TTL_ESQUEMA).
+
+    Las tablas de agregados (agr_*) no se incluyen: son un detalle interno de la reescritura.
+    Tampoco las columnas generadas o invisibles (las que crea el asesor de índices).
+    """
+    clave = str(engine.url)
+    with _lock:
+        cacheado = _cache_esquemas.get(clave)
+        if cacheado and time.time() - cacheado[0] < TTL_ESQUEMA:
+            return cacheado[1]
+
+    with engine.connect() as conexion:
+        columnas = conexion.execute(text(
+            "SELECT TABLE_NAME, COLUMN_NAME, DATA_TYPE, COLUMN_TYPE, COLUMN_KEY, EXTRA "
+            "FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = DATABASE() "
+            "ORDER BY TABLE_NAME, ORDINAL_POSITION"
+        )).fetchall()
+        claves_foraneas = conexion.execute(text(
+            "SELECT TABLE_NAME, COLUMN_NAME, REFERENCED_TABLE_NAME, REFERENCED_COLUMN_NAME "
+            "FROM information_schema.KEY_COLUMN_USAGE "
+            "WHERE TABLE_SCHEMA = DATABASE() AND REFERENCED_TABLE_NAME IS NOT NULL "
+            "ORDER BY TABLE_NAME, COLUMN_NAME"
+        )).fetchall()
+
+    esquema = {"tablas": {}, "claves_foraneas": []}
+    for tabla, columna, tipo, tipo_columna, clave_columna, extra in columnas:
+        if tabla.lower().startswith(PREFIJO_AGREGADOS) or _EXTRA_OCULTAS.search(extra or ""):
+            continue
+        valores_enum = None
+        if tipo.lower() == "enum":
+            valores_enum = re.findall(r"'((?:[^']|'')*)'", tipo_columna)
+        esquema["tablas"].setdefault(tabla, []).append({
+            "nombre": columna,
+            "tipo": tipo.lower(),
+            "enum": valores_enum,
+            "clave": clave_columna,
+        })
+    for tabla, columna, tabla_ref, columna_ref in claves_foraneas:
+        if tabla.lower().startswith(PREFIJO_AGREGADOS) or tabla_ref.lower().startswith(PREFIJO_AGREGADOS):
+            continue
+        esquema["claves_foraneas"].append((tabla, columna, tabla_ref, columna_ref))
+
+    with _lock:
+        _cache_esquemas[clave] = (time.time(), esquema)
+    return esquema
+
+
+# --- Selección de tablas ---
+def _grafo_fk(esquema):
+    grafo = {t: set() for t in esquema["tablas"]}
+    for tabla, _, tabla_ref, _ in esquema["claves_foraneas"]:
+        if tabla in grafo and tabla_ref in grafo:
+            grafo[tabla].add(tabla_ref)
+            grafo[tabla_ref].add(tabla)
+    return grafo
+
+
+def _camino(grafo, origen, destino):
+    anteriores = {origen: None}
+    cola = deque([origen])
+    while cola:
+        actual = cola.popleft()
+        if actual == destino:
+            camino = []
+            while actual is not None:
+                camino.append(actual)
+                actual = anteriores[actual]
+            return camino
+        for vecino in sorted(grafo[actual]):
+            if vecino not in anteriores:
+                anteriores[vecino] = actual
+                cola.append(vecino)
+    return []
+
+
+def seleccionar_tablas(pregunta, esquema):
+    """Devuelve {tabla: set(columnas mencionadas)} con las tablas relevantes para la pregunta.
+
+    Las tablas puente necesarias para unir las seleccionadas (según las FK) se añaden
+    con None: del prompt solo necesitan sus columnas clave.
+    """
+    raices = _raices(pregunta)
+    puntajes = {}
+    mencionadas = {}
+
+    def _sumar(tabla, puntos, columna=None):
+        if tabla not in esquema["tablas"]:
+            return
+        puntajes[tabla] = puntajes.get(tabla, 0) + puntos
+        columnas = mencionadas.setdefault(tabla, set())
+        if columna:
+            columnas.add(columna)
+
+    columnas_clave = {(t, c) for t, c, _, _ in esquema["claves_foraneas"]}
+    for tabla, columnas in esquema["tablas"].items():
+        # El nombre de la tabla debe aparecer completo ("pagos siniestros"), no solo una parte
+        if _raices(tabla.replace("_", " ")) <= raices:
+            _sumar(tabla, 3)
+        for columna in columnas:
+            # Las claves (id_poliza en siniestros...) no indican que se pregunte por esa tabla
+            if columna["clave"] == "PRI" or (tabla, columna["nombre"]) in columnas_clave:
+                continue
+            partes = _raices(columna["nombre"].replace("_", " ")) - PARTES_GENERICAS
+            if partes & raices:
+                _sumar(tabla, 1, columna["nombre"])
+            for valor in columna["enum"] or []:
+                if _raices(valor) & raices:
+                    _sumar(tabla, 2, columna["nombre"])
+    for raiz in raices:
+        for destino in SINONIMOS.get(raiz, []):
+            tabla, _, columna = destino.partition(".")
+            _sumar(tabla, 2, columna or None)
+
+    if not puntajes:
+        # Sin pistas: mejor enviar todo el esquema que dejar al modelo sin la tabla correcta
+        return {t: set() for t in esquema["tablas"]}
+
+    seleccion = {t: mencionadas.get(t, set()) for t in puntajes}
+    grafo = _grafo_fk(esquema)
+    tablas = sorted(seleccion)
+    for i, origen in enumerate(tablas):
+        for destino in tablas[i + 1:]:
+            for intermedia in _camino(grafo, origen, destino):
+                seleccion.setdefault(intermedia, None)  # Tabla puente: solo sus claves
+    return seleccion
+
+
+# --- Texto del prompt ---
+def describir_esquema(esquema, seleccion, nombre_bd="dbseguro"):
+    """Bloque de esquema en el mismo formato que el prompt original, solo con lo seleccionado.
+
+    Las tablas se listan en orden alfabético para que el texto sea idéntico cada vez
+    que se elige el mismo conjunto.
+    """
+    lineas = [f"Tienes las siguientes tablas en la base de datos MySQL llamada {nombre_bd}:"]
+    detalles = []
+    columnas_fecha = []
+    columnas_clave = {(t, c) for t, c, _, _ in esquema["claves_foraneas"]}
+    for tabla in sorted(seleccion):
+        columnas = esquema["tablas"][tabla]
+        if seleccion[tabla] is None:
+            columnas = [c for c in columnas if c["clave"] == "PRI" or (tabla, c["nombre"]) in columnas_clave]
+        lineas.append(f"• {tabla}({', '.join(c['nombre'] for c in columnas)})")
+        if tabla in DESCRIPCIONES_TABLAS:
+            detalles.append(f"- La tabla '{tabla}' {DESCRIPCIONES_TABLAS[tabla]}.")
+        for columna in columnas:
+            if columna["enum"]:
+                valores = ", ".join(f"'{v}'" for v in columna["enum"])
+                detalles.append(f"  - '{tabla}.{columna['nombre']}' puede ser: {valores}.")
+            if columna["tipo"] in ("date", "datetime", "timestamp"):
+                columnas_fecha.append(f"{tabla}.{columna['nombre']}")
+    for tabla, columna, tabla_ref, columna_ref in esquema["claves_foraneas"]:
+        if tabla in seleccion and tabla_ref in seleccion:
+            detalles.append(f"- '{tabla}.{columna}' referencia a '{tabla_ref}.{columna_ref}'.")
+    if columnas_fecha:
+        detalles.append(f"- Las columnas de fecha son: {', '.join(columnas_fecha)}.")
+
+    texto = "\n".join(lineas) + "\n"
+    if detalles:
+        texto += "\nDetalles importantes sobre los valores en las columnas y relaciones:\n" + "\n".join(detalles) + "\n"
+    return texto
+
+
+def construir_bloque_esquema(engine, pregunta, nombre_bd="dbseguro"):
+    """Devuelve (texto_esquema, tablas_elegidas) para la pregunta, o (None, None) si falla la introspección.
+
+    Con pregunta=None se describen todas las tablas.
+    """
+    try:
+        esquema = leer_esquema(engine)
+    except Exception:
+        return None, None
+    if not esquema["tablas"]:
+        return None, None
+    if pregunta is None:
+        seleccion = {t: set() for t in esquema["tablas"]}
+    else:
+        seleccion = seleccionar_tablas(pregunta, esquema)
+    return describir_esquema(esquema, seleccion, nombre_bd), sorted(seleccion)
+
+
+def construir_mensajes_sql(engine, pregunta, nombre_bd="dbseguro", prefijo_estable=True):
+    """Mensajes de chat para traducir la pregunta a SQL. Devuelve (mensajes, tablas).
+
+    Con prefijo_estable=True el esquema completo y las reglas van en un mensaje de sistema
+    que es byte a byte igual en todas las preguntas: Ollama reutiliza la caché KV de ese
+    prefijo y solo evalúa los pocos tokens de la pregunta. Con False se envían solo las
+    tablas relevantes junto a la pregunta (prompt más corto cuando no hay caché).
+    """
+    if prefijo_estable:
+        bloque, tablas = construir_bloque_esquema(engine, None, nombre_bd)
+        if bloque is None:
+            bloque, tablas = ESQUEMA_COMPLETO, None
+        return [
+            {"role": "system", "content": bloque + REGLAS_SQL},
+            {"role": "user", "content": f"Pregunta: '{pregunta}'"},
+        ], tablas
+
+    bloque, tablas = construir_bloque_esquema(engine, pregunta, nombre_bd)
+    if bloque is None:
+        bloque, tablas = ESQUEMA_COMPLETO, None
+    return [
+        {"role": "user", "content": bloque + REGLAS_SQL + f"\n\nPregunta: '{pregunta}'"},
+    ], tablas
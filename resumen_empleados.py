@@ -0,0 +1,239 @@
+# === Resumen de empleados mantenido de forma incremental (appretail) ===
+# construir_resumen_dinamico recalculaba en cada pregunta cinco groupby/value_counts sobre
+# toda la tabla de empleados y formateaba cada empresa con iterrows. Aquí se guardan los
+# agregados que necesita el texto (sumas y conteos, no promedios) y se actualizan con las
+# filas que cambian en el almacén: restar las quitadas y sumar las agregadas es O(delta).
+# El texto se genera una vez por versión de la tabla. Con muchas empresas el texto solo
+# trae rankings y los datos de cada empresa van al índice de hechos (`hechos_empresas`).
+
+import threading
+from collections import Counter, defaultdict
+
+import pandas as pd
+
+TABLA = "empresas_empleados"
+SALARIO_PROVINCIA_ALTO = 2500
+MAX_EMPRESAS_CASADOS = 5
+MAX_CARGOS_NIVEL = 5
+MAX_RANKING_EMPRESAS = 5  # Empresas por ranking cuando no se listan todas
+NIVEL_CARGOS = "medio-alto"
+MIN_FILAS_AGRUPAR = 500  # Con menos filas (refrescos) se acumulan una a una, sin groupby
+SUMAS = ["suma_salario", "n_salario", "suma_edad", "n_edad", "filas"]
+
+
+def _preparar(df):
+    """Claves y columnas a sumar de las filas de empleados (salario y edad con sus conteos)."""
+    salario = df["salario_estimado"].astype("float64")
+    edad = df["edad"].astype("float64")
+    return pd.DataFrame({
+        "empresa": df["nombre_empresa"], "provincia": df["provincia"],
+        "nivel": df["nivel_socioeconomico"], "cargo": df["cargo"],
+        "casado_40": (df["estado_civil"] == 'casado') & (edad > 40),
+        "suma_salario": salario.fillna(0.0), "n_salario": salario.notna().astype("int64"),
+        "suma_edad": edad.fillna(0.0), "n_edad": edad.notna().astype("int64"), "filas": 1,
+    })
+
+
+def _grupos(datos, claves, columnas):
+    """(clave, sumas) por combinación de claves no nulas."""
+    sumas = datos.groupby(claves, observed=True)[columnas].sum()
+    return zip(sumas.index, sumas.itertuples(index=False, name=None))
+
+
+def _acumular(destino, clave, sumas, signo):
+    """Suma (o resta) las sumas de un grupo y lo quita si se queda sin filas."""
+    acumulado = destino[clave]
+    for i, suma in enumerate(sumas):
+        acumulado[i] += signo * suma
+    if acumulado[-1] <= 0:
+        del destino[clave]
+
+
+def _sumar(contador, clave, cantidad):
+    """Suma al contador y quita la clave si se queda sin filas."""
+    contador[clave] += cantidad
+    if contador[clave] <= 0:
+        del contador[clave]
+
+
+def _mas_comunes(contador, n):
+    """Los n más frecuentes; a igual cantidad, por nombre (el orden no depende del historial)."""
+    return sorted(contador.items(), key=lambda par: (-par[1], par[0]))[:n]
+
+
+class ResumenEmpleados:
+    """Agregados por empresa, provincia, nivel y cargo, sincronizados con el almacén."""
+
+    def __init__(self, almacen):
+        self.almacen = almacen
+        self._lock = threading.Lock()
+        self.version = None
+        self._textos = {}  # por_empresa -> texto de la versión actual
+        self.estadisticas = {"reconstrucciones": 0, "actualizaciones": 0, "filas_aplicadas": 0}
+        self._vaciar()
+
+    def _vaciar(self):
+        self.empresas = defaultdict(lambda: [0.0, 0, 0.0, 0, 0])  # Salario/edad: sumas y conteos
+        self.provincias = defaultdict(lambda: [0.0, 0, 0.0, 0, 0])
+        self.casados_40 = Counter()  # empresa -> empleados casados mayores de 40
+        self.cargos_nivel = defaultdict(Counter)  # nivel socioeconómico -> cargo -> empleados
+        self.cargos_empresa = defaultdict(Counter)  # empresa -> cargo -> empleados (distintos = len)
+
+    def _aplicar(self, df, signo):
+        """Suma (signo 1) o resta (-1) las filas a los agregados; las claves nulas no cuentan."""
+        if df.empty:
+            return
+        if len(df) <= MIN_FILAS_AGRUPAR:
+            return self._aplicar_filas(df, signo)
+        datos = _preparar(df)
+        for destino, clave in ((self.empresas, "empresa"), (self.provincias, "provincia")):
+            for valor, sumas in _grupos(datos, [clave], SUMAS):
+                _acumular(destino, valor, sumas, signo)
+        for empresa, (filas,) in _grupos(datos[datos["casado_40"]], ["empresa"], ["filas"]):
+            _sumar(self.casados_40, empresa, signo * filas)
+        for (nivel, cargo), (filas,) in _grupos(datos, ["nivel", "cargo"], ["filas"]):
+            _sumar(self.cargos_nivel[nivel], cargo, signo * filas)
+        for (empresa, cargo), (filas,) in _grupos(datos, ["empresa", "cargo"], ["filas"]):
+            _sumar(self.cargos_empresa[empresa], cargo, signo * filas)
+            if not self.cargos_empresa[empresa]:
+                del self.cargos_empresa[empresa]
+
+    def _aplicar_filas(self, df, signo):
+        """Lo mismo que `_aplicar`, fila a fila: para los pocos cambios de un refresco."""
+        columnas = ("nombre_empresa", "provincia", "nivel_socioeconomico", "cargo", "estado_civil",
+                    "salario_estimado", "edad")
+        for empresa, provincia, nivel, cargo, estado_civil, salario, edad in zip(*(df[c].tolist() for c in columnas)):
+            salario = None if pd.isna(salario) else float(salario)
+            edad = None if pd.isna(edad) else float(edad)
+            sumas = (salario or 0.0, salario is not None, edad or 0.0, edad is not None, 1)
+            if not pd.isna(empresa):
+                _acumular(self.empresas, empresa, sumas, signo)
+            if not pd.isna(provincia):
+                _acumular(self.provincias, provincia, sumas, signo)
+            if not pd.isna(empresa) and estado_civil == 'casado' and edad is not None and edad > 40:
+                _sumar(self.casados_40, empresa, signo)
+            if pd.isna(cargo):
+                continue
+            if not pd.isna(nivel):
+                _sumar(self.cargos_nivel[nivel], cargo, signo)
+            if not pd.isna(empresa):
+                _sumar(self.cargos_empresa[empresa], cargo, signo)
+                if not self.cargos_empresa[empresa]:
+                    del self.cargos_empresa[empresa]
+
+    def sincronizar(self):
+        """Aplica los cambios del almacén desde la última versión (o reconstruye si no hay)."""
+        with self._lock:
+            self._sincronizar()
+
+    def _sincronizar(self):
+        version, df, deltas = self.almacen.cambios_desde(TABLA, self.version)
+        if version == self.version:
+            return
+        if deltas is None:
+            self._vaciar()
+            self._aplicar(df, 1)
+            self.estadisticas["reconstrucciones"] += 1
+        else:
+            for quitadas, agregadas in deltas:
+                self._aplicar(quitadas, -1)
+                self._aplicar(agregadas, 1)
+                self.estadisticas["filas_aplicadas"] += len(quitadas) + len(agregadas)
+            self.estadisticas["actualizaciones"] += 1
+        self.version = version
+        self._textos = {}
+
+    def texto(self, max_empresas=None):
+        """Texto del resumen para el prompt; solo se regenera si la tabla cambió.
+
+        Con más de `max_empresas` empresas no se lista cada una (el prompt crecería sin
+        límite): se dan los rankings y el detalle queda para el índice de hechos.
+        """
+        with self._lock:
+            self._sincronizar()
+            por_empresa = max_empresas is None or len(self.empresas) <= max_empresas
+            if por_empresa not in self._textos:
+                self._textos[por_empresa] = self._redactar(por_empresa)
+            return self._textos[por_empresa]
+
+    def hechos_empresas(self, empresas=None):
+        """{empresa: frase con sus datos} de las empresas pedidas (todas si es None)."""
+        with self._lock:
+            self._sincronizar()
+            nombres = self.empresas if empresas is None else [e for e in empresas if e in self.empresas]
+            return {e: self._hecho_empresa(e) for e in nombres}
+
+    def _promedios(self, empresa):
+        suma_salario, n_salario, suma_edad, n_edad, _ = self.empresas[empresa]
+        salario = round(suma_salario / n_salario) if n_salario else float("nan")
+        edad = round(suma_edad / n_edad) if n_edad else float("nan")
+        return salario, edad
+
+    def _hecho_empresa(self, empresa):
+        salario, edad = self._promedios(empresa)
+        cargos = self.cargos_empresa.get(empresa, Counter())
+        texto = (f"{empresa}: {self.empresas[empresa][4]} empleados, salario promedio ${salario:,.0f}, "
+                 f"edad promedio {edad:.0f} años, {len(cargos)} cargos distintos")
+        if cargos:
+            texto += " (más comunes: " + ", ".join(str(c) for c, _ in _mas_comunes(cargos, 3)) + ")"
+        if self.casados_40.get(empresa):
+            texto += f", {self.casados_40[empresa]} empleados casados mayores de 40 años"
+        return texto
+
+    def _redactar(self, por_empresa=True):
+        if not self.empresas:
+            return "No hay datos de empleados para generar resúmenes."
+        if por_empresa:
+            resumen = ["\nSalario y edad promedio por empresa:"]
+            for empresa in sorted(self.empresas):
+                salario, edad = self._promedios(empresa)
+                resumen.append(f"- {empresa}: salario promedio ${salario:,.0f}, edad promedio {edad:.0f} años")
+        else:
+            por_salario = sorted(self.empresas, key=lambda e: (-(self._promedios(e)[0] if self.empresas[e][1] else 0), e))
+            por_empleados = sorted(self.empresas, key=lambda e: (-self.empresas[e][4], e))
+            resumen = [f"\nHay {len(self.empresas):,} empresas; los datos de cada una se incluyen junto a la "
+                       "pregunta cuando son relevantes.", "\nEmpresas con mayor salario promedio:"]
+            resumen.extend(f"- {e}: ${self._promedios(e)[0]:,.0f}" for e in por_salario[:MAX_RANKING_EMPRESAS])
+            resumen.append("\nEmpresas con más empleados:")
+            resumen.extend(f"- {e}: {self.empresas[e][4]}" for e in por_empleados[:MAX_RANKING_EMPRESAS])
+
+        if self.casados_40:
+            resumen.append("\nEmpresas con empleados casados y mayores de 40 años (ejemplos):")
+            resumen.extend(f"- {e}" for e, _ in _mas_comunes(self.casados_40, MAX_EMPRESAS_CASADOS))
+        else:
+            resumen.append("\nNo se encontraron empresas con un número significativo de empleados casados y mayores de 40 años.")
+
+        cargos = self.cargos_nivel.get(NIVEL_CARGOS)
+        if cargos:
+            resumen.append("\nCargos más comunes entre empleados de nivel socioeconómico medio-alto:")
+            resumen.extend(f"- {cargo}: {cantidad} empleados" for cargo, cantidad in _mas_comunes(cargos, MAX_CARGOS_NIVEL))
+        else:
+            resumen.append("\nNo se encontraron empleados de nivel socioeconómico medio-alto.")
+
+        provincias_altos = [p for p in sorted(self.provincias)
+                            if self.provincias[p][1] and self.provincias[p][0] / self.provincias[p][1] > SALARIO_PROVINCIA_ALTO]
+        if provincias_altos:
+            resumen.append("\nProvincias con salario promedio mayor a $2500:")
+            resumen.extend(f"- {p}" for p in provincias_altos)
+        else:
+            resumen.append("\nNinguna provincia tiene un salario promedio mayor a $2500 según los datos.")
+
+        if self.cargos_empresa:
+            top_empresa = max(sorted(self.cargos_empresa), key=lambda e: len(self.cargos_empresa[e]))
+            resumen.append(f"\nEmpresa con mayor diversidad de cargos: {top_empresa} "
+                           f"({len(self.cargos_empresa[top_empresa])} cargos únicos)")
+        else:
+            resumen.append("\nNo se pudo determinar la empresa con mayor diversidad de cargos.")
+        return "\n".join(resumen)
+
+
+_resumenes = {}
+_lock = threading.Lock()
+
+
+def obtener_resumen(almacen):
+    """Resumen compartido por las sesiones que usan el mismo almacén."""
+    with _lock:
+        if id(almacen) not in _resumenes:
+            _resumenes[id(almacen)] = ResumenEmpleados(almacen)
+        return _resumenes[id(almacen)]
@@ -0,0 +1,144 @@
+# === Servidor /api/chat de prueba (sustituto local de Ollama) ===
+# Responde con el mismo formato que Ollama (NDJSON en streaming o JSON completo) y
+# con una latencia por token configurable, sin GPU ni modelo. Las peticiones de SQL
+# reciben un SQL "enlatado" válido para el esquema dbseguro, elegido por palabras clave
+# de la pregunta; el resto reciben un texto de recomendación de longitud fija.
+#
+# Uso independiente:
+#   python stub_ollama.py --puerto 11435 --latencia-token 0.02
+#   OLLAMA_URL=http://localhost:11435 streamlit run main.py
+
+import argparse
+import json
+import threading
+import time
+import unicodedata
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# (palabras clave, SQL): se usa la primera entrada cuyas palabras aparezcan todas
+SQL_ENLATADO = [
+    (("pago",), "SELECT estado_pago, SUM(monto_pagado) AS total_pagado FROM pagos_siniestros GROUP BY estado_pago;"),
+    (("evaluacion",), "SELECT id_perito, AVG(puntaje_fraude) AS puntaje_medio FROM evaluaciones_siniestro GROUP BY id_perito ORDER BY puntaje_medio DESC LIMIT 20;"),
+    (("siniestro", "mes"), "SELECT DATE_FORMAT(fecha_siniestro, '%Y-%m') AS anio_mes, COUNT(id_siniestro) AS cantidad FROM siniestros GROUP BY anio_mes ORDER BY anio_mes;"),
+    (("siniestro",), "SELECT gravedad, COUNT(id_siniestro) AS cantidad FROM siniestros GROUP BY gravedad;"),
+    (("poliza", "producto"), "SELECT pr.tipo_seguro, COUNT(p.id_poliza) AS cantidad FROM polizas p JOIN productos pr ON p.id_producto = pr.id_producto GROUP BY pr.tipo_seguro;"),
+    (("poliza",), "SELECT estado, COUNT(id_poliza) AS cantidad FROM polizas GROUP BY estado;"),
+    (("producto",), "SELECT tipo_seguro, AVG(deducible) AS deducible_medio FROM productos GROUP BY tipo_seguro;"),
+    (("listado",), "SELECT id_afiliado, nombre, provincia, ciudad, fecha_afiliacion FROM afiliados;"),
+    ((), "SELECT provincia, COUNT(id_afiliado) AS cantidad FROM afiliados GROUP BY provincia;"),
+]
+TEXTO_RECOMENDACION = ("Conviene revisar la concentración de casos en las categorías con mayor volumen y "
+                       "priorizar controles preventivos allí. También se recomienda seguir la evolución "
+                       "mensual para detectar cambios de tendencia a tiempo.")
+
+
+def _normalizar(texto):
+    texto = unicodedata.normalize("NFKD", texto.lower())
+    return "".join(c for c in texto if not unicodedata.combining(c))
+
+
+def sql_para(pregunta):
+    pregunta = _normalizar(pregunta)
+    for palabras, sql in SQL_ENLATADO:
+        if all(p in pregunta for p in palabras):
+            return sql
+    return SQL_ENLATADO[-1][1]
+
+
+def _trozos(texto, caracteres_por_token=4):
+    return [texto[i:i + caracteres_por_token] for i in range(0, len(texto), caracteres_por_token)] or [""]
+
+
+class _Manejador(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive, como Ollama
+
+    def log_message(self, formato, *args):
+        pass
+
+    def _enviar_json(self, datos):
+        cuerpo = json.dumps(datos).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def do_POST(self):
+        if self.path != "/api/chat":
+            self.send_error(404)
+            return
+        longitud = int(self.headers.get("Content-Length", 0))
+        payload = json.loads(self.rfile.read(longitud) or b"{}")
+        servidor = self.server
+        mensajes = payload.get("messages") or []
+        with servidor.lock:
+            servidor.peticiones += 1
+
+        prompt = "".join(m.get("content", "") for m in mensajes)
+        ultimo = mensajes[-1]["content"] if mensajes else ""
+        if not mensajes:
+            texto = ""  # Precalentamiento: solo carga el "modelo"
+        elif "Pregunta:" in ultimo:
+            texto = sql_para(ultimo.rsplit("Pregunta:", 1)[1])  # Sin prefijo estable el esquema va delante
+        else:
+            texto = TEXTO_RECOMENDACION
+        tokens = _trozos(texto) if texto else []
+        base = {"model": payload.get("model"), "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ")}
+        inicio = time.perf_counter()
+
+        def final():
+            return {**base, "message": {"role": "assistant", "content": ""}, "done": True,
+                    "prompt_eval_count": len(prompt) // 4, "prompt_eval_duration": int(servidor.latencia_primer_token * 1e9),
+                    "eval_count": len(tokens), "eval_duration": int((time.perf_counter() - inicio) * 1e9) or 1,
+                    "load_duration": 0}
+
+        if tokens:
+            time.sleep(servidor.latencia_primer_token)
+        if not payload.get("stream", True):
+            time.sleep(servidor.latencia_token * len(tokens))
+            datos = final()
+            datos["message"]["content"] = texto
+            self._enviar_json(datos)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def escribir(datos):
+            linea = (json.dumps(datos) + "\n").encode("utf-8")
+            self.wfile.write(f"{len(linea):X}\r\n".encode() + linea + b"\r\n")
+
+        for token in tokens:
+            escribir({**base, "message": {"role": "assistant", "content": token}, "done": False})
+            time.sleep(servidor.latencia_token)
+        escribir(final())
+        self.wfile.write(b"0\r\n\r\n")
+
+
+def iniciar(puerto=0, latencia_token=0.01, latencia_primer_token=0.05):
+    """Arranca el servidor en un hilo y lo devuelve; su URL queda en `servidor.url`."""
+    servidor = ThreadingHTTPServer(("127.0.0.1", puerto), _Manejador)
+    servidor.daemon_threads = True
+    servidor.latencia_token = latencia_token
+    servidor.latencia_primer_token = latencia_primer_token
+    servidor.peticiones = 0
+    servidor.lock = threading.Lock()
+    servidor.url = f"http://127.0.0.1:{servidor.server_address[1]}"
+    threading.Thread(target=servidor.serve_forever, daemon=True, name="stub-ollama").start()
+    return servidor
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Servidor /api/chat de prueba")
+    parser.add_argument("--puerto", type=int, default=11435)
+    parser.add_argument("--latencia-token", type=float, default=0.01, help="Segundos por token generado")
+    parser.add_argument("--latencia-primer-token", type=float, default=0.05, help="Segundos hasta el primer token")
+    args = parser.parse_args()
+    servidor = iniciar(args.puerto, args.latencia_token, args.latencia_primer_token)
+    print(f"Stub de Ollama escuchando en {servidor.url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        servidor.shutdown()
@@ -0,0 +1,267 @@
+# === Trazas por etapa (tiempos de cada pregunta) ===
+# Cada pregunta abre una "traza" y cada etapa (generar SQL, llamada al LLM, ejecución,
+# conversión de fechas, gráfico, recomendación, exportación...) un "tramo" con su
+# duración y atributos (filas, bytes, tokens...). Los tramos se envían a:
+#   - un log JSONL rotativo (una línea por tramo), para analizar después;
+#   - métricas agregadas en formato de texto de Prometheus, en un archivo y, si se
+#     define PUERTO_METRICAS, también servidas en http://<host>:<puerto>/metrics;
+#   - la propia traza, que la interfaz muestra en el panel "⏱ Diagnóstico".
+#
+# La traza activa viaja en una contextvar: pipeline.py copia el contexto al enviar
+# trabajo a los workers, así los tramos de etapas en paralelo caen en la misma traza.
+
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from logging.handlers import RotatingFileHandler
+
+RUTA_JSONL = os.environ.get("TRAZAS_JSONL", "trazas.jsonl")
+RUTA_PROMETHEUS = os.environ.get("TRAZAS_PROMETHEUS", "metricas.prom")
+MAX_BYTES_JSONL = 10 * 1024 * 1024
+ARCHIVOS_JSONL = 5
+INTERVALO_PROMETHEUS = 1.0  # Segundos mínimos entre reescrituras del archivo .prom
+PREFIJO_METRICAS = "dwconsulware"
+LIMITES_HISTOGRAMA = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_traza_actual = contextvars.ContextVar("traza_actual", default=None)
+_tramo_actual = contextvars.ContextVar("tramo_actual", default=None)
+
+
+class Traza:
+    """Tramos de una misma pregunta (se van añadiendo también desde los workers)."""
+
+    def __init__(self, nombre, **atributos):
+        self.id = uuid.uuid4().hex[:16]
+        self.nombre = nombre
+        self.atributos = atributos
+        self.inicio = time.time()
+        self._tramos = []
+        self._lock = threading.Lock()
+
+    def agregar(self, tramo):
+        with self._lock:
+            self._tramos.append(tramo)
+
+    def tramos(self):
+        """Copia de los tramos ordenados por inicio."""
+        with self._lock:
+            return sorted(self._tramos, key=lambda t: t["desde_inicio_ms"])
+
+    def duracion_ms(self):
+        tramos = self.tramos()
+        if not tramos:
+            return 0.0
+        return max(t["desde_inicio_ms"] + t["duracion_ms"] for t in tramos)
+
+
+# --- Destinos ---
+_log_jsonl = logging.getLogger("trazas.jsonl")
+_log_jsonl.propagate = False
+_lock_configuracion = threading.Lock()
+
+
+def _configurar_log():
+    with _lock_configuracion:
+        if _log_jsonl.handlers:
+            return
+        try:
+            manejador = RotatingFileHandler(RUTA_JSONL, maxBytes=MAX_BYTES_JSONL, backupCount=ARCHIVOS_JSONL,
+                                            encoding="utf-8")
+        except OSError:
+            manejador = logging.NullHandler()  # Sin permisos de escritura: solo métricas y panel
+        manejador.setFormatter(logging.Formatter("%(message)s"))
+        _log_jsonl.addHandler(manejador)
+        _log_jsonl.setLevel(logging.INFO)
+
+
+class _Metricas:
+    """Histograma de duración y suma de atributos numéricos por tramo."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histogramas = {}  # tramo -> [cubetas..., suma, cuenta]
+        self._errores = {}
+        self._atributos = {}  # (tramo, atributo) -> suma
+        self._ultima_escritura = 0.0
+
+    def observar(self, tramo):
+        segundos = tramo["duracion_ms"] / 1000
+        nombre = tramo["tramo"]
+        with self._lock:
+            h = self._histogramas.setdefault(nombre, [0] * len(LIMITES_HISTOGRAMA) + [0.0, 0])
+            for i, limite in enumerate(LIMITES_HISTOGRAMA):
+                if segundos <= limite:
+                    h[i] += 1
+            h[-2] += segundos
+            h[-1] += 1
+            if tramo.get("error"):
+                self._errores[nombre] = self._errores.get(nombre, 0) + 1
+            for clave, valor in tramo["atributos"].items():
+                if isinstance(valor, (int, float)) and not isinstance(valor, bool):
+                    self._atributos[(nombre, clave)] = self._atributos.get((nombre, clave), 0) + valor
+
+    def texto(self):
+        p = PREFIJO_METRICAS
+        lineas = [f"# HELP {p}_tramo_segundos Duración de cada etapa.", f"# TYPE {p}_tramo_segundos histogram"]
+        with self._lock:
+            for nombre, h in sorted(self._histogramas.items()):
+                for limite, cuenta in zip(LIMITES_HISTOGRAMA, h):
+                    lineas.append(f'{p}_tramo_segundos_bucket{{tramo="{nombre}",le="{limite}"}} {cuenta}')
+                lineas.append(f'{p}_tramo_segundos_bucket{{tramo="{nombre}",le="+Inf"}} {h[-1]}')
+                lineas.append(f'{p}_tramo_segundos_sum{{tramo="{nombre}"}} {h[-2]:.6f}')
+                lineas.append(f'{p}_tramo_segundos_count{{tramo="{nombre}"}} {h[-1]}')
+            lineas += [f"# HELP {p}_tramo_errores_total Etapas que terminaron con excepción.",
+                       f"# TYPE {p}_tramo_errores_total counter"]
+            for nombre, cuenta in sorted(self._errores.items()):
+                lineas.append(f'{p}_tramo_errores_total{{tramo="{nombre}"}} {cuenta}')
+            lineas += [f"# HELP {p}_tramo_atributo_total Suma de los atributos numéricos (filas, bytes, tokens...).",
+                       f"# TYPE {p}_tramo_atributo_total counter"]
+            for (nombre, clave), suma in sorted(self._atributos.items()):
+                lineas.append(f'{p}_tramo_atributo_total{{tramo="{nombre}",atributo="{clave}"}} {suma}')
+        return "\n".join(lineas) + "\n"
+
+    def escribir(self, forzar=False):
+        ahora = time.monotonic()
+        with self._lock:
+            if not forzar and ahora - self._ultima_escritura < INTERVALO_PROMETHEUS:
+                return
+            self._ultima_escritura = ahora
+        try:
+            temporal = RUTA_PROMETHEUS + ".tmp"
+            with open(temporal, "w", encoding="utf-8") as f:
+                f.write(self.texto())
+            os.replace(temporal, RUTA_PROMETHEUS)
+        except OSError:
+            pass
+
+
+metricas = _Metricas()
+
+
+def _registrar(traza, tramo):
+    if traza is not None:
+        tramo["traza"] = traza.id
+        tramo["desde_inicio_ms"] = round((tramo["inicio"] - traza.inicio) * 1000, 2)
+        traza.agregar(tramo)
+    else:
+        tramo["traza"] = None
+        tramo["desde_inicio_ms"] = 0.0
+    _configurar_log()
+    _log_jsonl.info(json.dumps({**tramo, "inicio": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(tramo["inicio"]))
+                                + f".{int(tramo['inicio'] % 1 * 1000):03d}"}, ensure_ascii=False, default=str))
+    metricas.observar(tramo)
+    metricas.escribir()
+
+
+# --- API ---
+def iniciar_traza(nombre, **atributos):
+    """Crea una traza y la deja activa en el contexto actual."""
+    traza = Traza(nombre, **atributos)
+    _traza_actual.set(traza)
+    return traza
+
+
+def traza_actual():
+    return _traza_actual.get()
+
+
+def establecer(traza):
+    """Deja `traza` (o None) como activa; Streamlit la recupera así de la sesión en cada rerun."""
+    _traza_actual.set(traza)
+
+
+@contextmanager
+def activar(traza):
+    """Activa `traza` en un hilo que no la heredó (p. ej. el callback de descarga)."""
+    token = _traza_actual.set(traza)
+    try:
+        yield traza
+    finally:
+        _traza_actual.reset(token)
+
+
+@contextmanager
+def tramo(nombre, **atributos):
+    """Mide el bloque; los atributos se pueden completar dentro: `with tramo("x") as t: t["filas"] = n`."""
+    padre = _tramo_actual.get()
+    datos = {"tramo": nombre, "padre": padre, "atributos": dict(atributos), "error": None}
+    token = _tramo_actual.set(nombre)
+    inicio = time.time()
+    inicio_perf = time.perf_counter()
+    try:
+        yield datos["atributos"]
+    except Exception as e:
+        datos["error"] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        datos["duracion_ms"] = round((time.perf_counter() - inicio_perf) * 1000, 2)
+        datos["inicio"] = inicio
+        _tramo_actual.reset(token)
+        _registrar(_traza_actual.get(), datos)
+
+
+def registrar_tramo(nombre, segundos, **atributos):
+    """Registra una etapa ya medida por otro componente (termina ahora y duró `segundos`)."""
+    _registrar(_traza_actual.get(), {
+        "tramo": nombre, "padre": _tramo_actual.get(), "atributos": atributos, "error": None,
+        "duracion_ms": round(segundos * 1000, 2), "inicio": time.time() - segundos,
+    })
+
+
+# --- Endpoint /metrics ---
+_servidor_metricas = None
+
+
+class _ManejadorMetricas(BaseHTTPRequestHandler):
+    def log_message(self, formato, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.rstrip("/") not in ("/metrics", ""):
+            self.send_error(404)
+            return
+        cuerpo = metricas.texto().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+
+def iniciar_servidor_metricas(puerto=None):
+    """Sirve /metrics una vez por proceso si hay puerto (argumento o PUERTO_METRICAS)."""
+    global _servidor_metricas
+    puerto = puerto or os.environ.get("PUERTO_METRICAS")
+    if not puerto:
+        return None
+    with _lock_configuracion:
+        if _servidor_metricas is None:
+            try:
+                _servidor_metricas = ThreadingHTTPServer(("0.0.0.0", int(puerto)), _ManejadorMetricas)
+            except OSError:
+                return None  # Puerto ocupado (p. ej. la otra app ya lo sirve en este proceso)
+            _servidor_metricas.daemon_threads = True
+            threading.Thread(target=_servidor_metricas.serve_forever, daemon=True, name="metricas").start()
+    return _servidor_metricas
+
+
+# --- Presentación ---
+def tabla_tramos(traza):
+    """Filas para el panel de diagnóstico: etapa, inicio relativo, duración y atributos."""
+    filas = []
+    for t in traza.tramos():
+        atributos = ", ".join(f"{k}={v:,.3f}" if isinstance(v, float) else f"{k}={v}"
+                              for k, v in t["atributos"].items() if v is not None)
+        filas.append({
+            "Etapa": ("  └ " if t["padre"] else "") + t["tramo"],
+            "Inicio (ms)": t["desde_inicio_ms"],
+            "Duración (ms)": t["duracion_ms"],
+            "Detalle": atributos + (f" · ERROR {t['error']}" if t["error"] else ""),
+        })
+    return filas